@@ -0,0 +1,278 @@
+"""
+Бенчмарк основных эндпоинтов API на синтетическом наборе данных.
+
+Каталог ингредиентов загружается из data/ingredients.csv, остальные
+данные создает команда seed_foodgram. Запросы выполняются через
+тестовый клиент, для каждого сценария фиксируются p50/p95,
+число SQL-запросов и пиковая память. Результаты пишутся в JSON
+и сравниваются с сохраненным эталоном:
+
+    python -m benchmarks.api
+    python -m benchmarks.api --output results.json
+    python -m benchmarks.api --write-baseline
+
+Регрессией считается рост числа запросов или рост p50 больше
+допуска --tolerance (и больше --min-delta миллисекунд, чтобы
+не реагировать на шум). При регрессиях код выхода равен 1.
+"""
+import argparse
+import base64
+import io
+import json
+import platform
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+DATA_FILE = Path(__file__).resolve().parents[2] / 'data' / 'ingredients.csv'
+BASELINE_FILE = Path(__file__).resolve().parent / 'baseline_api.json'
+
+
+def make_image():
+    """Изображение рецепта в формате base64."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (100, 100), color='red').save(buffer, format='JPEG')
+    return f'data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode()}'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--recipes', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Число повторов каждого сценария')
+    parser.add_argument('--output', type=Path,
+                        help='Куда записать результаты в JSON')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE,
+                        help='Эталон для сравнения')
+    parser.add_argument('--write-baseline', action='store_true',
+                        help='Сохранить результаты как новый эталон')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Допустимый относительный рост p50')
+    parser.add_argument('--min-delta', type=float, default=2.0,
+                        help='Минимальный рост p50 в мс, считающийся регрессией')
+    return parser.parse_args(argv)
+
+
+def seed(options):
+    from django.core.management import call_command
+    from django.db.models import Count
+
+    from recipes.ingredient_import import IngredientImporter
+    from users.models import User
+
+    IngredientImporter(batch_size=5000).run(str(DATA_FILE), 'csv', force=True)
+    call_command(
+        'seed_foodgram', users=options.users, recipes=options.recipes,
+        seed=options.seed, stdout=io.StringIO()
+    )
+    # Самый активный пользователь: больше всего рецептов в корзине
+    return User.objects.annotate(
+        cart_size=Count('shopping_cart', distinct=True)
+    ).order_by('-cart_size', 'id').first()
+
+
+def build_scenarios(user):
+    """Возвращает список пар (имя, функция) для измерения."""
+    from rest_framework.test import APIClient
+
+    from recipes.models import Ingredient, Recipe, ShortLink, Tag
+    from users.models import Subscription
+
+    anonymous = APIClient()
+    client = APIClient()
+    client.force_authenticate(user)
+
+    recipe = Recipe.objects.order_by('-created', '-id').first()
+    own_recipe = Recipe.objects.filter(author=user).first() or Recipe.objects.create(
+        author=user, name='Рецепт бенчмарка', text='Описание',
+        image='recipes/images/seed.png', cooking_time=10
+    )
+    author_id = Subscription.objects.filter(
+        user=user, author__recipes__isnull=False
+    ).values_list('author_id', flat=True).first() or recipe.author_id
+    tag_slugs = list(Tag.objects.values_list('slug', flat=True)[:2])
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True)[:3])
+    pantry_ids = list(recipe.recipe_ingredients.values_list('ingredient_id', flat=True))
+    tag_id = Tag.objects.values_list('id', flat=True).first()
+    untouched = Recipe.objects.exclude(
+        favorited_by__user=user
+    ).exclude(in_shopping_carts__user=user)
+    toggled = untouched.first()
+    batch_ids = list(untouched.values_list('id', flat=True)[:10])
+    short_link = ShortLink.objects.create(recipe=recipe, short_id='bench1')
+    image = make_image()
+
+    def get(api_client, url, params=None, expected=200):
+        def run():
+            response = api_client.get(url, params)
+            assert response.status_code == expected, (url, response.status_code)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        return run
+
+    def toggle(action):
+        url = f'/api/recipes/{toggled.id}/{action}/'
+
+        def run():
+            assert client.post(url).status_code == 201
+            assert client.delete(url).status_code == 204
+        return run
+
+    def toggle_batch(action):
+        url = f'/api/recipes/{action}/'
+        payload = {'recipes': batch_ids}
+
+        def run():
+            assert client.post(url, payload, format='json').status_code == 200
+            assert client.delete(url, payload, format='json').status_code == 200
+        return run
+
+    def recipe_payload(amount):
+        return {
+            'name': 'Рецепт бенчмарка',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': image,
+            'tags': [tag_id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': amount + index}
+                for index, ingredient_id in enumerate(ingredient_ids)
+            ],
+        }
+
+    def create():
+        response = client.post(
+            '/api/recipes/', recipe_payload(100), format='json'
+        )
+        assert response.status_code == 201, response.data
+        Recipe.objects.filter(id=response.data['id']).delete()
+
+    amounts = iter(range(1, 10 ** 6))
+
+    def update():
+        response = client.patch(
+            f'/api/recipes/{own_recipe.id}/',
+            recipe_payload(next(amounts)), format='json'
+        )
+        assert response.status_code == 200, response.data
+
+    return [
+        ('recipes list (anonymous)', get(anonymous, '/api/recipes/')),
+        ('recipes list (authenticated)', get(client, '/api/recipes/')),
+        ('recipes list ?author', get(client, '/api/recipes/', {'author': author_id})),
+        ('recipes list ?tags', get(client, '/api/recipes/', {'tags': tag_slugs})),
+        ('recipes list ?is_favorited', get(client, '/api/recipes/', {'is_favorited': 1})),
+        ('recipes list ?is_in_shopping_cart',
+         get(client, '/api/recipes/', {'is_in_shopping_cart': 1})),
+        ('recipes list ?search', get(client, '/api/recipes/', {'search': 'рецепт 42'})),
+        ('recipes list ?ordering=trending',
+         get(anonymous, '/api/recipes/', {'ordering': 'trending'})),
+        ('recipes list ?pagination=cursor',
+         get(client, '/api/recipes/', {'pagination': 'cursor'})),
+        ('recipes list page 50', get(anonymous, '/api/recipes/', {'page': 50})),
+        ('recipe detail (anonymous)', get(anonymous, f'/api/recipes/{recipe.id}/')),
+        ('recipe similar', get(anonymous, f'/api/recipes/{recipe.id}/similar/')),
+        ('recipes pantry',
+         get(anonymous, '/api/recipes/pantry/', {'ingredients': pantry_ids})),
+        ('recipe detail (authenticated)', get(client, f'/api/recipes/{recipe.id}/')),
+        ('recipe create', create),
+        ('recipe update', update),
+        ('favorite add+remove', toggle('favorite')),
+        ('shopping_cart add+remove', toggle('shopping_cart')),
+        ('shopping_cart batch add+remove (10)', toggle_batch('shopping_cart')),
+        ('download_shopping_cart txt',
+         get(client, '/api/recipes/download_shopping_cart/', {'format': 'txt'})),
+        ('download_shopping_cart json',
+         get(client, '/api/recipes/download_shopping_cart/', {'format': 'json'})),
+        ('subscriptions', get(client, '/api/users/subscriptions/', {'recipes_limit': 3})),
+        ('recipes feed', get(client, '/api/recipes/feed/')),
+        ('ingredients ?name', get(anonymous, '/api/ingredients/', {'name': 'мол'})),
+        ('ingredients ?name&fuzzy',
+         get(anonymous, '/api/ingredients/', {'name': 'малако', 'fuzzy': 1})),
+        ('short link redirect',
+         get(anonymous, f'/s/{short_link.short_id}/', expected=302)),
+    ]
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Возвращает строки отчета и список регрессий."""
+    rows = []
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            rows.append((name, stats, 'new'))
+            continue
+        problems = []
+        if stats['queries'] > reference['queries']:
+            problems.append(f"queries {reference['queries']}->{stats['queries']}")
+        delta = stats['p50_ms'] - reference['p50_ms']
+        if delta > min_delta and delta > reference['p50_ms'] * tolerance:
+            problems.append(f"p50 {reference['p50_ms']}->{stats['p50_ms']}ms")
+        if problems:
+            regressions.append(f"{name}: {', '.join(problems)}")
+            rows.append((name, stats, 'REGRESSION'))
+        else:
+            rows.append((name, stats, f'{delta:+.2f}ms'))
+    return rows, regressions
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    with benchmark_database() as connection:
+        from django.test import override_settings
+
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            user = seed(options)
+            results = {
+                name: measure(func, repeat=options.repeat)
+                for name, func in build_scenarios(user)
+            }
+        vendor = connection.vendor
+
+    report = {
+        'meta': {
+            'users': options.users,
+            'recipes': options.recipes,
+            'seed': options.seed,
+            'repeat': options.repeat,
+            'database': vendor,
+            'python': platform.python_version(),
+        },
+        'results': results,
+    }
+    if options.output:
+        options.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if options.write_baseline:
+        options.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f'Эталон сохранен в {options.baseline}')
+
+    baseline = {}
+    if options.baseline.exists() and not options.write_baseline:
+        stored = json.loads(options.baseline.read_text())
+        if stored['meta'] != report['meta']:
+            print('Параметры эталона отличаются, сравнение приблизительное')
+        baseline = stored['results']
+
+    rows, regressions = compare(
+        results, baseline, options.tolerance, options.min_delta
+    )
+    print(f"Данные: {options.users} пользователей, {options.recipes} рецептов")
+    print_table(rows, extra_columns=('vs baseline',))
+    if regressions:
+        print('\nРегрессии:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Общие утилиты бенчмарков.
+
+Бенчмарки запускаются из каталога backend как модули, например:
+
+    python -m benchmarks.shopping_cart
+
+и работают на отдельной тестовой базе, которая создается
+и удаляется автоматически.
+"""
+import os
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+
+@contextmanager
+def benchmark_database():
+    """Создает тестовую базу на время бенчмарка."""
+    django.setup()
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment, teardown_test_environment
+    )
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, repeat=10):
+    """
+    Выполняет func repeat раз и возвращает статистику:
+    p50/p95 в миллисекундах, пиковую память в КиБ и число SQL-запросов
+    последнего запуска.
+
+    tracemalloc заметно замедляет каждое выделение памяти, поэтому
+    время меряется без него, а пиковая память — отдельным запуском.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'peak_kib': round(peak / 1024, 1),
+        'queries': queries,
+    }
+
+
+def print_table(rows, extra_columns=()):
+    """
+    Печатает результаты в виде выровненной таблицы. Строка — (name, stats)
+    и значения дополнительных колонок extra_columns, если они заданы.
+    """
+    keys = ('p50_ms', 'p95_ms', 'peak_kib', 'queries')
+    header = ('name',) + keys + tuple(extra_columns)
+    lines = [header] + [
+        (name,) + tuple(str(stats[key]) for key in keys)
+        + tuple(str(value) for value in extra)
+        for name, stats, *extra in rows
+    ]
+    widths = [max(len(line[index]) for line in lines) for index in range(len(header))]
+    for line in lines:
+        print('  '.join(value.ljust(width) for value, width in zip(line, widths)))
@@ -0,0 +1,66 @@
+"""
+Бенчмарк автодополнения ингредиентов.
+
+Загружает каталог из data/ingredients.csv и сравнивает поиск
+по префиксу через ORM (name__istartswith + сериализация)
+с индексом в памяти процесса.
+
+    python -m benchmarks.ingredient_search
+"""
+import csv
+from pathlib import Path
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+DATA_FILE = Path(__file__).resolve().parents[2] / 'data' / 'ingredients.csv'
+PREFIXES = ('м', 'мол', 'сах', 'карто', 'xyz')
+
+
+def seed():
+    from recipes.models import Ingredient
+
+    with open(DATA_FILE, encoding='utf-8') as file:
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in csv.reader(file)
+            ),
+            ignore_conflicts=True
+        )
+    return Ingredient.objects.count()
+
+
+def main():
+    with benchmark_database():
+        from django.conf import settings
+
+        from recipes.ingredient_index import ingredient_index
+        from recipes.models import Ingredient
+        from recipes.serializers import IngredientSerializer
+        from recipes.versions import INGREDIENTS, bump_version
+
+        total = seed()
+        bump_version(INGREDIENTS)
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+
+        def orm(prefix):
+            return lambda: IngredientSerializer(
+                Ingredient.objects.filter(name__istartswith=prefix)[:limit],
+                many=True
+            ).data
+
+        def index(prefix):
+            return lambda: ingredient_index.search(prefix, limit)
+
+        rows = [('index build', measure(
+            lambda: (bump_version(INGREDIENTS), index('м')()), repeat=5
+        ))]
+        for prefix in PREFIXES:
+            rows.append((f'orm   "{prefix}"', measure(orm(prefix), repeat=50)))
+            rows.append((f'index "{prefix}"', measure(index(prefix), repeat=50)))
+        print(f'Каталог: {total} ингредиентов, лимит {limit}')
+        print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
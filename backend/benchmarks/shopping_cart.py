@@ -0,0 +1,110 @@
+"""
+Бенчмарк скачивания списка покупок.
+
+Корзина из 500 рецептов по 10 ингредиентов из каталога в 200 позиций.
+Сравнивает потоковое чтение материализованного списка по каждому
+формату, эталонную агрегацию в БД и прежнюю реализацию,
+суммировавшую строки в Python.
+
+    python -m benchmarks.shopping_cart
+"""
+import random
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+RECIPES = 500
+INGREDIENTS = 200
+INGREDIENTS_PER_RECIPE = 10
+
+
+def seed():
+    from recipes.models import Ingredient, Recipe, RecipeIngredient, ShoppingCart
+    from recipes.shopping_list import rebuild_shopping_lists
+    from users.models import User
+
+    rng = random.Random(42)
+    user = User.objects.create_user(
+        username='bench', email='bench@example.com',
+        first_name='Bench', last_name='User', password='bench-password'
+    )
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+        for index in range(INGREDIENTS)
+    )
+    recipes = Recipe.objects.bulk_create(
+        Recipe(
+            author=user, name=f'Рецепт {index}', text='Описание',
+            image='recipes/images/bench.png', cooking_time=10
+        )
+        for index in range(RECIPES)
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                         amount=rng.randint(1, 500))
+        for recipe in recipes
+        for ingredient in rng.sample(ingredients, INGREDIENTS_PER_RECIPE)
+    )
+    ShoppingCart.objects.bulk_create(
+        ShoppingCart(user=user, recipe=recipe) for recipe in recipes
+    )
+    rebuild_shopping_lists([user.id])
+    return user
+
+
+def legacy_download(user):
+    """Прежняя реализация: все строки в Python и конкатенация строк."""
+    from recipes.models import RecipeIngredient
+
+    shopping_cart_recipes = user.shopping_cart.values_list('recipe', flat=True)
+    ingredients_dict = {}
+    for recipe_ingredient in RecipeIngredient.objects.filter(
+        recipe__in=shopping_cart_recipes
+    ).select_related('ingredient'):
+        ingredient = recipe_ingredient.ingredient
+        key = f"{ingredient.name} ({ingredient.measurement_unit})"
+        ingredients_dict[key] = (
+            ingredients_dict.get(key, 0) + recipe_ingredient.amount
+        )
+    shopping_list = "Список покупок:\n\n"
+    for ingredient_info, amount in ingredients_dict.items():
+        shopping_list += f"• {ingredient_info} — {amount}\n"
+    return shopping_list
+
+
+def main():
+    with benchmark_database():
+        from rest_framework.test import APIClient
+
+        from recipes.shopping_list import compute_shopping_list_totals
+
+        user = seed()
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def download(file_format):
+            def run():
+                response = client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': file_format}
+                )
+                assert response.status_code == 200, response.status_code
+                for _ in response.streaming_content:
+                    pass
+            return run
+
+        rows = [
+            ('legacy (python sum)', measure(lambda: legacy_download(user))),
+            ('db aggregate (sum)', measure(
+                lambda: compute_shopping_list_totals([user.id])
+            )),
+        ]
+        rows += [
+            (f'download format={file_format}', measure(download(file_format)))
+            for file_format in ('txt', 'csv', 'json')
+        ]
+        print(f'Корзина: {RECIPES} рецептов x {INGREDIENTS_PER_RECIPE} ингредиентов')
+        print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,5 +18,11 @@ ls -la /app
 echo "Importing ingredients..."
 python manage.py import_ingredients --json --path=/app/data/ingredients.json
 
+echo "Preparing metrics directory..."
+# Воркеры gunicorn складывают сюда снимки метрик для /metrics
+export METRICS_MULTIPROC_DIR="${METRICS_MULTIPROC_DIR:-/tmp/foodgram-metrics}"
+rm -rf "$METRICS_MULTIPROC_DIR"
+mkdir -p "$METRICS_MULTIPROC_DIR"
+
 echo "Starting Gunicorn server..."
 exec gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
@@ -0,0 +1,32 @@
+"""Определение эндпоинта, обработавшего запрос."""
+
+
+def resolve_endpoint(request):
+    """
+    Возвращает (владелец, действие, имя) для обработчика запроса.
+
+    Для ViewSet владелец — класс view, действие — имя действия DRF,
+    для страниц админки — экземпляр ModelAdmin и имя его view
+    (changelist, change и т.п.). Для view-функций владелец — сама
+    функция, действие None.
+    """
+    match = request.resolver_match
+    if match is None:
+        return None, None, None
+    view = match.func
+
+    model_admin = getattr(view, 'model_admin', None)
+    if model_admin is not None:
+        opts = model_admin.model._meta
+        action = (match.url_name or '').removeprefix(
+            f'{opts.app_label}_{opts.model_name}_'
+        )
+        return model_admin, action, f'{type(model_admin).__name__}.{action}'
+
+    owner = getattr(view, 'cls', None)
+    if owner is None:
+        return view, None, match.view_name
+    actions = getattr(view, 'actions', None) or {}
+    method = request.method.lower()
+    action = actions.get(method, method)
+    return owner, action, f'{owner.__name__}.{action}'
@@ -0,0 +1,376 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Значения каждой метрики хранятся по потокам: поток пишет только
+в свой словарь, поэтому на горячем пути нет общих блокировок.
+Блокировка берется один раз при первом обращении потока к метрике
+и при сборе значений.
+
+Несколько воркеров gunicorn: если задан settings.METRICS_MULTIPROC_DIR,
+каждый процесс периодически (METRICS_FLUSH_INTERVAL секунд), при
+завершении и перед ответом на /metrics записывает снимок своих метрик
+в файл <pid>-<uuid>.json этого каталога: uuid выбирается при первой
+записи в процессе, поэтому новый воркер с pid завершившегося не
+затирает его снимок. Ответ /metrics складывает снимки всех процессов:
+счетчики и гистограммы завершившихся воркеров сохраняются, значения
+gauge берутся только у живых процессов.
+Каталог нужно очищать при старте сервиса.
+"""
+import atexit
+import bisect
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from foodgram.endpoints import resolve_endpoint
+from foodgram.profiling import current_profile
+
+logger = logging.getLogger('foodgram.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Прочие методы попадают в метку other, чтобы не плодить ряды
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Metric:
+    """Базовый класс метрики с потоковыми шардами значений."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def collect(self):
+        """Сумма значений всех потоков: {labels: value}."""
+        with self._lock:
+            shards = [dict(shard) for shard in self._shards]
+        result = {}
+        for shard in shards:
+            for labels, value in shard.items():
+                result[labels] = self.merge(result.get(labels), value)
+        return result
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge с операциями inc/dec, значение — сумма по потокам."""
+
+    type = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """
+    Гистограмма. Значение по меткам — список
+    [счетчики корзин..., счетчик +Inf, сумма].
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        # Поток-владелец может добавить метки во время сбора, поэтому
+        # сначала копируем словарь шарда целиком, затем списки счетчиков
+        with self._lock:
+            shards = [
+                {labels: list(counts) for labels, counts in dict(shard).items()}
+                for shard in self._shards
+            ]
+        result = {}
+        for shard in shards:
+            for labels, counts in shard.items():
+                result[labels] = self.merge(result.get(labels), counts)
+        return result
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [left + right for left, right in zip(total, value)]
+
+
+class Registry:
+    """Набор метрик процесса и их запись в файлы снимков."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+        self._snapshot_name = None
+        self._snapshot_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def collect(self):
+        return {
+            name: metric.collect() for name, metric in self.metrics.items()
+        }
+
+    # Многопроцессный режим
+
+    def multiprocess_dir(self):
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        return Path(directory) if directory else None
+
+    def ensure_flusher(self):
+        """Запускает в текущем процессе поток периодической записи снимка."""
+        if self._flusher_pid == os.getpid() or self.multiprocess_dir() is None:
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(
+                target=self._flush_forever, name='metrics-flusher', daemon=True
+            ).start()
+            atexit.register(self.write_snapshot)
+
+    def _flush_forever(self):
+        stop = threading.Event()
+        while not stop.wait(settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Пишет снимок; ошибка не должна останавливать поток записи."""
+        try:
+            self.write_snapshot()
+        except Exception:
+            logger.exception('Не удалось записать снимок метрик')
+
+    def snapshot_name(self):
+        """Имя файла снимка текущего процесса: <pid>-<uuid>."""
+        pid = os.getpid()
+        if self._snapshot_pid != pid:
+            with self._flusher_lock:
+                if self._snapshot_pid != pid:
+                    self._snapshot_name = f'{pid}-{uuid.uuid4().hex}'
+                    self._snapshot_pid = pid
+        return self._snapshot_name
+
+    def write_snapshot(self):
+        directory = self.multiprocess_dir()
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        snapshot = {
+            name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in self.collect().items()
+        }
+        # Запись во временный файл и rename, чтобы читатель не увидел половину
+        with tempfile.NamedTemporaryFile(
+            'w', dir=directory, suffix='.tmp', delete=False
+        ) as file:
+            json.dump(snapshot, file)
+        os.replace(file.name, directory / f'{self.snapshot_name()}.json')
+
+    def collect_all(self):
+        """Значения метрик всех процессов или только текущего."""
+        directory = self.multiprocess_dir()
+        if directory is None:
+            return self.collect()
+
+        self.write_snapshot()
+        result = {name: {} for name in self.metrics}
+        for path in directory.glob('*.json'):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            # Файл с pid текущего процесса, но чужим uuid оставил
+            # завершившийся процесс с тем же pid
+            pid = int(path.stem.split('-', 1)[0])
+            alive = pid_alive(pid) and (
+                pid != os.getpid() or path.stem == self.snapshot_name()
+            )
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                merged = result[name]
+                for labels, value in values:
+                    labels = tuple(labels)
+                    merged[labels] = metric.merge(merged.get(labels), value)
+        return result
+
+    def render(self):
+        """Текст в формате Prometheus."""
+        values = self.collect_all()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(values.get(name, {}).items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{format_labels(pairs)} {format_value(value)}')
+                    continue
+                cumulative = 0
+                bounds = [*metric.buckets, math.inf]
+                for bound, count in zip(bounds, value):
+                    cumulative += count
+                    bucket_labels = format_labels(pairs + [('le', format_value(bound))])
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(pairs)} {format_value(value[-1])}')
+                lines.append(f'{name}_count{format_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+REQUESTS = Counter(
+    'foodgram_http_requests_total',
+    'Число HTTP-запросов',
+    ('view', 'method', 'status'),
+)
+REQUEST_LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки HTTP-запроса',
+    ('view', 'method', 'status'),
+)
+REQUEST_QUERIES = Histogram(
+    'foodgram_http_request_db_queries',
+    'Число SQL-запросов на HTTP-запрос',
+    ('view',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total',
+    'Обращения к кешам приложения по результату (hit/miss)',
+    ('cache', 'result'),
+)
+IMAGE_UPLOADS_IN_PROGRESS = Gauge(
+    'foodgram_image_uploads_in_progress',
+    'Загружаемые изображения, декодирование которых еще не завершено',
+)
+QUERY_BUDGET_VIOLATIONS = Counter(
+    'foodgram_query_budget_violations_total',
+    'Превышения бюджета SQL-запросов',
+    ('view',),
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc((cache, 'hit' if hit else 'miss'))
+
+
+def metrics_view(request):
+    """Эндпоинт /metrics для Prometheus."""
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    Считает запросы, их длительность и число SQL-запросов по эндпоинтам.
+
+    Число SQL-запросов берется из профиля ProfilingMiddleware, поэтому
+    middleware должен стоять в MIDDLEWARE после него.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        REGISTRY.ensure_flusher()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        _, _, view = resolve_endpoint(request)
+        view = view or 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        labels = (view, method, str(response.status_code))
+        REQUESTS.inc(labels)
+        REQUEST_LATENCY.observe(duration, labels)
+        profile = current_profile()
+        if profile is not None:
+            REQUEST_QUERIES.observe(profile.sql_count, (view,))
+        return response
@@ -1,4 +1,14 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -7,3 +17,201 @@ class CustomPageNumberPagination(PageNumberPagination):
     """
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация по паре полей (created, id) в порядке убывания.
+
+    Вместо OFFSET страница выбирается условием
+    (created, id) < (курсор), поэтому глубокие страницы стоят столько же,
+    сколько первая. Общее количество объектов не считается.
+    Курсор непрозрачен для клиента: это base64 от позиции и направления.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = self.start(request)
+        results = list(
+            self.apply_cursor(queryset, cursor)[:self.page_size + 1]
+        )
+        self.page = self.finish(results, cursor)
+        self.keys = [(obj.created, obj.pk) for obj in self.page]
+        return self.page
+
+    def start(self, request):
+        """Запоминает параметры запроса и возвращает курсор."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        return self.decode_cursor(request)
+
+    def apply_cursor(self, queryset, cursor, created_field='created',
+                     id_field='id'):
+        """Условие по курсору и сортировка по паре полей (дата, id)."""
+        reverse = False
+        if cursor is not None:
+            created, pk, reverse = cursor
+            if reverse:
+                queryset = queryset.filter(
+                    Q(**{f'{created_field}__gt': created})
+                    | Q(**{created_field: created, f'{id_field}__gt': pk})
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{created_field}__lt': created})
+                    | Q(**{created_field: created, f'{id_field}__lt': pk})
+                )
+
+        if reverse:
+            return queryset.order_by(created_field, id_field)
+        return queryset.order_by(f'-{created_field}', f'-{id_field}')
+
+    def finish(self, results, cursor):
+        """
+        Обрезает выборку из page_size + 1 элементов до страницы
+        и определяет наличие соседних страниц.
+        """
+        reverse = cursor is not None and cursor[2]
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        """Возвращает (created, id, reverse) или None для первой страницы."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return (
+                datetime.fromisoformat(payload['c']),
+                int(payload['i']),
+                bool(payload.get('r', False)),
+            )
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, key, reverse):
+        created, pk = key
+        payload = {'c': created.isoformat(), 'i': pk}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode()
+        ).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.keys:
+            return None
+        return self.encode_cursor(self.keys[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.keys:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.keys[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация по объединению нескольких источников.
+
+    Каждый источник — (queryset, поле даты, поле id) с одной и той же
+    парой ключей (дата, id объекта). Из каждого берется не больше
+    page_size + 1 ключей по курсору, ключи сливаются и повторы
+    отбрасываются. Страница — список id, объекты загружает view.
+    """
+
+    def paginate_sources(self, sources, request):
+        cursor = self.start(request)
+        reverse = cursor is not None and cursor[2]
+        keys = set()
+        for queryset, created_field, id_field in sources:
+            keys.update(self.apply_cursor(
+                queryset, cursor, created_field, id_field
+            ).values_list(created_field, id_field)[:self.page_size + 1])
+        keys = sorted(keys, reverse=not reverse)[:self.page_size + 1]
+        self.keys = self.finish(keys, cursor)
+        return [pk for _, pk in self.keys]
+
+
+class OptionalKeysetPagination(BasePagination):
+    """
+    Постраничная пагинация по умолчанию и курсорная по запросу.
+
+    Курсорный режим включается параметром ?pagination=cursor
+    или наличием параметра cursor, остальные запросы обслуживаются
+    как раньше через CustomPageNumberPagination. Курсор задан парой
+    (created, id), поэтому при другой сортировке (?ordering=...)
+    всегда используются номера страниц.
+    """
+
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    ordering_query_param = 'ordering'
+
+    def use_cursor(self, request):
+        if request.query_params.get(self.ordering_query_param):
+            return False
+        return (
+            request.query_params.get(self.mode_query_param) == self.cursor_mode
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.paginator = KeysetPagination()
+        else:
+            self.paginator = CustomPageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return CustomPageNumberPagination().get_paginated_response_schema(schema)
@@ -0,0 +1,219 @@
+"""
+Профилирование запросов.
+
+ProfilingMiddleware измеряет для каждого запроса число и суммарное
+время SQL-запросов (через connection.execute_wrapper), время view,
+сериализации, декодирования изображений и отрисовки ответа.
+
+Для выборки запросов (settings.PROFILING_SAMPLE_RATE) и для запросов
+сотрудников замеры отдаются в заголовке Server-Timing. Запросы
+дольше settings.PROFILING_SLOW_REQUEST_MS пишутся в лог
+foodgram.profiling одной структурированной записью.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger('foodgram.profiling')
+
+_current_profile = ContextVar('request_profile', default=None)
+
+# Порядок метрик в заголовке Server-Timing
+TIMINGS = ('db', 'view', 'serialize', 'image', 'render', 'total')
+
+
+class RequestProfile:
+    """Замеры одного запроса, времена в миллисекундах."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.sql_count = 0
+        self.view_started = None
+        self.view_finished = None
+        self._active = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.durations['db'] += (time.perf_counter() - started) * 1000
+
+    @contextmanager
+    def span(self, name):
+        """Добавляет время блока к метрике name, вложенные блоки не считаются дважды."""
+        if self._active[name]:
+            yield
+            return
+        self._active[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active[name] -= 1
+            self.durations[name] += (time.perf_counter() - started) * 1000
+
+    def finish(self):
+        finished = time.perf_counter()
+        if self.view_started is not None:
+            view_finished = self.view_finished or finished
+            self.durations['view'] = (view_finished - self.view_started) * 1000
+            if self.view_finished is not None:
+                self.durations['render'] = (finished - self.view_finished) * 1000
+        self.durations['total'] = (finished - self.started) * 1000
+
+    def server_timing(self):
+        parts = []
+        for name in TIMINGS:
+            if name not in self.durations:
+                continue
+            part = f'{name};dur={self.durations[name]:.2f}'
+            if name == 'db':
+                part += f';desc="{self.sql_count} queries"'
+            parts.append(part)
+        return ', '.join(parts)
+
+    def as_dict(self):
+        data = {
+            f'{name}_ms': round(duration, 2)
+            for name, duration in self.durations.items()
+        }
+        data['sql_count'] = self.sql_count
+        return data
+
+
+def current_profile():
+    """Профиль текущего запроса или None вне запроса."""
+    return _current_profile.get()
+
+
+def span(name):
+    """Замер блока кода в профиле текущего запроса, если он есть."""
+    profile = _current_profile.get()
+    if profile is None:
+        return nullcontext()
+    return profile.span(name)
+
+
+class ProfiledListSerializer(serializers.ListSerializer):
+    """ListSerializer, время отрисовки которого попадает в метрику serialize."""
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class ProfiledSerializerMixin:
+    """
+    Миксин сериализатора для метрики serialize.
+
+    Для списков в Meta нужно указать
+    list_serializer_class = ProfiledListSerializer.
+    """
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись, поля берутся из extra={'data': ...}."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'data', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ProfilingMiddleware:
+    """Собирает профиль запроса и отдает его в Server-Timing и в лог."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        profile.finish()
+
+        if self.should_expose(request):
+            response['Server-Timing'] = profile.server_timing()
+
+        if profile.durations['total'] >= settings.PROFILING_SLOW_REQUEST_MS:
+            logger.warning('slow request', extra={'data': {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                **profile.as_dict(),
+            }})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Вызывается после view и до отрисовки ответа DRF
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.view_finished = time.perf_counter()
+        return response
+
+    def should_expose(self, request):
+        user = request_user(request)
+        if user is not None and user.is_staff:
+            return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def request_user(request):
+    """
+    Пользователь запроса с учетом аутентификации DRF.
+
+    DRF проверяет токен только в своем view и тогда сам подменяет
+    request.user. Для обычных Django view и запросов, завершившихся
+    до аутентификации, токен из заголовка Authorization проверяется
+    здесь теми же классами аутентификации.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    if 'HTTP_AUTHORIZATION' not in request.META:
+        return user
+    drf_request = Request(request, authenticators=[
+        authentication() for authentication
+        in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        return drf_request.user
+    except APIException:
+        return user
@@ -0,0 +1,158 @@
+"""
+Бюджеты SQL-запросов для эндпоинтов.
+
+Бюджет задается у view декларативно: словарем query_budgets
+по именам действий или декоратором @query_budget(n) на методе
+действия либо на view-функции. QueryBudgetMiddleware считает запросы каждого запроса
+через connection.execute_wrapper и при превышении бюджета,
+в зависимости от settings.QUERY_BUDGET_MODE:
+
+* raise — выбрасывает QueryBudgetExceeded с отчетом о повторяющихся
+  запросах (по умолчанию при DEBUG);
+* log — пишет тот же отчет в лог foodgram.query_budget;
+* count — только увеличивает счетчик нарушений, он же экспортируется
+  в /metrics (по умолчанию в продакшене);
+* off — бюджеты не проверяются.
+
+Запросы, выполняемые при чтении тела StreamingHttpResponse,
+происходят уже после middleware и в бюджет не входят.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from foodgram.endpoints import resolve_endpoint
+from foodgram.metrics import QUERY_BUDGET_VIOLATIONS
+
+logger = logging.getLogger('foodgram.query_budget')
+
+# Списки параметров IN (%s, %s, ...) разной длины считаются одним шаблоном
+PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+_violations = Counter()
+_violations_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    """Запрос выполнил больше SQL-запросов, чем позволяет бюджет."""
+
+
+def query_budget(limit):
+    """Декоратор действия view, задающий его бюджет запросов."""
+    def decorator(func):
+        func.query_budget = limit
+        return func
+    return decorator
+
+
+def get_query_budget(owner, action):
+    """
+    Бюджет действия action у класса view или экземпляра ModelAdmin.
+
+    Сначала проверяется атрибут query_budget метода действия,
+    затем словарь query_budgets, затем default_query_budget.
+    У view-функции (action=None) — только ее атрибут query_budget.
+    """
+    if action is None:
+        return getattr(owner, 'query_budget', None)
+    budget = getattr(getattr(owner, action, None), 'query_budget', None)
+    if budget is None:
+        budget = getattr(owner, 'query_budgets', {}).get(action)
+    if budget is None:
+        budget = getattr(owner, 'default_query_budget', None)
+    return budget
+
+
+def resolve_budget(request):
+    """Возвращает (имя эндпоинта, бюджет) для запроса или (None, None)."""
+    owner, action, name = resolve_endpoint(request)
+    if owner is None:
+        return None, None
+    return name, get_query_budget(owner, action)
+
+
+def normalize_sql(sql):
+    return PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+def duplicated_queries(queries, limit=5):
+    """Наиболее частые повторяющиеся шаблоны запросов."""
+    patterns = Counter(normalize_sql(sql) for sql in queries)
+    return [
+        (count, sql) for sql, count in patterns.most_common(limit) if count > 1
+    ]
+
+
+def record_violation(name):
+    QUERY_BUDGET_VIOLATIONS.inc((name,))
+    with _violations_lock:
+        _violations[name] += 1
+
+
+def get_violations():
+    """Снимок счетчика нарушений бюджета по эндпоинтам."""
+    with _violations_lock:
+        return dict(_violations)
+
+
+def reset_violations():
+    with _violations_lock:
+        _violations.clear()
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper, запоминающая SQL выполненных запросов."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+def format_report(name, budget, queries):
+    lines = [
+        f'{name}: выполнено {len(queries)} SQL-запросов при бюджете {budget}'
+    ]
+    duplicates = duplicated_queries(queries)
+    if duplicates:
+        lines.append('Повторяющиеся запросы:')
+        lines.extend(f'  {count} x {sql}' for count, sql in duplicates)
+    return '\n'.join(lines)
+
+
+class QueryBudgetMiddleware:
+    """Проверяет число SQL-запросов запроса против бюджета эндпоинта."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'count')
+        if mode == 'off':
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        name, budget = resolve_budget(request)
+        if budget is None or len(recorder.queries) <= budget:
+            return response
+
+        record_violation(name)
+        if mode == 'count':
+            return response
+        report = format_report(name, budget, recorder.queries)
+        if mode == 'raise':
+            raise QueryBudgetExceeded(report)
+        logger.warning(report)
+        return response
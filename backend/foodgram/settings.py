@@ -46,6 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.profiling.ProfilingMiddleware',
+    'foodgram.metrics.MetricsMiddleware',
+    'foodgram.query_budget.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -137,6 +140,93 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кеш. При нескольких воркерах нужен общий бэкенд: через него
+# процессы узнают о новых версиях справочников (recipes.versions)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Максимальное число подсказок при поиске ингредиентов по префиксу
+INGREDIENT_SEARCH_LIMIT = 100
+
+# Минимальное триграммное сходство названия при нечетком поиске
+# ингредиентов (?fuzzy=1), см. recipes.ingredient_search
+INGREDIENT_FUZZY_THRESHOLD = 0.15
+
+# Лента подписок (см. recipes.feed): рецепты автора рассылаются
+# по лентам подписчиков пачками по FEED_FANOUT_BATCH_SIZE строк,
+# авторов с FEED_PULL_THRESHOLD подписчиков и более лента читает
+# напрямую. При подписке в ленту добавляются FEED_BACKFILL_LIMIT
+# последних рецептов автора.
+FEED_PULL_THRESHOLD = 1000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_LIMIT = 100
+
+# Похожие рецепты (см. recipes.similarity): сколько рецептов отдавать
+# и сколько кандидатов LSH переранжировать по точному сходству
+SIMILAR_RECIPES_LIMIT = 6
+SIMILAR_RECIPES_CANDIDATES = 200
+
+# Подбор рецептов по продуктам (см. recipes.pantry): порог покрытия
+# по умолчанию, максимум продуктов в запросе, обратный индекс в памяти
+# (False — запрос к БД) и длина журнала изменений для его обновления
+PANTRY_MIN_COVERAGE = 0.5
+PANTRY_MAX_INGREDIENTS = 100
+PANTRY_USE_INDEX = True
+PANTRY_JOURNAL_SIZE = 256
+
+# Максимум рецептов в одном пакетном запросе к избранному или корзине
+MARKS_BATCH_LIMIT = 100
+
+# Популярные рецепты (см. recipes.trending): период полураспада вклада
+# добавления, веса избранного и корзины и окно пересчета rebuild_trending
+TRENDING_HALF_LIFE_HOURS = 48
+TRENDING_WEIGHTS = {'favorite': 1.0, 'shopping_cart': 1.5}
+TRENDING_WINDOW_DAYS = 30
+
+# Реакция на превышение бюджета SQL-запросов эндпоинта:
+# raise, log, count или off (см. foodgram.query_budget)
+QUERY_BUDGET_MODE = os.environ.get(
+    'QUERY_BUDGET_MODE', 'raise' if DEBUG else 'count'
+)
+
+# Доля запросов, получающих заголовок Server-Timing (сотрудники получают всегда)
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+# Запросы дольше порога (мс) пишутся в лог foodgram.profiling
+PROFILING_SLOW_REQUEST_MS = float(
+    os.environ.get('PROFILING_SLOW_REQUEST_MS', '500')
+)
+
+# Каталог снимков метрик воркеров для /metrics при нескольких процессах
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'foodgram.profiling.JsonFormatter'},
+    },
+    'handlers': {
+        'json_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'foodgram': {
+            'handlers': ['json_console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -4,6 +4,7 @@ from django.urls.conf import re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from foodgram.metrics import metrics_view
 from recipes.short_links import short_link_redirect
 
 urlpatterns = [
@@ -12,6 +13,7 @@ urlpatterns = [
     re_path(r'^api/', include('recipes.urls')),
     re_path(r'^api/auth/', include('djoser.urls.authtoken')),
     path('s/<str:short_id>/', short_link_redirect, name='short_link_redirect'),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
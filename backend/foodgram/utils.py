@@ -3,16 +3,75 @@ import uuid
 from django.core.files.base import ContentFile
 from rest_framework import serializers
 
+from foodgram.metrics import IMAGE_UPLOADS_IN_PROGRESS
+from foodgram.profiling import span
+
 
 class Base64ImageField(serializers.ImageField):
     """Кастомное поле для декодирования изображений из base64."""
 
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(
-                base64.b64decode(imgstr),
-                name=f'recipe_{uuid.uuid4()}.{ext}'
-            )
-        return super().to_internal_value(data)
+        IMAGE_UPLOADS_IN_PROGRESS.inc()
+        try:
+            return self.decode(data)
+        finally:
+            IMAGE_UPLOADS_IN_PROGRESS.dec()
+
+    def decode(self, data):
+        with span('image'):
+            if isinstance(data, str) and data.startswith('data:image'):
+                format, imgstr = data.split(';base64,')
+                ext = format.split('/')[-1]
+                data = ContentFile(
+                    base64.b64decode(imgstr),
+                    name=f'recipe_{uuid.uuid4()}.{ext}'
+                )
+            return super().to_internal_value(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.ListField):
+    """
+    Список первичных ключей, проверяемых одной выборкой.
+
+    PrimaryKeyRelatedField(many=True) загружает каждый объект отдельным
+    запросом. Здесь все ключи проверяются разом: функцией lookup(ids),
+    возвращающей множество существующих (например, из справочника
+    в памяти), или одним запросом pk__in к queryset. Возвращает список
+    ключей, ошибки указываются для каждого несуществующего.
+    """
+
+    default_error_messages = {
+        'does_not_exist': 'Объект с id={pk_value} не существует.',
+        'duplicate': 'Значение {pk_value} указано повторно.',
+    }
+
+    def __init__(self, queryset=None, lookup=None, **kwargs):
+        assert queryset is not None or lookup is not None, (
+            'Нужно указать queryset или lookup'
+        )
+        kwargs.setdefault('child', serializers.IntegerField(min_value=1))
+        super().__init__(**kwargs)
+        self.queryset = queryset
+        self.lookup = lookup
+
+    def existing(self, pks):
+        if self.lookup is not None:
+            return self.lookup(pks)
+        return set(self.queryset.filter(pk__in=pks).values_list('pk', flat=True))
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        existing = self.existing(pks) if pks else set()
+        seen = set()
+        errors = {}
+        for index, pk in enumerate(pks):
+            if pk in seen:
+                errors[index] = [self.error_messages['duplicate'].format(pk_value=pk)]
+            elif pk not in existing:
+                errors[index] = [
+                    self.error_messages['does_not_exist'].format(pk_value=pk)
+                ]
+            seen.add(pk)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return pks
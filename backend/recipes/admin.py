@@ -1,10 +1,19 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.safestring import mark_safe
 
 from .models import (
-    Ingredient, Tag, Recipe, RecipeIngredient,
-    Favorite, ShoppingCart, ShortLink
+    Ingredient, IngredientImport, Tag, Recipe, RecipeIngredient,
+    Favorite, ShoppingCart, ShoppingListItem, ShortLink
 )
+from .shopping_list import (
+    add_recipes_to_list, get_recipe_amounts, propagate_recipe_change,
+    remove_carts_from_lists
+)
+from .pantry import record_change
+from .similarity import update_recipe_buckets
 from users.models import Subscription
 
 
@@ -18,6 +27,16 @@ class IngredientAdmin(admin.ModelAdmin):
     ordering = ('name',)
 
 
+@admin.register(IngredientImport)
+class IngredientImportAdmin(admin.ModelAdmin):
+    """Админ-панель для журнала импорта ингредиентов."""
+
+    list_display = ('source', 'created', 'inserted', 'skipped', 'invalid')
+    readonly_fields = (
+        'source', 'checksum', 'inserted', 'skipped', 'invalid', 'created'
+    )
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     """Админ-панель для тегов."""
@@ -42,6 +61,7 @@ class RecipeIngredientInline(admin.TabularInline):
 
     model = RecipeIngredient
     extra = 1
+    fields = ('ingredient', 'amount', 'position')
     autocomplete_fields = ('ingredient',)
 
 
@@ -73,6 +93,42 @@ class RecipeAdmin(admin.ModelAdmin):
         })
     )
 
+    # Число запросов страницы списка не зависит от числа рецептов на ней
+    query_budgets = {'changelist': 10}
+
+    def get_queryset(self, request):
+        """Счетчики считаем подзапросами, теги загружаем одним запросом."""
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('tags').annotate(
+            ingredients_count=self.count_subquery(RecipeIngredient),
+            favorites_count=self.count_subquery(Favorite),
+        )
+
+    @staticmethod
+    def count_subquery(model):
+        counts = model.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Ингредиенты из инлайна сохраняются здесь, поэтому разницу
+        до и после переносим в списки покупок с этим рецептом,
+        а при смене состава пересчитываем полосы похожих рецептов
+        и отмечаем рецепт в журнале индекса подбора по продуктам.
+        """
+        recipe = form.instance
+        old_amounts = get_recipe_amounts([recipe.id]) if change else {}
+        super().save_related(request, form, formsets, change)
+        new_amounts = get_recipe_amounts([recipe.id])
+        if new_amounts != old_amounts:
+            propagate_recipe_change(recipe, old_amounts, new_amounts)
+        if new_amounts.keys() != old_amounts.keys():
+            update_recipe_buckets(recipe, list(new_amounts), created=not change)
+            record_change(recipe.id)
+
     def get_tags(self, obj):
         """Получение списка тегов."""
         return ', '.join([tag.name for tag in obj.tags.all()])
@@ -81,15 +137,17 @@ class RecipeAdmin(admin.ModelAdmin):
 
     def get_ingredients_count(self, obj):
         """Количество ингредиентов."""
-        return obj.ingredients.count()
+        return obj.ingredients_count
 
     get_ingredients_count.short_description = 'Ингредиентов'
+    get_ingredients_count.admin_order_field = 'ingredients_count'
 
     def get_favorites_count(self, obj):
         """Количество добавлений в избранное."""
-        return obj.favorited_by.count()
+        return obj.favorites_count
 
     get_favorites_count.short_description = 'В избранном'
+    get_favorites_count.admin_order_field = 'favorites_count'
 
     def get_image_preview(self, obj):
         """Превью изображения."""
@@ -104,12 +162,24 @@ class RecipeAdmin(admin.ModelAdmin):
 
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
-    """Админ-панель для ингредиентов рецептов."""
+    """
+    Админ-панель для ингредиентов рецептов, только просмотр:
+    состав меняется на странице рецепта, где правка переносится
+    в списки покупок.
+    """
 
     list_display = ('recipe', 'ingredient', 'amount')
     list_filter = ('ingredient',)
     search_fields = ('recipe__name', 'ingredient__name')
-    autocomplete_fields = ('recipe', 'ingredient')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Favorite)
@@ -124,13 +194,45 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
-    """Админ-панель для корзины покупок."""
+    """
+    Админ-панель для корзины покупок. Добавление и удаление записей
+    обновляют списки покупок, существующую запись изменить нельзя.
+    """
 
     list_display = ('user', 'recipe', 'created')
     list_filter = ('created',)
     search_fields = ('user__username', 'recipe__name')
     autocomplete_fields = ('user', 'recipe')
 
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ('user', 'recipe')
+        return ()
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            add_recipes_to_list(obj.user, [obj.recipe_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            remove_carts_from_lists([obj])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            remove_carts_from_lists(queryset)
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    """Админ-панель для списков покупок."""
+
+    list_display = ('user', 'ingredient', 'total_amount')
+    search_fields = ('user__username', 'ingredient__name')
+    readonly_fields = ('user', 'ingredient', 'total_amount')
+
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
@@ -0,0 +1,84 @@
+"""
+Справочник тегов в памяти процесса.
+
+Тегов единицы, меняются они только через админку, поэтому соответствие
+слаг -> id и id -> тег держим в словарях и перестраиваем при смене
+версии TAGS (см. recipes.versions). Фильтр рецептов по тегам получает
+id, сериализатор рецепта проверяет присланные id и разворачивает id
+тегов рецепта в ответе без обращения к БД. На сотню тегов уходит
+порядка 50 КиБ.
+"""
+from .models import Tag
+from .versions import TAGS, VersionedValue
+
+
+class TagCatalog:
+    """Соответствие слагов тегов их id и id тегов самим тегам."""
+
+    def __init__(self):
+        self._snapshot = VersionedValue(TAGS, self._build, cache_name='tag_map')
+
+    def ids_for_slugs(self, slugs):
+        """id тегов по слагам без учета регистра, неизвестные пропускаются."""
+        by_slug, _ = self._snapshot.get()
+        return sorted({
+            by_slug[slug.lower()] for slug in slugs if slug.lower() in by_slug
+        })
+
+    def existing_ids(self, ids):
+        """
+        Те из ids, для которых есть тег. Версия в кеше может отставать
+        от изменений в другом процессе, поэтому id, которых нет в снимке,
+        проверяются одним запросом к БД.
+        """
+        by_id = self.by_id()
+        existing = {pk for pk in ids if pk in by_id}
+        missing = set(ids) - existing
+        if missing:
+            existing.update(Tag.objects.filter(
+                id__in=missing
+            ).values_list('id', flat=True))
+        return existing
+
+    def by_id(self):
+        """
+        Снимок id -> тег. Сериализатор списка берет его один раз
+        и передает в tags(), чтобы не сверять версию на каждой строке.
+        """
+        _, by_id = self._snapshot.get()
+        return by_id
+
+    def tags(self, ids, by_id=None):
+        """
+        Теги с id из ids в порядке Tag.Meta.ordering, как их вернул бы
+        TagSerializer; неизвестные id пропускаются.
+        """
+        if by_id is None:
+            by_id = self.by_id()
+        return [
+            dict(row) for row in sorted(
+                (by_id[pk] for pk in set(ids) if pk in by_id),
+                key=lambda row: (row['name'], row['id'])
+            )
+        ]
+
+    def _build(self):
+        by_slug = {}
+        by_id = {}
+        for pk, name, slug in Tag.objects.values_list(
+            'id', 'name', 'slug'
+        ).order_by():
+            by_slug[slug.lower()] = pk
+            by_id[pk] = {'id': pk, 'name': name, 'slug': slug}
+        return by_slug, by_id
+
+
+tag_catalog = TagCatalog()
+
+
+def existing_tag_ids(ids):
+    """
+    Те из ids, для которых есть тег. Функция, а не метод: поля
+    сериализаторов копируются через deepcopy вместе с аргументами.
+    """
+    return tag_catalog.existing_ids(ids)
@@ -0,0 +1,138 @@
+"""
+Лента рецептов авторов, на которых подписан пользователь.
+
+Гибрид fan-out on write и pull:
+
+* новый рецепт обычного автора сразу записывается в таблицу
+  TimelineEntry каждого подписчика пачками по FEED_FANOUT_BATCH_SIZE;
+* у автора, набравшего FEED_PULL_THRESHOLD подписчиков, ставится
+  флаг User.feed_pull, и его рецепты больше не рассылаются: лента
+  читает их напрямую по индексу (author, -created, -id). Флаг не
+  снимается при отписках, иначе из лент пропали бы рецепты, которые
+  не рассылались, пока он стоял (пересчитывает его rebuild_feeds).
+
+При подписке в ленту добавляются последние FEED_BACKFILL_LIMIT рецептов
+автора, при отписке его записи удаляются. Записи рецепта удаляются
+каскадно вместе с ним.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from users.models import Subscription, User
+from .models import Recipe, TimelineEntry
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def write_entries(entries):
+    """Вставляет записи лент пачками, уже существующие пропускаются."""
+    for batch in batched(entries, settings.FEED_FANOUT_BATCH_SIZE):
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_recipe(recipe):
+    """Рассылает новый рецепт по лентам подписчиков автора."""
+    if recipe.author.feed_pull:
+        return
+    follower_ids = Subscription.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True).order_by().iterator(
+        chunk_size=settings.FEED_FANOUT_BATCH_SIZE
+    )
+    with transaction.atomic():
+        write_entries(
+            TimelineEntry(user_id=user_id, recipe=recipe, created=recipe.created)
+            for user_id in follower_ids
+        )
+
+
+def subscribed(user, author):
+    """Обновляет ленту после подписки user на author."""
+    if author.feed_pull:
+        return
+    followers = Subscription.objects.filter(author=author).count()
+    if followers >= settings.FEED_PULL_THRESHOLD:
+        User.objects.filter(pk=author.pk).update(feed_pull=True)
+        author.feed_pull = True
+        return
+    recent = Recipe.objects.filter(author=author).order_by(
+        '-created', '-id'
+    ).values_list('id', 'created')[:settings.FEED_BACKFILL_LIMIT]
+    write_entries(
+        TimelineEntry(user=user, recipe_id=recipe_id, created=created)
+        for recipe_id, created in recent
+    )
+
+
+def unsubscribed(user, author):
+    """Убирает рецепты author из ленты user после отписки."""
+    TimelineEntry.objects.filter(user=user, recipe__author=author).delete()
+
+
+def feed_sources(user):
+    """
+    Источники ленты для MergedKeysetPagination: записи ленты
+    пользователя и рецепты авторов с флагом feed_pull.
+    """
+    sources = [(TimelineEntry.objects.filter(user=user), 'created', 'recipe_id')]
+    pulled_author_ids = list(Subscription.objects.filter(
+        user=user, author__feed_pull=True
+    ).values_list('author_id', flat=True))
+    if pulled_author_ids:
+        sources.append((
+            Recipe.objects.filter(author_id__in=pulled_author_ids),
+            'created', 'id'
+        ))
+    return sources
+
+
+@transaction.atomic
+def rebuild_feeds():
+    """
+    Пересобирает флаги feed_pull и все ленты по подпискам.
+
+    Нужна после массовой загрузки данных без сигналов (seed_foodgram).
+    Возвращает число записей в лентах.
+    """
+    pulled = set(Subscription.objects.values('author').annotate(
+        followers=Count('id')
+    ).filter(
+        followers__gte=settings.FEED_PULL_THRESHOLD
+    ).order_by().values_list('author', flat=True))
+    User.objects.filter(feed_pull=True).exclude(pk__in=pulled).update(feed_pull=False)
+    User.objects.filter(pk__in=pulled).update(feed_pull=True)
+
+    recent = {}
+    for recipe_id, author_id, created in Recipe.objects.filter(
+        Exists(Subscription.objects.filter(author=OuterRef('author'))),
+        author__feed_pull=False,
+    ).order_by(
+        'author_id', '-created', '-id'
+    ).values_list('id', 'author_id', 'created').iterator():
+        recipes = recent.setdefault(author_id, [])
+        if len(recipes) < settings.FEED_BACKFILL_LIMIT:
+            recipes.append((recipe_id, created))
+
+    TimelineEntry.objects.all().delete()
+    total = 0
+
+    def entries():
+        nonlocal total
+        for user_id, author_id in Subscription.objects.filter(
+            author__feed_pull=False
+        ).values_list('user_id', 'author_id').order_by().iterator():
+            for recipe_id, created in recent.get(author_id, ()):
+                total += 1
+                yield TimelineEntry(
+                    user_id=user_id, recipe_id=recipe_id, created=created
+                )
+
+    write_entries(entries())
+    return total
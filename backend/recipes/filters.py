@@ -1,6 +1,40 @@
 import django_filters
-from django.db.models import Q
-from .models import Recipe, Ingredient, ShoppingCart
+from django import forms
+from django.db.models import Exists, OuterRef, Q
+from .catalog import tag_catalog
+from .models import Recipe, ShoppingCart
+from .search import search_recipes
+from .trending import trending
+
+
+class SlugListField(forms.MultipleChoiceField):
+    """Повторяющийся параметр запроса без проверки по списку вариантов."""
+
+    def valid_value(self, value):
+        return True
+
+
+class TagSlugFilter(django_filters.Filter):
+    """
+    Фильтр по слагам тегов: рецепт подходит, если у него есть хотя бы
+    один из тегов.
+
+    Слаги переводятся в id по справочнику в памяти (recipes.catalog),
+    а условие проверяется через EXISTS по таблице связи, поэтому
+    нет ни запроса вариантов, ни JOIN с повторами рецептов.
+    """
+
+    field_class = SlugListField
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        tag_ids = tag_catalog.ids_for_slugs(value)
+        if not tag_ids:
+            return qs.none()
+        return qs.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=tag_ids
+        )))
 
 
 class RecipeFilter(django_filters.FilterSet):
@@ -9,9 +43,11 @@ class RecipeFilter(django_filters.FilterSet):
     is_favorited = django_filters.NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = django_filters.NumberFilter(method='filter_is_in_shopping_cart')
     author = django_filters.NumberFilter(field_name='author__id')
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
-        lookup_expr='iexact'
+    tags = TagSlugFilter()
+    search = django_filters.CharFilter(method='filter_search')
+    ordering = django_filters.ChoiceFilter(
+        choices=[('trending', 'Популярные сейчас')],
+        method='filter_ordering'
     )
     
     class Meta:
@@ -20,6 +56,8 @@ class RecipeFilter(django_filters.FilterSet):
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
+            if 'is_favorited' in queryset.query.annotations:
+                return queryset.filter(is_favorited=True)
             return queryset.filter(favorited_by__user=self.request.user)
         return queryset
     
@@ -29,19 +67,19 @@ class RecipeFilter(django_filters.FilterSet):
             return queryset
 
         # Находим рецепты в корзине текущего пользователя
+        if 'is_in_shopping_cart' in queryset.query.annotations:
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset.filter(in_shopping_carts__user=self.request.user)
 
+    def filter_search(self, queryset, name, value):
+        # Полнотекстовый поиск с сортировкой по релевантности,
+        # см. recipes.search
+        if value.strip():
+            return search_recipes(queryset, value.strip())
+        return queryset
 
-class IngredientFilter(django_filters.FilterSet):
-    """Фильтр для ингредиентов."""
-    
-    name = django_filters.CharFilter(method='filter_name')
-    
-    class Meta:
-        model = Ingredient
-        fields = ['name']
-    
-    def filter_name(self, queryset, name, value):
-        if value:
-            return queryset.filter(name__istartswith=value)
+    def filter_ordering(self, queryset, name, value):
+        # Сортировка по таблице RecipeTrend, см. recipes.trending
+        if value == 'trending':
+            return trending(queryset)
         return queryset
@@ -0,0 +1,258 @@
+"""
+Потоковый импорт каталога ингредиентов из CSV или JSON.
+
+Файл читается по частям и загружается пачками, поэтому память
+не зависит от его размера. На PostgreSQL строки передаются через
+COPY во временную таблицу и вставляются одним INSERT ... ON CONFLICT.
+Повторный импорт того же файла пропускается по контрольной сумме.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+from .models import Ingredient, IngredientImport
+from .versions import INGREDIENTS, bump_version
+
+CHUNK_SIZE = 64 * 1024
+
+NAME_MAX_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_MAX_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+@dataclass
+class ImportResult:
+    """Итоги импорта."""
+
+    inserted: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    unchanged: bool = False
+
+
+def file_checksum(path):
+    """SHA-256 содержимого файла, прочитанного по частям."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """Элементы JSON-массива верхнего уровня без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    started = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise ValueError('Ожидается JSON-массив')
+            buffer = buffer[1:]
+            started = True
+            continue
+        if started and buffer[:1] == ',':
+            buffer = buffer[1:]
+            continue
+        if started and buffer[:1] == ']':
+            return
+        if started and buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        if eof:
+            raise ValueError('Неожиданный конец JSON-файла')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_csv_rows(file):
+    """Строки CSV-файла, заголовок name,measurement_unit пропускается."""
+    reader = csv.reader(file)
+    for line_number, row in enumerate(reader):
+        if (
+            line_number == 0 and len(row) >= 2
+            and row[0].strip().lower() == 'name'
+            and row[1].strip().lower() == 'measurement_unit'
+        ):
+            continue
+        yield row
+
+
+def detect_format(path):
+    return 'json' if path.lower().endswith('.json') else 'csv'
+
+
+class CsvStream(io.TextIOBase):
+    """Файлоподобный объект, отдающий строки в CSV для COPY FROM STDIN."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+        self.output = io.StringIO()
+        self.writer = csv.writer(self.output)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.buffer += self.output.getvalue()
+            self.output.seek(0)
+            self.output.truncate()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+class IngredientImporter:
+    """Идемпотентный импорт ингредиентов пачками."""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.result = ImportResult()
+
+    def run(self, path, file_format=None, force=False):
+        """Импортирует файл path и возвращает ImportResult."""
+        checksum = file_checksum(path)
+        if not force and IngredientImport.objects.filter(
+            checksum=checksum
+        ).exists():
+            return ImportResult(unchanged=True)
+
+        self.result = ImportResult()
+        rows = self.clean_rows(self.read_rows(
+            path, file_format or detect_format(path)
+        ))
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and self.supports_copy():
+                self.copy_rows(rows)
+            else:
+                self.upsert_rows(rows)
+            IngredientImport.objects.create(
+                source=os.path.basename(path),
+                checksum=checksum,
+                inserted=self.result.inserted,
+                skipped=self.result.skipped,
+                invalid=self.result.invalid,
+            )
+        if self.result.inserted:
+            # Пачки вставляются без сигналов, меняем версию каталога явно
+            bump_version(INGREDIENTS)
+        return self.result
+
+    def read_rows(self, path, file_format):
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            if file_format == 'json':
+                for item in iter_json_array(file):
+                    if isinstance(item, dict):
+                        yield item.get('name'), item.get('measurement_unit')
+                    else:
+                        yield None, None
+            else:
+                for row in iter_csv_rows(file):
+                    if len(row) >= 2:
+                        yield row[0], row[1]
+                    else:
+                        yield None, None
+
+    def clean_rows(self, rows):
+        """Отбрасывает пустые и слишком длинные значения."""
+        for name, measurement_unit in rows:
+            name = name.strip() if isinstance(name, str) else ''
+            measurement_unit = (
+                measurement_unit.strip()
+                if isinstance(measurement_unit, str) else ''
+            )
+            if (
+                not name or not measurement_unit
+                or len(name) > NAME_MAX_LENGTH
+                or len(measurement_unit) > UNIT_MAX_LENGTH
+            ):
+                self.result.invalid += 1
+                continue
+            yield name, measurement_unit
+
+    def upsert_rows(self, rows):
+        """Вставка пачками через bulk_create с пропуском существующих."""
+        batch = {}
+        for row in rows:
+            if row in batch:
+                self.result.skipped += 1
+                continue
+            batch[row] = Ingredient(name=row[0], measurement_unit=row[1])
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+
+    def flush(self, batch):
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
+        new = [
+            ingredient for key, ingredient in batch.items()
+            if key not in existing
+        ]
+        Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+        self.result.inserted += len(new)
+        self.result.skipped += len(batch) - len(new)
+
+    def supports_copy(self):
+        with connection.cursor() as cursor:
+            return hasattr(cursor.cursor, 'copy_expert')
+
+    def copy_rows(self, rows):
+        """COPY во временную таблицу и один INSERT ... ON CONFLICT."""
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        total = 0
+
+        def counted(rows):
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield row
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import ('
+                f'name varchar({NAME_MAX_LENGTH}), '
+                f'measurement_unit varchar({UNIT_MAX_LENGTH})'
+                ') ON COMMIT DROP'
+            )
+            cursor.cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                CsvStream(counted(rows)),
+                size=CHUNK_SIZE
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            self.result.inserted = cursor.rowcount
+        self.result.skipped = total - self.result.inserted
@@ -0,0 +1,89 @@
+"""
+Индекс ингредиентов в памяти процесса для автодополнения.
+
+Каталог небольшой (около 2 200 строк из data/ingredients.csv), поэтому
+его целиком держим в отсортированном списке нормализованных названий
+и ищем префикс двоичным поиском, не обращаясь к БД. Индекс строится
+при первом запросе и перестраивается, когда меняется версия каталога
+(см. recipes.versions). Для 2 200 строк занимает около 1 МиБ.
+
+Тот же снимок служит справочником id -> ингредиент для сериализаторов
+рецептов: в ответе название и единица измерения берутся отсюда, а из
+БД читаются только (recipe_id, ingredient_id, amount). Словарь по id
+ссылается на те же строки и добавляет около 150 КиБ.
+"""
+from bisect import bisect_left
+
+from .models import Ingredient
+from .versions import INGREDIENTS, VersionedValue
+
+
+def fold(text):
+    """Приводит строку к виду для сравнения без учета регистра и ё/е."""
+    return text.casefold().replace('ё', 'е')
+
+
+class IngredientPrefixIndex:
+    """Отсортированный по нормализованному названию список ингредиентов."""
+
+    def __init__(self):
+        self._snapshot = VersionedValue(
+            INGREDIENTS, self._build, cache_name='ingredient_index'
+        )
+
+    def search(self, prefix, limit):
+        """Ингредиенты, чье название начинается с prefix, не более limit."""
+        keys, rows, _ = self._snapshot.get()
+        key = fold(prefix)
+        result = []
+        for position in range(bisect_left(keys, key), len(keys)):
+            if len(result) >= limit or not keys[position].startswith(key):
+                break
+            result.append(rows[position])
+        return result
+
+    def entries(self):
+        """Нормализованные названия и строки ингредиентов, по названию."""
+        keys, rows, _ = self._snapshot.get()
+        return keys, rows
+
+    def existing_ids(self, ids):
+        """
+        Те из ids, для которых есть ингредиент. Id, которых нет в снимке
+        (например, добавленные другим процессом), проверяются одним
+        запросом к БД, чтобы не отвергнуть существующий ингредиент.
+        """
+        by_id = self.by_id()
+        existing = {pk for pk in ids if pk in by_id}
+        missing = set(ids) - existing
+        if missing:
+            existing.update(Ingredient.objects.filter(
+                id__in=missing
+            ).values_list('id', flat=True))
+        return existing
+
+    def get(self, pk):
+        """Строка ингредиента по id или None. Строку нельзя изменять."""
+        return self.by_id().get(pk)
+
+    def by_id(self):
+        """Снимок id -> строка ингредиента. Словарь и строки нельзя изменять."""
+        _, _, by_id = self._snapshot.get()
+        return by_id
+
+    def _build(self):
+        entries = sorted(
+            (fold(name), name, measurement_unit, pk)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).order_by().iterator()
+        )
+        keys = [entry[0] for entry in entries]
+        rows = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, name, measurement_unit, pk in entries
+        ]
+        return keys, rows, {row['id']: row for row in rows}
+
+
+ingredient_index = IngredientPrefixIndex()
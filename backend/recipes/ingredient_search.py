@@ -0,0 +1,104 @@
+"""
+Нечеткий поиск ингредиентов по названию (?name=...&fuzzy=1).
+
+Подходят названия, начинающиеся с запроса, и названия, похожие
+на него по триграммам (опечатки вроде «малако»). Сначала идут
+совпадения по префиксу, затем остальные по убыванию сходства.
+
+PostgreSQL: поиск выполняется в БД по индексам миграции
+0009_ingredient_fuzzy_search — функциональному lower(name)
+varchar_pattern_ops для LIKE 'префикс%' и GIN-индексу pg_trgm по
+lower(name) для оператора сходства %. Порог сходства задается
+settings.INGREDIENT_FUZZY_THRESHOLD на время транзакции запроса.
+DDL индексов записан в самой миграции, здесь только их имена.
+
+Остальные СУБД: то же ранжирование на Python по индексу ингредиентов
+в памяти (recipes.ingredient_index), триграммы строятся так же,
+как в pg_trgm.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .ingredient_index import fold, ingredient_index
+
+TABLE = 'recipes_ingredient'
+PATTERN_INDEX = 'recipes_ingredient_name_lower_pattern'
+TRIGRAM_INDEX = 'recipes_ingredient_name_lower_trgm'
+
+# % в шаблоне экранирован для DB-API, в БД уходит оператор сходства %
+POSTGRESQL_SEARCH = f"""
+    SELECT id, name, measurement_unit
+    FROM {TABLE}
+    WHERE lower(name) LIKE %(prefix)s OR lower(name) %% %(query)s
+    ORDER BY
+        lower(name) LIKE %(prefix)s DESC,
+        similarity(lower(name), %(query)s) DESC,
+        name, id
+    LIMIT %(limit)s
+"""
+
+WORD = re.compile(r'\w+')
+
+
+def like_prefix(text):
+    """Шаблон LIKE для префикса с экранированными спецсимволами."""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+
+def search_params(text, limit):
+    query = text.lower()
+    return {'prefix': like_prefix(query), 'query': query, 'limit': limit}
+
+
+def trigrams(text):
+    """Множество триграмм строки, как show_trgm в pg_trgm."""
+    result = set()
+    for word in WORD.findall(text.lower()):
+        padded = f'  {word} '
+        result.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return result
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def fuzzy_search(text, limit, using='default'):
+    """Ингредиенты для запроса text, не более limit, в порядке ранжирования."""
+    if connections[using].vendor == 'postgresql':
+        return postgresql_search(text, limit, using)
+    return python_search(text, limit)
+
+
+def postgresql_search(text, limit, using):
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+            [str(settings.INGREDIENT_FUZZY_THRESHOLD)]
+        )
+        cursor.execute(POSTGRESQL_SEARCH, search_params(text, limit))
+        return [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in cursor.fetchall()
+        ]
+
+
+def python_search(text, limit):
+    keys, rows = ingredient_index.entries()
+    key = fold(text)
+    query = trigrams(key)
+    threshold = settings.INGREDIENT_FUZZY_THRESHOLD
+    ranked = []
+    for position, (name, row) in enumerate(zip(keys, rows)):
+        is_prefix = name.startswith(key)
+        score = similarity(query, trigrams(name))
+        if is_prefix or score >= threshold:
+            # Список keys уже отсортирован, position сохраняет порядок по имени
+            ranked.append((not is_prefix, -score, position, row))
+    ranked.sort(key=lambda item: item[:3])
+    return [row for *_, row in ranked[:limit]]
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import rebuild_buckets
+
+
+class Command(BaseCommand):
+    """Команда для пересчета MinHash-полос всех рецептов."""
+
+    help = 'Пересчет MinHash-сигнатур и LSH-полос для поиска похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько рецептов записывать за одну вставку',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        recipes = rebuild_buckets(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитаны полосы {recipes} рецептов '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
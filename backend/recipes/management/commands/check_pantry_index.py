@@ -0,0 +1,61 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Ingredient
+from recipes.pantry import pantry_index, sql_match
+
+
+class Command(BaseCommand):
+    """Команда для сверки индекса подбора по продуктам с запросом к БД."""
+
+    help = 'Сравнение ответов обратного индекса продуктов и SQL-запроса'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=100,
+            help='Сколько случайных наборов продуктов проверить',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=10,
+            help='Сколько продуктов в наборе',
+        )
+        parser.add_argument(
+            '--min-coverage',
+            type=float,
+            default=0.5,
+            help='Порог покрытия рецепта',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Начальное значение генератора случайных чисел',
+        )
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Каталог ингредиентов пуст')
+        rng = random.Random(options['seed'])
+        size = min(options['size'], len(ingredient_ids))
+        mismatches = 0
+        for _ in range(options['samples']):
+            pantry = sorted(rng.sample(ingredient_ids, size))
+            expected = sql_match(pantry, options['min_coverage'])
+            actual = pantry_index.match(pantry, options['min_coverage'])
+            if actual != expected:
+                mismatches += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Продукты {pantry}: в индексе {len(actual)} рецептов, '
+                    f'в БД {len(expected)}'
+                ))
+        if mismatches:
+            raise CommandError(f'Найдено расхождений: {mismatches}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс совпадает с БД на {options["samples"]} наборах продуктов'
+        ))
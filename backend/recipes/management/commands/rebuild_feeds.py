@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    """Команда для пересборки лент подписок."""
+
+    help = 'Пересборка лент подписок и флагов feed_pull по текущим подпискам'
+
+    def handle(self, *args, **options):
+        entries = rebuild_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано записей в лентах: {entries}'
+        ))
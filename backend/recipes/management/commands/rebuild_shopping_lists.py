@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCart, ShoppingListItem
+from recipes.shopping_list import (
+    find_shopping_list_mismatches, rebuild_shopping_lists
+)
+
+
+class Command(BaseCommand):
+    """Команда для пересборки и проверки материализованных списков покупок."""
+
+    help = 'Пересборка или проверка списков покупок по содержимому корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить таблицу с корзинами, ничего не изменяя',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='users',
+            help='ID пользователя (можно указать несколько раз)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько пользователей обрабатывать за один проход',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or self.get_user_ids()
+        batch_size = options['batch_size']
+        batches = [
+            user_ids[start:start + batch_size]
+            for start in range(0, len(user_ids), batch_size)
+        ]
+
+        if options['verify']:
+            mismatches = []
+            for batch in batches:
+                mismatches.extend(find_shopping_list_mismatches(batch))
+            for user_id, ingredient_id, stored, expected in mismatches[:50]:
+                self.stdout.write(self.style.WARNING(
+                    f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                    f'в таблице {stored}, ожидается {expected}'
+                ))
+            if mismatches:
+                raise CommandError(
+                    f'Найдено расхождений: {len(mismatches)}'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок {len(user_ids)} пользователей совпадают с корзинами'
+            ))
+            return
+
+        rows = sum(rebuild_shopping_lists(batch) for batch in batches)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано {rows} позиций для {len(user_ids)} пользователей'
+        ))
+
+    def get_user_ids(self):
+        """Все пользователи, у которых есть корзина или список покупок."""
+        return sorted(
+            set(ShoppingCart.objects.order_by().values_list('user_id', flat=True).distinct())
+            | set(ShoppingListItem.objects.order_by().values_list('user_id', flat=True).distinct())
+        )
@@ -0,0 +1,340 @@
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+)
+from recipes.feed import rebuild_feeds
+from recipes.pantry import invalidate_pantry_index
+from recipes.shopping_list import rebuild_shopping_lists
+from recipes.similarity import rebuild_buckets
+from recipes.trending import rebuild_scores
+from users.models import Subscription, User
+
+USERNAME_PREFIX = 'seed_'
+SEED_PASSWORD = 'seed-password'
+SEED_IMAGE = 'recipes/images/seed.png'
+DEFAULT_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C94C', 'dessert'),
+    ('Выпечка', '#B0703C', 'baking'),
+    ('Суп', '#2F80ED', 'soup'),
+)
+
+
+class ZipfSampler:
+    """
+    Выбор индексов 0..size-1 с вероятностью, убывающей как 1 / rank^s.
+
+    Накопленные веса хранятся в array('d'): 8 байт на элемент.
+    """
+
+    def __init__(self, rng, size, exponent):
+        self.rng = rng
+        self.population = range(size)
+        self.cum_weights = array('d', accumulate(
+            1.0 / (rank ** exponent) for rank in range(1, size + 1)
+        ))
+
+    def sample(self, count):
+        return self.rng.choices(
+            self.population, cum_weights=self.cum_weights, k=count
+        )
+
+
+@contextmanager
+def explicit_created(*models):
+    """Позволяет задавать created явно, отключая auto_now_add."""
+    fields = [model._meta.get_field('created') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """Команда генерации синтетических данных для нагрузочного тестирования."""
+
+    help = 'Генерация детерминированного набора данных для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes', type=int, default=10000,
+                            help='Количество рецептов')
+        parser.add_argument('--min-ingredients', type=int, default=3,
+                            help='Минимум ингредиентов в рецепте')
+        parser.add_argument('--max-ingredients', type=int, default=15,
+                            help='Максимум ингредиентов в рецепте')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных рецептов на пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Среднее число рецептов в корзине пользователя')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить даты создания')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения Ципфа для популярности')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Размер пачки для bulk_create')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить ранее сгенерированных пользователей и их данные')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.period = timedelta(days=options['days']).total_seconds()
+
+        seeded = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if options['clear']:
+            deleted = self.clear(seeded)
+            self.stdout.write(f'Удалено объектов: {deleted}')
+        elif seeded.exists():
+            raise CommandError(
+                'Сгенерированные данные уже есть, используйте --clear'
+            )
+
+        ingredient_ids = array('q', Ingredient.objects.order_by(
+            'id'
+        ).values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Каталог ингредиентов пуст, сначала выполните import_ingredients'
+            )
+        tag_ids = self.ensure_tags()
+
+        with explicit_created(Recipe, Favorite, ShoppingCart, Subscription):
+            user_ids = self.create_users(options['users'])
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, options['zipf']
+            )
+            self.create_recipe_ingredients(
+                recipe_ids, ingredient_ids, options['zipf'],
+                options['min_ingredients'], options['max_ingredients']
+            )
+            self.create_recipe_tags(recipe_ids, tag_ids)
+            recipe_sampler = ZipfSampler(self.rng, len(recipe_ids), options['zipf'])
+            for model, mean in ((Favorite, options['favorites']),
+                                (ShoppingCart, options['carts'])):
+                self.create_user_recipe_links(
+                    model, mean, user_ids, recipe_ids, recipe_sampler
+                )
+            self.create_subscriptions(
+                options['subscriptions'], user_ids, options['zipf']
+            )
+
+        self.stdout.write('Пересборка списков покупок...')
+        for start in range(0, len(user_ids), self.batch_size):
+            rebuild_shopping_lists(list(user_ids[start:start + self.batch_size]))
+        self.stdout.write('Пересборка лент подписок...')
+        rebuild_feeds()
+        self.stdout.write('Расчет сигнатур похожих рецептов...')
+        rebuild_buckets(self.batch_size)
+        invalidate_pantry_index()
+        self.stdout.write('Расчет популярности рецептов...')
+        rebuild_scores(self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, рецептов: {len(recipe_ids)}'
+        ))
+
+    def clear(self, seeded):
+        """
+        Удаляет сгенерированных пользователей и их рецепты пачками по id.
+
+        Каскадное seeded.delete() из-за сигналов pre_delete/post_delete
+        рецепта загрузило бы все рецепты в память и выполнило запросы
+        для каждого. Здесь зависимые строки удаляются запросами по пачке
+        id, рецепты — одним DELETE без сигналов, а работа обработчиков
+        делается целиком: списки покупок затронутых пользователей
+        пересобираются, индекс подбора по продуктам сбрасывается.
+        Ленты, сигнатуры и популярность пересчитываются после генерации.
+        """
+        seeded_recipes = Recipe.objects.filter(author__in=seeded)
+        affected_ids = list(ShoppingCart.objects.filter(
+            recipe__in=seeded_recipes
+        ).exclude(user__in=seeded).order_by().values_list(
+            'user_id', flat=True
+        ).distinct())
+        dependents = {
+            (relation.related_model, relation.field.name)
+            for relation in Recipe._meta.get_fields(include_hidden=True)
+            if relation.auto_created and not relation.concrete
+            and (relation.one_to_many or relation.one_to_one)
+        }
+        table = connection.ops.quote_name(Recipe._meta.db_table)
+        deleted = 0
+        while True:
+            recipe_ids = list(seeded_recipes.order_by('id').values_list(
+                'id', flat=True
+            )[:self.batch_size])
+            if not recipe_ids:
+                break
+            placeholders = ', '.join(['%s'] * len(recipe_ids))
+            with transaction.atomic():
+                for model, field in dependents:
+                    count, _ = model.objects.filter(
+                        **{f'{field}__in': recipe_ids}
+                    ).delete()
+                    deleted += count
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {table} WHERE id IN ({placeholders})',
+                        recipe_ids
+                    )
+                    deleted += cursor.rowcount
+        while True:
+            user_ids = list(seeded.order_by('id').values_list(
+                'id', flat=True
+            )[:self.batch_size])
+            if not user_ids:
+                break
+            count, _ = User.objects.filter(id__in=user_ids).delete()
+            deleted += count
+        for start in range(0, len(affected_ids), self.batch_size):
+            rebuild_shopping_lists(affected_ids[start:start + self.batch_size])
+        invalidate_pantry_index()
+        return deleted
+
+    def random_created(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.period)
+
+    def ensure_tags(self):
+        for name, color, slug in DEFAULT_TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def create_in_batches(self, model, objects, label, collect_ids=False):
+        """
+        Создает объекты пачками. С collect_ids возвращает их id
+        в array('q'), иначе id не накапливаются.
+        """
+        ids = array('q') if collect_ids else None
+        batch = []
+        total = 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self.flush(model, batch, ids)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.flush(model, batch, ids)
+            total += len(batch)
+        self.stdout.write(f'{label}: {total}')
+        return ids
+
+    def flush(self, model, batch, ids=None):
+        with transaction.atomic():
+            created = model.objects.bulk_create(batch, ignore_conflicts=(
+                model in (Favorite, ShoppingCart, Subscription)
+            ))
+        if ids is not None:
+            ids.extend(obj.pk for obj in created if obj.pk is not None)
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        return self.create_in_batches(User, (
+            User(
+                username=f'{USERNAME_PREFIX}{index}',
+                email=f'{USERNAME_PREFIX}{index}@example.com',
+                first_name='Seed',
+                last_name=f'User {index}',
+                password=password,
+            )
+            for index in range(count)
+        ), 'Пользователи', collect_ids=True)
+
+    def create_recipes(self, count, user_ids, exponent):
+        authors = ZipfSampler(self.rng, len(user_ids), exponent)
+        return self.create_in_batches(Recipe, (
+            Recipe(
+                author_id=user_ids[authors.sample(1)[0]],
+                name=f'Рецепт {index}',
+                text=f'Описание синтетического рецепта {index}.',
+                image=SEED_IMAGE,
+                cooking_time=self.rng.randint(5, 180),
+                created=self.random_created(),
+            )
+            for index in range(count)
+        ), 'Рецепты', collect_ids=True)
+
+    def create_recipe_ingredients(self, recipe_ids, ingredient_ids, exponent,
+                                  minimum, maximum):
+        sampler = ZipfSampler(self.rng, len(ingredient_ids), exponent)
+        maximum = min(maximum, len(ingredient_ids))
+        minimum = min(minimum, maximum)
+
+        def generate():
+            for recipe_id in recipe_ids:
+                count = self.rng.randint(minimum, maximum)
+                chosen = set()
+                while len(chosen) < count:
+                    chosen.update(sampler.sample(count - len(chosen)))
+                for index in chosen:
+                    yield RecipeIngredient(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_ids[index],
+                        amount=self.rng.randint(1, 500),
+                    )
+
+        self.create_in_batches(RecipeIngredient, generate(), 'Ингредиенты в рецептах')
+
+    def create_recipe_tags(self, recipe_ids, tag_ids):
+        through = Recipe.tags.through
+
+        def generate():
+            for recipe_id in recipe_ids:
+                for tag_id in self.rng.sample(tag_ids, self.rng.randint(1, min(3, len(tag_ids)))):
+                    yield through(recipe_id=recipe_id, tag_id=tag_id)
+
+        self.create_in_batches(through, generate(), 'Теги рецептов')
+
+    def create_user_recipe_links(self, model, mean, user_ids, recipe_ids, sampler):
+        def generate():
+            for user_id in user_ids:
+                count = min(self.rng.randint(0, 2 * mean), len(recipe_ids))
+                for index in set(sampler.sample(count)):
+                    yield model(
+                        user_id=user_id,
+                        recipe_id=recipe_ids[index],
+                        created=self.random_created(),
+                    )
+
+        self.create_in_batches(model, generate(), model._meta.verbose_name_plural)
+
+    def create_subscriptions(self, mean, user_ids, exponent):
+        sampler = ZipfSampler(self.rng, len(user_ids), exponent)
+
+        def generate():
+            for user_id in user_ids:
+                count = min(self.rng.randint(0, 2 * mean), len(user_ids) - 1)
+                for index in set(sampler.sample(count)):
+                    author_id = user_ids[index]
+                    if author_id != user_id:
+                        yield Subscription(
+                            user_id=user_id,
+                            author_id=author_id,
+                            created=self.random_created(),
+                        )
+
+        self.create_in_batches(Subscription, generate(), 'Подписки')
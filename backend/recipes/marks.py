@@ -0,0 +1,114 @@
+"""
+Отметки рецептов пользователем: избранное и корзина покупок.
+
+Добавление и удаление пачки рецептов — по одному SQL-запросу:
+INSERT ... ON CONFLICT DO NOTHING и DELETE, оба с RETURNING recipe_id.
+Уже существующие отметки не считаются ошибкой, а RETURNING сообщает,
+какие строки действительно изменились. Только по ним обновляются
+список покупок (recipes.shopping_list) и популярность
+(recipes.trending), поэтому повторное или параллельное добавление
+не учитывается дважды.
+
+Вставка с ON CONFLICT и RETURNING есть в PostgreSQL и SQLite 3.35+.
+bulk_create(ignore_conflicts=True) не подходит: он не сообщает,
+какие строки вставлены.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ShoppingCart
+from .shopping_list import add_recipes_to_list, remove_recipes_from_list
+from .trending import FAVORITE, SHOPPING_CART, record_activity
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+
+
+def insert_marks(model, user, recipe_ids):
+    """Создает отметки, возвращает id рецептов, для которых они созданы."""
+    if not recipe_ids:
+        return set()
+    table = connection.ops.quote_name(model._meta.db_table)
+    rows = ', '.join(['(%s, %s, %s)'] * len(recipe_ids))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    params = [
+        value for recipe_id in recipe_ids for value in (user.id, recipe_id, now)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, recipe_id, created) VALUES {rows} '
+            f'ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING recipe_id',
+            params
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def delete_marks(model, user, recipe_ids):
+    """Удаляет отметки, возвращает id рецептов, у которых они были."""
+    if not recipe_ids:
+        return set()
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE user_id = %s '
+            f'AND recipe_id IN ({placeholders}) RETURNING recipe_id',
+            [user.id, *recipe_ids]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+@transaction.atomic
+def add_favorites(user, recipe_ids):
+    added = insert_marks(Favorite, user, recipe_ids)
+    record_activity(sorted(added), FAVORITE)
+    return added
+
+
+@transaction.atomic
+def remove_favorites(user, recipe_ids):
+    return delete_marks(Favorite, user, recipe_ids)
+
+
+@transaction.atomic
+def add_to_cart(user, recipe_ids):
+    added = insert_marks(ShoppingCart, user, recipe_ids)
+    if added:
+        add_recipes_to_list(user, added)
+        record_activity(sorted(added), SHOPPING_CART)
+    return added
+
+
+@transaction.atomic
+def remove_from_cart(user, recipe_ids):
+    removed = delete_marks(ShoppingCart, user, recipe_ids)
+    if removed:
+        remove_recipes_from_list(user, removed)
+    return removed
+
+
+def apply_batch(change, user, recipe_ids, done, unchanged):
+    """
+    Применяет change к существующим рецептам из recipe_ids и возвращает
+    статус по каждому id в порядке запроса: done, unchanged или NOT_FOUND.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    existing = set(Recipe.objects.filter(
+        id__in=recipe_ids
+    ).values_list('id', flat=True))
+    changed = change(user, [
+        recipe_id for recipe_id in recipe_ids if recipe_id in existing
+    ])
+    return [
+        {
+            'id': recipe_id,
+            'status': (
+                NOT_FOUND if recipe_id not in existing
+                else done if recipe_id in changed else unchanged
+            ),
+        }
+        for recipe_id in recipe_ids
+    ]
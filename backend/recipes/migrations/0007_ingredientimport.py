@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, verbose_name='Файл')),
+                ('checksum', models.CharField(db_index=True, max_length=64, verbose_name='SHA-256 файла')),
+                ('inserted', models.PositiveIntegerField(verbose_name='Добавлено')),
+                ('skipped', models.PositiveIntegerField(verbose_name='Пропущено')),
+                ('invalid', models.PositiveIntegerField(verbose_name='Некорректных строк')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата импорта')),
+            ],
+            options={
+                'verbose_name': 'Импорт ингредиентов',
+                'verbose_name_plural': 'Импорты ингредиентов',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,91 @@
+from django.db import migrations
+
+# SQL скопирован в миграцию, чтобы история не зависела от recipes.search
+INSTALL = {
+    'postgresql': [
+        """
+        ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(text, '')), 'B')
+        ) STORED
+        """,
+        """
+        CREATE INDEX recipes_recipe_search_vector_gin
+        ON recipes_recipe USING GIN (search_vector)
+        """,
+    ],
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING fts5(
+            name, text,
+            content='recipes_recipe', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+        AFTER INSERT ON recipes_recipe
+        BEGIN
+            INSERT INTO recipes_recipe_fts(rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+        AFTER DELETE ON recipes_recipe
+        BEGIN
+            INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+        AFTER UPDATE OF name, text ON recipes_recipe
+        BEGIN
+            INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+            INSERT INTO recipes_recipe_fts(rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END
+        """,
+        # Заполняет индекс по уже существующим рецептам
+        "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')",
+    ],
+}
+
+DROP = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS recipes_recipe_search_vector_gin',
+        'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+        'DROP TABLE IF EXISTS recipes_recipe_fts',
+    ],
+}
+
+
+def forward(apps, schema_editor):
+    for sql in INSTALL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def backward(apps, schema_editor):
+    for sql in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredientimport'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# SQL скопирован в миграцию, чтобы история не зависела
+# от recipes.ingredient_search
+POSTGRESQL_INSTALL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_lower_pattern '
+    'ON recipes_ingredient (lower(name) varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_lower_trgm '
+    'ON recipes_ingredient USING GIN (lower(name) gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS recipes_ingredient_name_lower_trgm',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_lower_pattern',
+]
+
+
+def forward(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_INSTALL:
+            schema_editor.execute(sql)
+
+
+def backward(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(verbose_name='Хеш полосы')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='recipes.recipe')),
+            ],
+            options={
+                'verbose_name': 'Полоса MinHash',
+                'verbose_name_plural': 'Полосы MinHash',
+                'indexes': [models.Index(fields=['bucket', 'recipe'], name='recipebucket_bucket_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipetrend'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipeingredient',
+            options={'ordering': ['recipe_id', 'position', 'id'], 'verbose_name': 'Ингредиент в рецепте', 'verbose_name_plural': 'Ингредиенты в рецептах'},
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Позиция в рецепте'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['recipe', 'position', 'id'], name='recipeingredient_order_idx'),
+        ),
+    ]
@@ -84,6 +84,14 @@ class Recipe(models.Model):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-created']
+        indexes = [
+            # Общая лента и лента автора, в том числе курсорная (created, id)
+            models.Index(fields=['-created', '-id'], name='recipe_created_idx'),
+            models.Index(
+                fields=['author', '-created', '-id'],
+                name='recipe_author_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -109,11 +117,25 @@ class RecipeIngredient(models.Model):
             MaxValueValidator(MAX_INGREDIENT_AMOUNT)
         ]
     )
+    position = models.PositiveSmallIntegerField(
+        'Позиция в рецепте',
+        default=0
+    )
 
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
-        ordering = ['recipe', 'ingredient']
+        # Сортировка по полям связей через recipe и ingredient добавляла
+        # JOIN с рецептами и ингредиентами в каждую выборку. position
+        # хранит порядок, в котором автор перечислил ингредиенты; у строк,
+        # созданных до появления поля, он совпадает с порядком id
+        ordering = ['recipe_id', 'position', 'id']
+        indexes = [
+            models.Index(
+                fields=['recipe', 'position', 'id'],
+                name='recipeingredient_order_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
@@ -144,6 +166,13 @@ class Favorite(models.Model):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         ordering = ['-created']
+        indexes = [
+            # Список пользователя по дате, recipe в ключе покрывает выборку id
+            models.Index(
+                fields=['user', '-created', 'recipe'],
+                name='favorite_user_created_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'recipe'],
@@ -174,6 +203,13 @@ class ShoppingCart(models.Model):
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзина покупок'
         ordering = ['-created']
+        indexes = [
+            # Список пользователя по дате, recipe в ключе покрывает выборку id
+            models.Index(
+                fields=['user', '-created', 'recipe'],
+                name='shoppingcart_user_created_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'recipe'],
@@ -185,6 +221,93 @@ class ShoppingCart(models.Model):
         return f"{self.user.email} добавил в корзину {self.recipe.name}"
 
 
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика, записывается при публикации рецепта."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Копия Recipe.created: лента сортируется без JOIN с рецептами
+    created = models.DateTimeField('Дата публикации рецепта')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_timeline_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-recipe'],
+                name='timeline_user_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe.name} в ленте {self.user.email}"
+
+
+class RecipeBucket(models.Model):
+    """
+    Хеш полосы MinHash-сигнатуры рецепта (см. recipes.similarity).
+    Рецепты с одинаковым bucket — кандидаты в похожие.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='lsh_buckets'
+    )
+    bucket = models.BigIntegerField('Хеш полосы')
+
+    class Meta:
+        verbose_name = 'Полоса MinHash'
+        verbose_name_plural = 'Полосы MinHash'
+        indexes = [
+            # recipe в ключе: кандидаты выбираются только из индекса
+            models.Index(fields=['bucket', 'recipe'], name='recipebucket_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.bucket}"
+
+
+class RecipeTrend(models.Model):
+    """
+    Популярность рецепта с затуханием по времени (см. recipes.trending).
+    Строка есть только у рецептов с добавлениями в избранное или корзину.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trend'
+    )
+    # Логарифм суммы вкладов относительно recipes.trending.EPOCH
+    score = models.FloatField('Оценка популярности', null=True)
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(fields=['-score', '-recipe'], name='recipetrend_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.score}"
+
+
 class ShortLink(models.Model):
     """Модель коротких ссылок на рецепты."""
 
@@ -203,3 +326,57 @@ class ShortLink(models.Model):
 
     def __str__(self):
         return f"Короткая ссылка для {self.recipe.name}"
+
+
+class ShoppingListItem(models.Model):
+    """
+    Материализованный список покупок пользователя.
+
+    Хранит суммарное количество каждого ингредиента по всем рецептам
+    из корзины и обновляется вместе с корзиной и ингредиентами рецептов.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    total_amount = models.IntegerField('Общее количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_shopping_list_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user.email}: {self.ingredient.name} - {self.total_amount}"
+
+
+class IngredientImport(models.Model):
+    """Журнал успешных импортов каталога ингредиентов."""
+
+    source = models.CharField('Файл', max_length=255)
+    checksum = models.CharField('SHA-256 файла', max_length=64, db_index=True)
+    inserted = models.PositiveIntegerField('Добавлено')
+    skipped = models.PositiveIntegerField('Пропущено')
+    invalid = models.PositiveIntegerField('Некорректных строк')
+    created = models.DateTimeField('Дата импорта', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Импорт ингредиентов'
+        verbose_name_plural = 'Импорты ингредиентов'
+        ordering = ['-created']
+
+    def __str__(self):
+        return f"Импорт {self.source} от {self.created:%Y-%m-%d %H:%M}"
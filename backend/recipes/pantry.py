@@ -0,0 +1,257 @@
+"""
+Подбор рецептов по продуктам пользователя («что приготовить»).
+
+Покрытие рецепта — доля его ингредиентов, которые есть у пользователя.
+Подходят рецепты с покрытием не ниже порога, сортировка по убыванию
+покрытия, затем числа совпавших ингредиентов, затем id.
+
+Основной путь — обратный индекс в памяти процесса (PantryIndex):
+
+* для каждого ингредиента отсортированный список id рецептов
+  (array('I'), 4 байта на строку RecipeIngredient);
+* число ингредиентов рецепта в array('H') с индексом по id рецепта,
+  2 байта на рецепт.
+
+Миллион рецептов по 10 ингредиентов занимает около 42 МиБ. Запрос
+складывает списки только своих ингредиентов, к БД не обращается.
+
+Индекс строится одним проходом по RecipeIngredient и дальше обновляется
+по журналу изменений в кеше Django: после коммита изменения ингредиентов
+рецепта record_change дописывает его id в кольцевой журнал из
+PANTRY_JOURNAL_SIZE записей. Процесс, увидев новые записи, перечитывает
+ингредиенты только этих рецептов. Если записи уже вытеснены или версия
+RECIPE_INGREDIENTS сменилась (invalidate_pantry_index после массовой
+загрузки), индекс строится заново.
+
+sql_match — то же самое одним запросом с GROUP BY, используется при
+PANTRY_USE_INDEX = False и для сверки (команда check_pantry_index).
+"""
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, namedtuple
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from foodgram.metrics import record_cache
+from .models import RecipeIngredient
+from .versions import RECIPE_INGREDIENTS, bump_version, get_version
+
+SEQUENCE_KEY = 'foodgram:pantry:sequence'
+JOURNAL_KEY = 'foodgram:pantry:journal:{}'
+
+
+class PantryMatch(namedtuple('PantryMatch', 'recipe_id matched total')):
+    """Рецепт, число совпавших ингредиентов и всего ингредиентов."""
+
+    __slots__ = ()
+
+    @property
+    def coverage(self):
+        return self.matched / self.total
+
+    @property
+    def missing(self):
+        return self.total - self.matched
+
+
+def rank(matches):
+    return sorted(
+        matches,
+        key=lambda match: (-match.coverage, -match.matched, -match.recipe_id)
+    )
+
+
+def record_change(recipe_id):
+    """
+    Отмечает изменение ингредиентов рецепта (в том числе удаление).
+    Запись в журнал откладывается до коммита транзакции, иначе другой
+    процесс мог бы прочитать старый состав рецепта и пропустить правку.
+    """
+    transaction.on_commit(lambda: append_to_journal(recipe_id))
+
+
+def append_to_journal(recipe_id):
+    cache.add(SEQUENCE_KEY, 0, timeout=None)
+    try:
+        sequence = cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        # Счетчик вытеснен между add и incr
+        invalidate_pantry_index()
+        return
+    cache.set(
+        JOURNAL_KEY.format(sequence % settings.PANTRY_JOURNAL_SIZE),
+        (sequence, recipe_id), timeout=None
+    )
+
+
+def invalidate_pantry_index():
+    """Заставляет все процессы перестроить индекс целиком."""
+    bump_version(RECIPE_INGREDIENTS)
+
+
+def current_sequence():
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+class PantryIndex:
+    """Обратный индекс ингредиент -> рецепты."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (версия, номер записи журнала, списки рецептов, размеры рецептов);
+        # заменяется целиком, читатели не видят промежуточных состояний
+        self._state = None
+
+    def match(self, ingredient_ids, min_coverage):
+        """Рецепты с покрытием не ниже min_coverage, см. PantryMatch."""
+        postings, sizes = self.snapshot()
+        counts = Counter()
+        for ingredient_id in set(ingredient_ids):
+            counts.update(postings.get(ingredient_id, ()))
+        return rank(
+            PantryMatch(recipe_id, matched, sizes[recipe_id])
+            for recipe_id, matched in counts.items()
+            if matched >= sizes[recipe_id] * min_coverage
+        )
+
+    def snapshot(self):
+        version = get_version(RECIPE_INGREDIENTS)
+        sequence = current_sequence()
+        state = self._state
+        hit = state is not None and state[:2] == (version, sequence)
+        if not hit:
+            with self._lock:
+                state = self._state
+                if state is None or state[:2] != (version, sequence):
+                    state = self._refresh(state, version, sequence)
+                    self._state = state
+        record_cache('pantry_index', hit)
+        return state[2:]
+
+    def _refresh(self, state, version, sequence):
+        if (
+            state is None or state[0] != version or sequence < state[1]
+            or sequence - state[1] > settings.PANTRY_JOURNAL_SIZE
+        ):
+            return self._build(version, sequence)
+        recipe_ids = self._read_journal(state[1], sequence)
+        if recipe_ids is None:
+            return self._build(version, sequence)
+        postings, sizes = self._apply(state[2], state[3], recipe_ids)
+        return version, sequence, postings, sizes
+
+    def _read_journal(self, start, sequence):
+        """id рецептов из записей (start, sequence] или None, если их уже нет."""
+        size = settings.PANTRY_JOURNAL_SIZE
+        keys = {
+            number: JOURNAL_KEY.format(number % size)
+            for number in range(start + 1, sequence + 1)
+        }
+        entries = cache.get_many(keys.values())
+        recipe_ids = set()
+        for number, key in keys.items():
+            entry = entries.get(key)
+            if entry is None or entry[0] != number:
+                return None
+            recipe_ids.add(entry[1])
+        return recipe_ids
+
+    def _build(self, version, sequence):
+        postings = {}
+        sizes = array('H')
+        rows = RecipeIngredient.objects.order_by(
+            'recipe_id', 'ingredient_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator(chunk_size=10000)
+        for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+            total = 0
+            for _, ingredient_id in group:
+                postings.setdefault(ingredient_id, array('I')).append(recipe_id)
+                total += 1
+            grow(sizes, recipe_id)
+            sizes[recipe_id] = total
+        return version, sequence, postings, sizes
+
+    def _apply(self, postings, sizes, recipe_ids):
+        """Копия индекса с новым составом рецептов recipe_ids."""
+        postings = dict(postings)
+        sizes = array('H', sizes)
+        copied = set()
+
+        def writable(ingredient_id):
+            if ingredient_id not in copied:
+                copied.add(ingredient_id)
+                postings[ingredient_id] = array(
+                    'I', postings.get(ingredient_id, ())
+                )
+            return postings[ingredient_id]
+
+        stale = {
+            recipe_id: sizes[recipe_id]
+            for recipe_id in recipe_ids
+            if recipe_id < len(sizes) and sizes[recipe_id]
+        }
+        if stale:
+            for ingredient_id, recipes in list(postings.items()):
+                for recipe_id in [
+                    recipe_id for recipe_id in stale
+                    if stale[recipe_id] and contains(recipes, recipe_id)
+                ]:
+                    recipes = writable(ingredient_id)
+                    del recipes[bisect_left(recipes, recipe_id)]
+                    stale[recipe_id] -= 1
+                if not any(stale.values()):
+                    break
+        for recipe_id in recipe_ids:
+            if recipe_id < len(sizes):
+                sizes[recipe_id] = 0
+
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by().values_list('recipe_id', 'ingredient_id'):
+            insort(writable(ingredient_id), recipe_id)
+            grow(sizes, recipe_id)
+            sizes[recipe_id] += 1
+        return postings, sizes
+
+
+def grow(sizes, recipe_id):
+    if recipe_id >= len(sizes):
+        sizes.extend(bytes(2 * (recipe_id + 1 - len(sizes))))
+
+
+def contains(recipes, recipe_id):
+    position = bisect_left(recipes, recipe_id)
+    return position < len(recipes) and recipes[position] == recipe_id
+
+
+def sql_match(ingredient_ids, min_coverage):
+    """То же, что PantryIndex.match, одним запросом к RecipeIngredient."""
+    rows = RecipeIngredient.objects.values('recipe_id').annotate(
+        total=Count('id'),
+        matched=Count('id', filter=Q(ingredient_id__in=set(ingredient_ids))),
+    ).filter(
+        matched__gt=0,
+        matched__gte=ExpressionWrapper(
+            F('total') * min_coverage, output_field=FloatField()
+        ),
+    ).annotate(
+        coverage=Cast('matched', FloatField()) / Cast('total', FloatField())
+    ).order_by('-coverage', '-matched', '-recipe_id').values_list(
+        'recipe_id', 'matched', 'total'
+    )
+    return [PantryMatch(*row) for row in rows]
+
+
+def match_recipes(ingredient_ids, min_coverage):
+    if settings.PANTRY_USE_INDEX:
+        return pantry_index.match(ingredient_ids, min_coverage)
+    return sql_match(ingredient_ids, min_coverage)
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,95 @@
+"""
+Заранее отрисованные ответы для редко меняющихся справочников.
+
+Полный список ингредиентов (около 2 200 строк) и тегов
+сериализуется один раз на версию справочника в JSON и gzip.
+Ответы отдаются с сильным ETag и на If-None-Match отвечают 304.
+"""
+import gzip
+import hashlib
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from foodgram.metrics import record_cache
+from .versions import VersionedValue
+
+
+class RenderedBody:
+    """Тело ответа в обычном и сжатом виде с ETag для каждого варианта."""
+
+    def __init__(self, body):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+
+class PrerenderedListMixin:
+    """
+    Миксин ViewSet для отдачи полного списка из готовых байтов.
+
+    prerender_version — имя версии справочника из recipes.versions.
+    """
+
+    prerender_version = None
+
+    @classmethod
+    def get_rendered_list(cls):
+        # Свой VersionedValue у каждого ViewSet, создается при первом вызове
+        if '_rendered_list' not in cls.__dict__:
+            cls._rendered_list = VersionedValue(
+                cls.prerender_version, cls.render_list,
+                cache_name=f'prerendered_{cls.prerender_version}'
+            )
+        return cls._rendered_list.get()
+
+    @classmethod
+    def render_list(cls):
+        serializer = cls.serializer_class(cls.queryset.all(), many=True)
+        return RenderedBody(JSONRenderer().render(serializer.data))
+
+    def prerendered_list(self, request):
+        """
+        Готовый ответ для полного списка в JSON или None,
+        если клиент запросил другой формат.
+        """
+        if request.accepted_renderer.format != 'json':
+            return None
+
+        rendered = self.get_rendered_list()
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        use_gzip = 'gzip' in accept_encoding
+        etag = rendered.gzip_etag if use_gzip else rendered.etag
+
+        not_modified = etag in parse_etags(
+            request.META.get('HTTP_IF_NONE_MATCH', '')
+        )
+        record_cache('http_etag', not_modified)
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                rendered.gzip_body if use_gzip else rendered.body,
+                content_type='application/json'
+            )
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        response = self.prerendered_list(request)
+        if response is None:
+            return super().list(request, *args, **kwargs)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # DRF перезаписывает Vary, поэтому добавляем Accept-Encoding после него
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
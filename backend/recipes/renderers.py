@@ -0,0 +1,30 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class PlainTextRenderer(BaseRenderer):
+    """
+    Рендерер текстовых ответов.
+
+    Нужен, чтобы согласование формата DRF принимало ?format=txt,
+    сами файлы отдаются потоково в обход рендерера.
+    """
+
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Рендерер CSV-ответов."""
+
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,87 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+Индекс живет вне моделей и создается миграцией 0008_recipe_search:
+
+* PostgreSQL — хранимая генерируемая колонка search_vector
+  (русская и английская конфигурации, название с весом A, описание
+  с весом B) и GIN-индекс по ней, ранжирование через ts_rank;
+* SQLite — внешняя FTS5-таблица recipes_recipe_fts, которую
+  триггеры синхронизируют при вставке, изменении и удалении рецепта
+  (в том числе при bulk_create и удалении queryset), ранжирование
+  через bm25. Стемминга нет, поэтому каждое слово ищется как префикс.
+
+Совпадения отбираются условием над самой таблицей рецептов
+(или id IN (...) для SQLite), без JOIN, поэтому поиск сочетается
+с остальными фильтрами, не размножая строки.
+
+SQL колонки, индексов и триггеров записан в самой миграции, чтобы
+история миграций не менялась вместе с этим модулем. SQLite пересоздает
+таблицу при некоторых изменениях схемы (AlterField, RemoveField и т.п.),
+триггеры при этом теряются: такая миграция должна создать их заново,
+скопировав SQL из 0008_recipe_search.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+TABLE = 'recipes_recipe'
+FTS_TABLE = 'recipes_recipe_fts'
+
+# Веса названия и описания в bm25, как у весов A и B в ts_rank
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+
+POSTGRESQL_TSQUERY = (
+    "(websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s))"
+)
+
+WORD = re.compile(r'\w+')
+
+
+def fts5_query(text):
+    """
+    Запрос FTS5 из пользовательской строки: все слова обязательны,
+    каждое ищется как префикс. Кавычки защищают от синтаксиса FTS5.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD.findall(text))
+
+
+def search_recipes(queryset, text):
+    """
+    Оставляет в queryset рецепты, подходящие под text, добавляет
+    аннотацию search_rank (чем больше, тем релевантнее) и сортирует
+    по ней, при равенстве — от новых к старым.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        params = (text, text)
+        queryset = queryset.filter(RawSQL(
+            f'{TABLE}.search_vector @@ {POSTGRESQL_TSQUERY}', params,
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank({TABLE}.search_vector, {POSTGRESQL_TSQUERY})', params,
+            output_field=FloatField(),
+        ))
+    elif vendor == 'sqlite':
+        match = fts5_query(text)
+        if not match:
+            return queryset.none()
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            # bm25 отрицателен и меньше для лучших совпадений
+            f'(SELECT -bm25({FTS_TABLE}, {NAME_WEIGHT}, {TEXT_WEIGHT}) '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND {FTS_TABLE}.rowid = {TABLE}.id)',
+            (match,),
+            output_field=FloatField(),
+        ))
+    else:
+        queryset = queryset.filter(
+            Q(name__icontains=text) | Q(text__icontains=text)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-search_rank', '-created', '-id')
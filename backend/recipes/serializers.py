@@ -1,3 +1,6 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from .models import (
@@ -6,30 +9,66 @@ from .models import (
     MIN_INGREDIENT_AMOUNT, MAX_INGREDIENT_AMOUNT,
     MIN_COOKING_TIME, MAX_COOKING_TIME
 )
+from .catalog import existing_tag_ids, tag_catalog
+from .ingredient_index import ingredient_index
+from .pantry import record_change
+from .shopping_list import propagate_recipe_change
+from .similarity import update_recipe_buckets
 from users.models import User, Subscription
-from foodgram.utils import Base64ImageField
+from foodgram.metrics import record_cache
+from foodgram.profiling import ProfiledListSerializer, ProfiledSerializerMixin
+from foodgram.utils import Base64ImageField, BulkPrimaryKeyRelatedField
 
 from users.serializers import UserSerializer
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор тега."""
 
     class Meta:
         model = Tag
+        list_serializer_class = ProfiledListSerializer
         fields = ('id', 'name', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор ингредиента."""
 
     class Meta:
         model = Ingredient
+        list_serializer_class = ProfiledListSerializer
         fields = ('id', 'name', 'measurement_unit')
 
 
+def recipe_ingredient_rows():
+    """Строки RecipeIngredient для ответа: без JOIN с ингредиентами."""
+    return RecipeIngredient.objects.only(
+        'recipe', 'ingredient', 'amount', 'position'
+    )
+
+
+def recipe_tag_ids():
+    """Prefetch тегов рецепта для CatalogTagsField: нужны только id."""
+    return Prefetch('tags', queryset=Tag.objects.only('id').order_by())
+
+
+def catalog_snapshot(field, name, load):
+    """
+    Снимок справочника, общий для всей сериализации: версия сверяется
+    один раз на корневой сериализатор, а не на каждую строку ответа.
+    """
+    snapshots = field.root.__dict__.setdefault('_catalog_snapshots', {})
+    if name not in snapshots:
+        snapshots[name] = load()
+    return snapshots[name]
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор ингредиента в рецепте."""
+    """
+    Сериализатор ингредиента в рецепте. Название и единица измерения
+    берутся из индекса ингредиентов в памяти, от строки RecipeIngredient
+    нужны только ingredient_id и amount.
+    """
 
     id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.ReadOnlyField(source='ingredient.name')
@@ -39,6 +78,38 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
+    def to_representation(self, instance):
+        rows = catalog_snapshot(self, 'ingredients', ingredient_index.by_id)
+        row = rows.get(instance.ingredient_id)
+        if row is None:
+            # Ингредиент добавлен после сборки индекса в этом процессе
+            return super().to_representation(instance)
+        return {**row, 'amount': instance.amount}
+
+
+class CatalogTagsField(serializers.Field):
+    """
+    Теги рецепта из справочника в памяти, в формате TagSerializer.
+    id тегов берутся из prefetch recipe_tag_ids(); без него они
+    читаются отдельным запросом, что учитывается как промах в метрике
+    кешей recipe_tags.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        prefetched = 'tags' in getattr(recipe, '_prefetched_objects_cache', {})
+        record_cache('recipe_tags', prefetched)
+        if prefetched:
+            tag_ids = [tag.id for tag in recipe.tags.all()]
+        else:
+            tag_ids = recipe.tags.values_list('id', flat=True)
+        by_id = catalog_snapshot(self, 'tags', tag_catalog.by_id)
+        return tag_catalog.tags(tag_ids, by_id=by_id)
+
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания связи рецепт-ингредиент."""
@@ -54,17 +125,18 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для списка рецептов."""
 
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(source='recipe_ingredients', many=True, read_only=True)
-    tags = TagSerializer(many=True, read_only=True)
+    tags = CatalogTagsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
+        list_serializer_class = ProfiledListSerializer
         fields = (
             'id', 'author', 'ingredients', 'is_favorited',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time', 'tags'
@@ -72,34 +144,45 @@ class RecipeListSerializer(serializers.ModelSerializer):
         # Запрещаем дополнительные поля в ответе
         extra_kwargs = {'created': {'write_only': True}}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Если JSON схема не ожидает поле tags, не сериализуем его вовсе
+        if self.context.get('exclude_tags', False):
+            self.fields.pop('tags', None)
+
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        # Если JSON схема не ожидает поле tags, удаляем его из ответа
-        if 'tags' in data and self.context.get('exclude_tags', False):
-            data.pop('tags')
-        return data
+        # Флаг подписки на автора приходит аннотацией рецепта,
+        # передаем его во вложенный UserSerializer
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return request.user.favorites.filter(recipe=obj).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return request.user.shopping_cart.filter(recipe=obj).exists()
         return False
 
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
+class RecipeCreateUpdateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецептов."""
 
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    # id тегов проверяются по справочнику в памяти, отсутствующие
+    # в нем — одним запросом к БД
+    tags = BulkPrimaryKeyRelatedField(
+        lookup=existing_tag_ids,
         required=False
     )
     image = Base64ImageField()
@@ -129,26 +212,95 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise ValidationError('Ингредиенты не должны повторяться.')
 
-        # Проверяем существование ингредиентов
-        existing_ingredients = Ingredient.objects.filter(id__in=ingredient_ids)
-        if len(existing_ingredients) != len(ingredient_ids):
-            raise ValidationError('Один или несколько ингредиентов не существуют.')
+        # Существование проверяем по индексу ингредиентов в памяти,
+        # id, которых в нем нет, — одним запросом к БД;
+        # ошибка указывается у каждого неизвестного id
+        existing = ingredient_index.existing_ids(ingredient_ids)
+        if len(existing) != len(ingredient_ids):
+            raise ValidationError([
+                {} if pk in existing
+                else {'id': [f'Ингредиент с id={pk} не существует.']}
+                for pk in ingredient_ids
+            ])
 
         return value
 
     def create_ingredients(self, recipe, ingredients_data):
         """Создаем связи рецепт-ингредиент."""
         recipe_ingredients = []
-        for ingredient_data in ingredients_data:
+        for position, ingredient_data in enumerate(ingredients_data):
             recipe_ingredients.append(
                 RecipeIngredient(
                     recipe=recipe,
                     ingredient_id=ingredient_data['id'],
-                    amount=ingredient_data['amount']
+                    amount=ingredient_data['amount'],
+                    position=position
                 )
             )
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит ингредиенты рецепта к ingredients_data, меняя только
+        отличающиеся строки: новые вставляются, измененные количества
+        и позиции обновляются одним bulk_update, лишние удаляются.
+
+        Позиции не обязаны идти подряд: если оставшиеся ингредиенты
+        перечислены в прежнем порядке, а новые добавлены в конец,
+        старые строки не переписываются. Иначе все строки получают
+        позиции по порядку ingredients_data.
+        Возвращает прежние количества {ingredient_id: amount}.
+        """
+        # Строки приходят в порядке Meta.ordering, т.е. по позиции
+        current = {row.ingredient_id: row for row in recipe.recipe_ingredients.all()}
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in current.items()
+        }
+        new_amounts = {item['id']: item['amount'] for item in ingredients_data}
+
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+
+        order = list(new_amounts)
+        kept = [ingredient_id for ingredient_id in current if ingredient_id in new_amounts]
+        if order[:len(kept)] == kept:
+            start = max((row.position + 1 for row in current.values()), default=0)
+            positions = {
+                ingredient_id: current[ingredient_id].position
+                if ingredient_id in current else start + index - len(kept)
+                for index, ingredient_id in enumerate(order)
+            }
+        else:
+            positions = {
+                ingredient_id: index for index, ingredient_id in enumerate(order)
+            }
+
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            position = positions[ingredient_id]
+            if row is not None and (row.amount, row.position) != (amount, position):
+                row.amount = amount
+                row.position = position
+                changed.append(row)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount', 'position'])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount,
+                position=positions[ingredient_id]
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        )
+        return old_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags = validated_data.pop('tags', [])
@@ -162,31 +314,52 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         )
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients_data)
+        update_recipe_buckets(
+            recipe, [item['id'] for item in ingredients_data], created=True
+        )
+        record_change(recipe.id)
 
         # Получаем обновленный рецепт со всеми связанными данными
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
 
-        # Обновляем основные поля рецепта
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-
-        # Обновляем теги
+        # Обновляем только изменившиеся поля рецепта
+        changed_fields = [
+            attr for attr, value in validated_data.items()
+            if getattr(instance, attr) != value
+        ]
+        for attr in changed_fields:
+            setattr(instance, attr, validated_data[attr])
+        if changed_fields:
+            instance.save(update_fields=changed_fields)
+
+        # set() сравнивает с текущими тегами и пишет только разницу
         if tags is not None:
             instance.tags.set(tags)
 
-        # Обновляем ингредиенты
+        # Обновляем ингредиенты и переносим изменения в списки покупок
         if ingredients_data is not None:
-            instance.recipe_ingredients.all().delete()
-            self.create_ingredients(instance, ingredients_data)
+            old_amounts = self.update_ingredients(instance, ingredients_data)
+            propagate_recipe_change(instance, old_amounts, {
+                item['id']: item['amount'] for item in ingredients_data
+            })
+            ingredient_ids = [item['id'] for item in ingredients_data]
+            if set(ingredient_ids) != set(old_amounts):
+                update_recipe_buckets(instance, ingredient_ids)
+                record_change(instance.id)
 
         return instance
 
     def to_representation(self, instance):
+        # Ингредиенты ответа загружаем одним запросом, названия
+        # подставляет IngredientInRecipeSerializer из индекса
+        prefetch_related_objects([instance], Prefetch(
+            'recipe_ingredients', queryset=recipe_ingredient_rows()
+        ))
         # Указываем, что нужно исключить поле tags из ответа
         context = self.context.copy()
         context['exclude_tags'] = True
@@ -195,15 +368,60 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
-class RecipeMinifiedSerializer(serializers.ModelSerializer):
+class RecipeMinifiedSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сокращенный сериализатор рецепта."""
 
     class Meta:
         model = Recipe
+        list_serializer_class = ProfiledListSerializer
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class UserWithRecipesSerializer(serializers.ModelSerializer):
+class SimilarRecipeSerializer(RecipeMinifiedSerializer):
+    """Похожий рецепт с коэффициентом сходства ингредиентов."""
+
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeMinifiedSerializer.Meta):
+        fields = RecipeMinifiedSerializer.Meta.fields + ('similarity',)
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по продуктам пользователя."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.PANTRY_MAX_INGREDIENTS
+    )
+    min_coverage = serializers.FloatField(
+        min_value=0.01,
+        max_value=1,
+        default=settings.PANTRY_MIN_COVERAGE
+    )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления в избранное или корзину."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.MARKS_BATCH_LIMIT
+    )
+
+
+class PantryRecipeSerializer(RecipeListSerializer):
+    """Рецепт с долей имеющихся ингредиентов и числом недостающих."""
+
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('coverage', 'missing')
+
+
+class UserWithRecipesSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор пользователя с рецептами для подписок."""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -213,12 +431,15 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
+        list_serializer_class = ProfiledListSerializer
         fields = (
             'id', 'username', 'first_name', 'last_name',
             'email', 'is_subscribed', 'recipes', 'recipes_count', 'avatar'
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return request.user.subscriptions.filter(author=obj).exists()
@@ -233,6 +454,10 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
         return None
 
     def get_recipes(self, obj):
+        # Рецепты могут быть заранее загружены одним запросом на страницу
+        if hasattr(obj, 'limited_recipes'):
+            return RecipeMinifiedSerializer(obj.limited_recipes, many=True).data
+
         request = self.context.get('request')
         recipes_limit = None
         if request:
@@ -248,10 +473,12 @@ class UserWithRecipesSerializer(serializers.ModelSerializer):
         return RecipeMinifiedSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
-class ShortLinkSerializer(serializers.ModelSerializer):
+class ShortLinkSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор короткой ссылки."""
 
     # Используем имя поля с дефисом, как требуется в схеме валидации
@@ -0,0 +1,266 @@
+import csv
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from users.models import User
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    """
+    Список покупок пользователя из материализованной таблицы.
+
+    Это одно чтение по индексу (user, ingredient), строки читаются
+    итератором, поэтому память не зависит от размера корзины.
+    """
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).annotate(
+        amount=F('total_amount')
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=500)
+
+
+def compute_shopping_list_totals(user_ids=None):
+    """
+    Эталонные суммы по корзинам: {user_id: {ingredient_id: amount}}.
+
+    Используется для пересборки и проверки материализованной таблицы.
+    """
+    # Оба условия в одном filter(): два вызова по многозначной связи
+    # дали бы два JOIN с корзинами и умножили суммы на число корзин
+    if user_ids is None:
+        carts = {'recipe__in_shopping_carts__isnull': False}
+    else:
+        carts = {'recipe__in_shopping_carts__user__in': user_ids}
+    rows = RecipeIngredient.objects.filter(**carts)
+    totals = defaultdict(dict)
+    for user_id, ingredient_id, amount in rows.values_list(
+        'recipe__in_shopping_carts__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by().iterator():
+        totals[user_id][ingredient_id] = amount
+    return totals
+
+
+def get_recipe_amounts(recipe_ids):
+    """Суммарные количества ингредиентов рецептов: {ingredient_id: amount}."""
+    return dict(
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient').annotate(total=Sum('amount')).order_by()
+    )
+
+
+@transaction.atomic(savepoint=False)
+def apply_deltas(user_ids, deltas):
+    """
+    Прибавляет deltas {ingredient_id: delta} к спискам покупок user_ids.
+
+    Существующие строки обновляются одним UPDATE с F()-арифметикой,
+    недостающие создаются, обнулившиеся удаляются. Вызывается в одной
+    транзакции с изменением корзины или рецепта.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    user_ids = list(user_ids)
+    if not deltas or not user_ids:
+        return
+
+    # Блокируем пользователей, чтобы параллельные изменения одного
+    # списка не создали одну и ту же строку дважды
+    list(
+        User.objects.select_for_update().filter(
+            id__in=user_ids
+        ).order_by('id').values_list('id', flat=True)
+    )
+
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    )
+    existing = set(items.values_list('user_id', 'ingredient_id'))
+    if existing:
+        items.update(total_amount=F('total_amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ),
+            default=Value(0)
+        ))
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, total_amount=delta
+        )
+        for user_id in user_ids
+        for ingredient_id, delta in deltas.items()
+        if delta > 0 and (user_id, ingredient_id) not in existing
+    )
+    if any(delta < 0 for delta in deltas.values()):
+        items.filter(total_amount__lte=0).delete()
+
+
+def add_recipes_to_list(user, recipe_ids):
+    """Добавляет ингредиенты рецептов в список покупок пользователя."""
+    apply_deltas([user.id], get_recipe_amounts(recipe_ids))
+
+
+def remove_recipes_from_list(user, recipe_ids):
+    """Вычитает ингредиенты рецептов из списка покупок пользователя."""
+    amounts = get_recipe_amounts(recipe_ids)
+    apply_deltas(
+        [user.id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()}
+    )
+
+
+def propagate_recipe_change(recipe, old_amounts, new_amounts):
+    """
+    Переносит изменение ингредиентов рецепта во все корзины с ним.
+
+    old_amounts и new_amounts: {ingredient_id: amount} до и после правки.
+    """
+    deltas = {
+        ingredient_id: new_amounts.get(ingredient_id, 0)
+        - old_amounts.get(ingredient_id, 0)
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    apply_deltas(
+        ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True),
+        deltas
+    )
+
+
+def remove_recipe_from_all_lists(recipe):
+    """
+    Вычитает рецепт из всех списков покупок перед его удалением.
+    Вызывается сигналом pre_delete, в том числе при каскадном удалении
+    рецептов вместе с автором.
+    """
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe=recipe
+    ).values_list('user_id', flat=True))
+    if user_ids:
+        apply_deltas(user_ids, {
+            ingredient_id: -amount
+            for ingredient_id, amount in get_recipe_amounts([recipe.id]).items()
+        })
+
+
+def remove_carts_from_lists(carts):
+    """Вычитает удаляемые записи корзины из списков их владельцев."""
+    recipes_by_user = defaultdict(set)
+    for cart in carts:
+        recipes_by_user[cart.user_id].add(cart.recipe_id)
+    for user_id, recipe_ids in recipes_by_user.items():
+        amounts = get_recipe_amounts(recipe_ids)
+        apply_deltas(
+            [user_id],
+            {ingredient_id: -amount for ingredient_id, amount in amounts.items()}
+        )
+
+
+def find_shopping_list_mismatches(user_ids=None):
+    """
+    Сравнивает материализованную таблицу с эталоном.
+
+    Возвращает список (user_id, ingredient_id, stored, expected).
+    """
+    expected = compute_shopping_list_totals(user_ids)
+    stored = defaultdict(dict)
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    for user_id, ingredient_id, amount in items.values_list(
+        'user_id', 'ingredient_id', 'total_amount'
+    ).iterator():
+        stored[user_id][ingredient_id] = amount
+
+    mismatches = []
+    for user_id in expected.keys() | stored.keys():
+        user_expected = expected.get(user_id, {})
+        user_stored = stored.get(user_id, {})
+        for ingredient_id in user_expected.keys() | user_stored.keys():
+            stored_amount = user_stored.get(ingredient_id)
+            expected_amount = user_expected.get(ingredient_id)
+            if stored_amount != expected_amount:
+                mismatches.append(
+                    (user_id, ingredient_id, stored_amount, expected_amount)
+                )
+    return mismatches
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids=None):
+    """Пересобирает материализованную таблицу из корзин. Возвращает число строк."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    created = ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id,
+                total_amount=amount
+            )
+            for user_id, amounts in compute_shopping_list_totals(
+                user_ids
+            ).items()
+            for ingredient_id, amount in amounts.items()
+        ),
+        batch_size=1000
+    )
+    return len(created)
+
+
+def render_txt(rows):
+    yield 'Список покупок:\n\n'
+    for row in rows:
+        yield (
+            f"• {row['ingredient__name']} "
+            f"({row['ingredient__measurement_unit']}) — {row['amount']}\n"
+        )
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow((
+            row['ingredient__name'],
+            row['ingredient__measurement_unit'],
+            row['amount'],
+        ))
+
+
+def render_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['ingredient__name'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+            'amount': row['amount'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+# Формат -> (генератор, Content-Type)
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json; charset=utf-8'),
+}
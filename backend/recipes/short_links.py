@@ -2,6 +2,7 @@ from django.shortcuts import get_object_or_404, redirect
 from django.http import Http404
 from django.views.generic import RedirectView
 
+from foodgram.query_budget import query_budget
 from recipes.models import ShortLink
 
 
@@ -17,12 +18,13 @@ class ShortLinkRedirectView(RedirectView):
         try:
             short_link = get_object_or_404(ShortLink, short_id=short_id)
             # Редирект на страницу рецепта
-            return f'/recipes/{short_link.recipe.id}/'
+            return f'/recipes/{short_link.recipe_id}/'
         except ShortLink.DoesNotExist:
             raise Http404("Короткая ссылка не найдена")
 
 
 # Функция-обертка для удобного использования в urls.py
+@query_budget(1)
 def short_link_redirect(request, short_id):
     """Функция редиректа по короткой ссылке."""
     view = ShortLinkRedirectView.as_view()
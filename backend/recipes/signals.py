@@ -0,0 +1,51 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .feed import fan_out_recipe
+from .models import Ingredient, Recipe, Tag
+from .pantry import invalidate_pantry_index, record_change
+from .shopping_list import remove_recipe_from_all_lists
+from .versions import INGREDIENTS, TAGS, bump_version
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    """Меняем версию каталога ингредиентов при любом изменении."""
+    bump_version(INGREDIENTS)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    """Удаление ингредиента каскадно меняет состав рецептов."""
+    invalidate_pantry_index()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    """Меняем версию справочника тегов при любом изменении."""
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, raw=False, **kwargs):
+    """Рассылаем новый рецепт по лентам подписчиков автора."""
+    if created and not raw:
+        fan_out_recipe(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """
+    Вычитаем рецепт из списков покупок, пока его корзины и ингредиенты
+    еще не удалены. Срабатывает и при каскадном удалении, например
+    вместе с автором.
+    """
+    remove_recipe_from_all_lists(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Убираем удаленный рецепт из индекса подбора по продуктам."""
+    record_change(instance.pk)
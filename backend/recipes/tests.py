@@ -1,14 +1,59 @@
-from django.test import TestCase
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Prefetch
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from recipes.models import Recipe, Tag, Ingredient, RecipeIngredient, Favorite, ShoppingCart
+from rest_framework.exceptions import ValidationError
+from recipes.models import (
+    Recipe, Tag, Ingredient, IngredientImport, RecipeIngredient, Favorite,
+    RecipeBucket, RecipeTrend, ShoppingCart, ShoppingListItem, ShortLink,
+    TimelineEntry
+)
+from foodgram.metrics import Counter as MetricCounter, Gauge, Histogram, Registry
+from foodgram.profiling import JsonFormatter
+from foodgram.utils import BulkPrimaryKeyRelatedField
+from foodgram.query_budget import (
+    QueryBudgetExceeded, duplicated_queries, get_violations, reset_violations
+)
+from recipes.ingredient_search import (
+    PATTERN_INDEX, POSTGRESQL_SEARCH, TRIGRAM_INDEX, search_params, similarity,
+    trigrams
+)
+from recipes.pantry import (
+    invalidate_pantry_index, pantry_index, record_change, sql_match
+)
+from recipes.serializers import (
+    RecipeListSerializer, TagSerializer, recipe_ingredient_rows, recipe_tag_ids
+)
+from recipes.shopping_list import find_shopping_list_mismatches
+from recipes.short_links import short_link_redirect
+from recipes.similarity import BANDS, band_buckets, update_recipe_buckets
+from recipes.trending import FAVORITE, rebuild_scores, record_activity, trending
+from recipes.versions import INGREDIENTS, TAGS, get_version
+from recipes.views import RecipeViewSet
+from users.models import Subscription
+from collections import Counter
+from unittest import mock, skipUnless
 import tempfile
+import threading
 from PIL import Image
 import base64
+import gzip
 import io
+import json
+import os
+import random
+import re
 
 User = get_user_model()
 
@@ -228,3 +273,2633 @@ class IngredientAPITest(APITestCase):
         response = self.client.get(url, {'name': 'xyz'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
+
+
+class RecipeListQueryCountTest(APITestCase):
+    """Тесты числа SQL-запросов при получении списка рецептов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            email='reader@example.com',
+            first_name='Reader',
+            last_name='User'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='Молоко',
+            measurement_unit='мл'
+        )
+
+    def create_recipes(self, count):
+        """Создает рецепты с ингредиентом, избранным и корзиной"""
+        for index in range(count):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.author
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe,
+                ingredient=self.ingredient,
+                amount=100
+            )
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def count_list_queries(self, limit):
+        """Возвращает число запросов для страницы заданного размера"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('recipes-list'), {'limit': limit}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        """Число запросов не растет вместе с размером страницы"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.create_recipes(6)
+        # Первый запрос строит индекс ингредиентов в памяти
+        self.count_list_queries(2)
+        self.assertEqual(
+            self.count_list_queries(2),
+            self.count_list_queries(6)
+        )
+
+    def test_list_uses_annotated_flags(self):
+        """Флаги избранного, корзины и подписки берутся из аннотаций"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.create_recipes(1)
+        Subscription.objects.create(user=self.user, author=self.author)
+
+        response = self.client.get(reverse('recipes-list'))
+        recipe = response.data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(recipe['ingredients'][0]['name'], 'Молоко')
+        self.assertNotIn('tags', recipe)
+
+
+class RecipeCursorPaginationTest(APITestCase):
+    """Тесты курсорной пагинации списка рецептов"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.author
+            )
+            for index in range(5)
+        ]
+        # Одинаковое время создания проверяет сортировку по id
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in self.recipes[:3]]
+        ).update(created=self.recipes[0].created)
+
+    def test_cursor_pages_cover_feed_without_duplicates(self):
+        """Переход по next обходит все рецепты в порядке ленты"""
+        expected = list(
+            Recipe.objects.order_by('-created', '-id').values_list('id', flat=True)
+        )
+        collected = []
+        response = self.client.get(
+            reverse('recipes-list'), {'pagination': 'cursor', 'limit': 2}
+        )
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            collected.extend(recipe['id'] for recipe in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(collected, expected)
+
+    def test_cursor_previous_link(self):
+        """Ссылка previous возвращает на предыдущую страницу"""
+        first = self.client.get(
+            reverse('recipes-list'), {'pagination': 'cursor', 'limit': 2}
+        )
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in back.data['results']],
+            [recipe['id'] for recipe in first.data['results']]
+        )
+
+    def test_invalid_cursor(self):
+        """Некорректный курсор возвращает 404"""
+        response = self.client.get(reverse('recipes-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_mode_is_default(self):
+        """Без параметров используется постраничная пагинация"""
+        response = self.client.get(reverse('recipes-list'), {'limit': 2})
+        self.assertEqual(response.data['count'], 5)
+
+
+class RecipeTagFilterTest(APITestCase):
+    """Тесты фильтра рецептов по тегам"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        self.dessert = Tag.objects.create(name='Десерт', slug='dessert')
+        self.both = self.create_recipe('Омлет', self.breakfast, self.dinner)
+        self.breakfast_only = self.create_recipe('Каша', self.breakfast)
+        self.dessert_only = self.create_recipe('Торт', self.dessert)
+
+    def create_recipe(self, name, *tags):
+        recipe = Recipe.objects.create(
+            name=name,
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.author
+        )
+        recipe.tags.set(tags)
+        return recipe
+
+    def get_list(self, tags):
+        response = self.client.get(reverse('recipes-list'), {'tags': tags})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_several_tags_return_each_recipe_once(self):
+        """Рецепт с несколькими выбранными тегами попадает в выдачу один раз"""
+        response = self.get_list(['breakfast', 'dinner'])
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            sorted(recipe['id'] for recipe in response.data['results']),
+            sorted([self.both.id, self.breakfast_only.id])
+        )
+
+    def test_slugs_are_case_insensitive(self):
+        """Слаги сравниваются без учета регистра"""
+        response = self.get_list(['DESSERT'])
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.dessert_only.id]
+        )
+
+    def test_unknown_slug_matches_nothing(self):
+        """Неизвестный тег не находит рецептов и не дает ошибку"""
+        self.assertEqual(self.get_list(['unknown']).data['count'], 0)
+
+    def test_new_tag_is_picked_up(self):
+        """Справочник тегов перестраивается после добавления тега"""
+        self.get_list(['breakfast'])
+        soup = Tag.objects.create(name='Суп', slug='soup')
+        recipe = self.create_recipe('Щи', soup)
+        response = self.get_list(['soup'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']], [recipe.id]
+        )
+
+    def test_tags_filter_adds_no_queries(self):
+        """Фильтр по тегам не добавляет запросов к списку"""
+        self.get_list(['breakfast'])
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(reverse('recipes-list'))
+        with CaptureQueriesContext(connection) as filtered:
+            self.get_list(['breakfast', 'dinner', 'dessert'])
+        self.assertEqual(
+            len(filtered.captured_queries), len(plain.captured_queries)
+        )
+        self.assertFalse(any(
+            'DISTINCT' in query['sql'] for query in filtered.captured_queries
+        ))
+
+
+class RecipeSearchTest(APITestCase):
+    """Тесты полнотекстового поиска рецептов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            email='reader@example.com',
+            first_name='Reader',
+            last_name='User'
+        )
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        self.borscht = Recipe.objects.create(
+            name='Борщ',
+            text='Свекла, капуста и говядина',
+            cooking_time=90,
+            author=self.author
+        )
+        self.borscht.tags.set([self.breakfast, self.dinner])
+        self.salad = Recipe.objects.create(
+            name='Винегрет',
+            text='Свекла, картофель и огурцы. Подходит к борщу',
+            cooking_time=30,
+            author=self.user
+        )
+        self.salad.tags.set([self.breakfast, self.dinner])
+        self.pancakes = Recipe.objects.create(
+            name='Pancakes',
+            text='Flour, milk and eggs',
+            cooking_time=20,
+            author=self.author
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('recipes-list'), {'search': query, **params}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search_by_name_and_text(self):
+        """Ищутся слова из названия и описания без учета регистра"""
+        self.assertEqual(
+            sorted(self.search('СВЕКЛА')),
+            sorted([self.borscht.id, self.salad.id])
+        )
+        self.assertEqual(self.search('milk'), [self.pancakes.id])
+        self.assertEqual(self.search('свекла milk'), [])
+
+    def test_name_match_ranks_first(self):
+        """Совпадение в названии важнее совпадения в описании"""
+        self.assertEqual(self.search('борщ'), [self.borscht.id, self.salad.id])
+
+    def test_search_combines_with_filters_without_duplicates(self):
+        """Поиск сочетается с фильтрами, рецепт с двумя тегами не дублируется"""
+        Favorite.objects.create(user=self.user, recipe=self.borscht)
+        ShoppingCart.objects.create(user=self.user, recipe=self.salad)
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(
+            sorted(self.search('свекла', tags=['breakfast', 'dinner'])),
+            sorted([self.borscht.id, self.salad.id])
+        )
+        response = self.client.get(reverse('recipes-list'), {
+            'search': 'свекла', 'tags': ['breakfast', 'dinner']
+        })
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            self.search('свекла', author=self.author.id), [self.borscht.id]
+        )
+        self.assertEqual(
+            self.search('свекла', is_favorited=1), [self.borscht.id]
+        )
+        self.assertEqual(
+            self.search('свекла', is_in_shopping_cart=1), [self.salad.id]
+        )
+
+    def test_index_follows_update_and_delete(self):
+        """Индекс обновляется при изменении и удалении рецепта"""
+        self.pancakes.text = 'Мука, молоко и яйца'
+        self.pancakes.save()
+        self.assertEqual(self.search('молоко'), [self.pancakes.id])
+        self.assertEqual(self.search('milk'), [])
+
+        self.pancakes.delete()
+        self.assertEqual(self.search('молоко'), [])
+
+    def test_query_syntax_is_escaped(self):
+        """Служебные символы в запросе не ломают поиск"""
+        self.assertEqual(self.search('"борщ'), [self.borscht.id, self.salad.id])
+        self.assertEqual(self.search('***'), [])
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class RecipeFeedTest(APITestCase):
+    """Тесты ленты подписок"""
+
+    def setUp(self):
+        self.reader = self.create_user('reader')
+        self.author = self.create_user('author')
+        self.other = self.create_user('other')
+        self.client.force_authenticate(self.reader)
+        self.feed_url = reverse('recipes-feed')
+
+    def create_user(self, name):
+        return User.objects.create_user(
+            username=name,
+            email=f'{name}@example.com',
+            first_name=name.title(),
+            last_name='User'
+        )
+
+    def create_recipe(self, author, name='Рецепт'):
+        return Recipe.objects.create(
+            name=name,
+            text='Описание рецепта',
+            cooking_time=10,
+            author=author
+        )
+
+    def subscribe(self, user, author):
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('users-subscribe', args=[author.id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(self.reader)
+
+    def feed_ids(self, **params):
+        response = self.client.get(self.feed_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_new_recipe_is_pushed_to_followers(self):
+        """Новый рецепт попадает в ленты подписчиков, но не остальных"""
+        self.subscribe(self.reader, self.author)
+        recipe = self.create_recipe(self.author)
+        self.create_recipe(self.other)
+        self.assertEqual(self.feed_ids(), [recipe.id])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=recipe, created=recipe.created
+        ).exists())
+
+    @override_settings(FEED_FANOUT_BATCH_SIZE=2)
+    def test_fan_out_is_batched(self):
+        """Рассылка вставляет записи пачками"""
+        followers = [self.create_user(f'follower{index}') for index in range(5)]
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=self.author) for user in followers
+        )
+        with CaptureQueriesContext(connection) as context:
+            recipe = self.create_recipe(self.author)
+        inserts = [
+            query for query in context.captured_queries
+            if 'INSERT' in query['sql'] and 'timelineentry' in query['sql']
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(recipe.timeline_entries.count(), 5)
+
+    @override_settings(FEED_BACKFILL_LIMIT=2)
+    def test_subscribe_backfills_and_unsubscribe_cleans(self):
+        """Подписка добавляет последние рецепты автора, отписка убирает их"""
+        recipes = [self.create_recipe(self.author) for _ in range(3)]
+        self.subscribe(self.reader, self.author)
+        self.assertEqual(
+            sorted(self.feed_ids()), sorted(recipe.id for recipe in recipes[1:])
+        )
+        response = self.client.delete(
+            reverse('users-subscribe', args=[self.author.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.feed_ids(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_popular_author_is_pulled(self):
+        """Рецепты популярного автора не рассылаются, а читаются лентой"""
+        pushed = self.create_recipe(self.other)
+        self.subscribe(self.reader, self.other)
+        self.subscribe(self.other, self.author)
+        self.subscribe(self.reader, self.author)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.feed_pull)
+
+        pulled = self.create_recipe(self.author)
+        self.assertFalse(pulled.timeline_entries.exists())
+        self.assertEqual(self.feed_ids(), [pulled.id, pushed.id])
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_cursor_pages_merge_sources(self):
+        """Курсор обходит записи ленты и рецепты популярных авторов по порядку"""
+        self.subscribe(self.other, self.author)
+        self.subscribe(self.reader, self.author)
+        self.subscribe(self.reader, self.other)
+        recipes = []
+        for index in range(5):
+            recipes.append(self.create_recipe(self.author, f'Популярный {index}'))
+            recipes.append(self.create_recipe(self.other, f'Обычный {index}'))
+        # Одинаковое время проверяет сортировку по id при слиянии
+        Recipe.objects.filter(id__in=[recipe.id for recipe in recipes[:4]]).update(
+            created=recipes[0].created
+        )
+        TimelineEntry.objects.filter(
+            recipe_id__in=[recipe.id for recipe in recipes[:4]]
+        ).update(created=recipes[0].created)
+        expected = list(Recipe.objects.filter(
+            id__in=[recipe.id for recipe in recipes]
+        ).order_by('-created', '-id').values_list('id', flat=True))
+
+        collected = []
+        response = self.client.get(self.feed_url, {'limit': 3})
+        pages = [response]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(response)
+        for page in pages:
+            self.assertEqual(page.status_code, status.HTTP_200_OK)
+            collected.extend(recipe['id'] for recipe in page.data['results'])
+        self.assertEqual(collected, expected)
+
+        back = self.client.get(pages[1].data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in back.data['results']],
+            [recipe['id'] for recipe in pages[0].data['results']]
+        )
+
+    @override_settings(FEED_PULL_THRESHOLD=3)
+    def test_rebuild_matches_incremental_feed(self):
+        """rebuild_feeds восстанавливает те же ленты и флаги"""
+        self.subscribe(self.reader, self.author)
+        self.subscribe(self.other, self.author)
+        for _ in range(3):
+            self.create_recipe(self.author)
+        expected = set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'created'
+        ))
+        TimelineEntry.objects.all().delete()
+        User.objects.filter(pk=self.author.pk).update(feed_pull=True)
+
+        call_command('rebuild_feeds', stdout=io.StringIO())
+        self.assertEqual(set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'created'
+        )), expected)
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.feed_pull)
+
+    def test_feed_requires_authentication(self):
+        """Лента доступна только авторизованным пользователям"""
+        self.client.force_authenticate(None)
+        response = self.client.get(self.feed_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+def recipe_admin_form(recipe, tag, amounts):
+    """
+    Данные формы рецепта в админке: прежние строки инлайна удаляются,
+    состав заменяется на amounts {ингредиент: количество}.
+    """
+    image = io.BytesIO()
+    Image.new('RGB', (10, 10), color='red').save(image, format='JPEG')
+    image.name = 'recipe.jpg'
+    image.seek(0)
+    rows = list(recipe.recipe_ingredients.order_by('id'))
+    data = {
+        'name': recipe.name,
+        'author': recipe.author_id,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': image,
+        'tags': [tag.id],
+        'recipe_ingredients-TOTAL_FORMS': len(rows) + len(amounts),
+        'recipe_ingredients-INITIAL_FORMS': len(rows),
+    }
+    for index, row in enumerate(rows):
+        data.update({
+            f'recipe_ingredients-{index}-id': row.id,
+            f'recipe_ingredients-{index}-recipe': recipe.id,
+            f'recipe_ingredients-{index}-ingredient': row.ingredient_id,
+            f'recipe_ingredients-{index}-amount': row.amount,
+            f'recipe_ingredients-{index}-position': row.position,
+            f'recipe_ingredients-{index}-DELETE': 'on',
+        })
+    for index, (ingredient, amount) in enumerate(amounts.items(), len(rows)):
+        data.update({
+            f'recipe_ingredients-{index}-recipe': recipe.id,
+            f'recipe_ingredients-{index}-ingredient': ingredient.id,
+            f'recipe_ingredients-{index}-amount': amount,
+            f'recipe_ingredients-{index}-position': index,
+        })
+    return data
+
+
+class SimilarRecipesTest(APITestCase):
+    """Тесты похожих рецептов по ингредиентам"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.tag = Tag.objects.create(name='Обед', color='#E26C2D', slug='lunch')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10)
+        ]
+        self.recipe = self.create_recipe('Исходный', range(6))
+        self.same = self.create_recipe('Такой же', range(6))
+        self.close = self.create_recipe('Почти такой же', range(7))
+        self.other = self.create_recipe('Другой', range(6, 10))
+
+    def create_recipe(self, name, positions):
+        recipe = Recipe.objects.create(
+            name=name,
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.author
+        )
+        ingredients = [self.ingredients[position] for position in positions]
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in ingredients
+        )
+        update_recipe_buckets(
+            recipe, [ingredient.id for ingredient in ingredients], created=True
+        )
+        return recipe
+
+    def similar(self, recipe):
+        response = self.client.get(reverse('recipes-similar', args=[recipe.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def buckets(self):
+        return sorted(RecipeBucket.objects.values_list('recipe_id', 'bucket'))
+
+    def test_admin_ingredient_edit_updates_buckets(self):
+        """Правка состава в админке пересчитывает полосы рецепта"""
+        self.author.is_staff = True
+        self.author.is_superuser = True
+        self.author.save()
+        self.client.force_login(self.author)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(
+                reverse('admin:recipes_recipe_change', args=[self.other.id]),
+                recipe_admin_form(self.other, self.tag, {
+                    ingredient: 10 for ingredient in self.ingredients[:6]
+                })
+            )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(
+            sorted(RecipeBucket.objects.filter(
+                recipe=self.other
+            ).values_list('bucket', flat=True)),
+            sorted(band_buckets([ingredient.id for ingredient in self.ingredients[:6]]))
+        )
+        self.assertIn(self.other.id, [recipe['id'] for recipe in self.similar(self.recipe)])
+
+    def test_band_buckets_are_deterministic(self):
+        """Полосы зависят только от множества ингредиентов"""
+        buckets = band_buckets([3, 1, 2])
+        self.assertEqual(len(buckets), BANDS)
+        self.assertEqual(buckets, band_buckets([1, 2, 3]))
+        self.assertNotEqual(buckets, band_buckets([1, 2, 4]))
+        self.assertEqual(band_buckets([]), [])
+
+    def test_similar_recipes_ranked_by_jaccard(self):
+        """Рецепты упорядочены по точному сходству, непохожие не попадают"""
+        data = self.similar(self.recipe)
+        self.assertEqual(
+            [recipe['id'] for recipe in data], [self.same.id, self.close.id]
+        )
+        self.assertEqual(data[0]['similarity'], 1.0)
+        self.assertEqual(data[1]['similarity'], round(6 / 7, 4))
+        self.assertEqual(
+            set(data[0]), {'id', 'name', 'image', 'cooking_time', 'similarity'}
+        )
+
+    def test_recipe_without_similar(self):
+        """Для рецепта без общих полос возвращается пустой список"""
+        lonely = self.create_recipe('Одинокий', [])
+        self.assertEqual(self.similar(lonely), [])
+
+    def test_limit_setting(self):
+        """Число похожих рецептов ограничено SIMILAR_RECIPES_LIMIT"""
+        with self.settings(SIMILAR_RECIPES_LIMIT=1):
+            data = self.similar(self.recipe)
+        self.assertEqual([recipe['id'] for recipe in data], [self.same.id])
+
+    def test_similar_within_budget(self):
+        """Ответ укладывается в бюджет при любом числе кандидатов"""
+        for index in range(10):
+            self.create_recipe(f'Копия {index}', range(6))
+        with CaptureQueriesContext(connection) as queries:
+            data = self.similar(self.recipe)
+        self.assertEqual(len(data), 6)
+        self.assertLessEqual(len(queries), 6)
+
+    def test_buckets_follow_ingredient_changes(self):
+        """Изменение набора ингредиентов через API пересчитывает полосы"""
+        self.client.force_authenticate(self.author)
+        ingredients = [self.ingredients[position] for position in range(6, 10)]
+        response = self.client.patch(
+            reverse('recipes-detail', args=[self.recipe.id]),
+            {
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 5} for ingredient in ingredients
+                ],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(RecipeBucket.objects.filter(
+                recipe=self.recipe
+            ).values_list('bucket', flat=True)),
+            sorted(band_buckets([ingredient.id for ingredient in ingredients]))
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in self.similar(self.recipe)], [self.other.id]
+        )
+
+    def test_created_recipe_gets_buckets(self):
+        """Рецепт, созданный через API, сразу находится среди похожих"""
+        self.client.force_authenticate(self.author)
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(buffer, format='JPEG')
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('recipes-list'), {
+                'name': 'Новый рецепт',
+                'text': 'Описание',
+                'cooking_time': 15,
+                'image': (
+                    'data:image/jpeg;base64,'
+                    + base64.b64encode(buffer.getvalue()).decode()
+                ),
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': self.ingredients[position].id, 'amount': 5}
+                    for position in range(6, 10)
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(
+            response.data['id'],
+            [recipe['id'] for recipe in self.similar(self.other)]
+        )
+
+    def test_buckets_deleted_with_recipe(self):
+        """Полосы удаляются вместе с рецептом"""
+        self.close.delete()
+        self.assertFalse(RecipeBucket.objects.filter(recipe_id=self.close.id).exists())
+        self.assertEqual(
+            [recipe['id'] for recipe in self.similar(self.recipe)], [self.same.id]
+        )
+
+    def test_build_command_matches_incremental_updates(self):
+        """Команда build_recipe_signatures пересобирает те же полосы"""
+        expected = self.buckets()
+        RecipeBucket.objects.all().delete()
+        call_command('build_recipe_signatures', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.buckets(), expected)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class PantryMatchTest(APITestCase):
+    """Тесты подбора рецептов по продуктам пользователя"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.tag = Tag.objects.create(name='Обед', color='#E26C2D', slug='lunch')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10)
+        ]
+        self.full = self.create_recipe('Все есть', range(3))
+        self.most = self.create_recipe('Почти все', range(4))
+        self.half = self.create_recipe('Половина', [0, 5])
+        self.none = self.create_recipe('Ничего', [7, 8])
+        # Рецепты выше созданы напрямую через ORM
+        invalidate_pantry_index()
+        self.url = reverse('recipes-pantry')
+
+    def create_recipe(self, name, positions):
+        recipe = Recipe.objects.create(
+            name=name,
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.author
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=self.ingredients[position], amount=10
+            )
+            for position in positions
+        )
+        return recipe
+
+    def pantry(self, positions, **params):
+        response = self.client.get(self.url, {
+            'ingredients': [self.ingredients[position].id for position in positions],
+            **params
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def ids(self, positions, **params):
+        return [recipe['id'] for recipe in self.pantry(positions, **params)['results']]
+
+    def test_ranked_by_coverage(self):
+        """Рецепты упорядочены по покрытию, ниже порога не попадают"""
+        data = self.pantry(range(3))
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']],
+            [self.full.id, self.most.id, self.half.id]
+        )
+        self.assertEqual(
+            [(recipe['coverage'], recipe['missing']) for recipe in data['results']],
+            [(1.0, 0), (0.75, 1), (0.5, 1)]
+        )
+        self.assertIn('ingredients', data['results'][0])
+
+    def test_min_coverage(self):
+        """Порог покрытия задается параметром min_coverage"""
+        self.assertEqual(
+            self.ids(range(3), min_coverage=0.75), [self.full.id, self.most.id]
+        )
+        self.assertEqual(self.ids([0], min_coverage=1), [])
+        self.assertEqual(self.ids([9]), [])
+
+    def test_invalid_params(self):
+        """Без продуктов или с неверным порогом возвращается 400"""
+        for params in (
+            {},
+            {'ingredients': 'x'},
+            {'ingredients': [1], 'min_coverage': 0},
+            {'ingredients': [1], 'min_coverage': 2},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_index_follows_api_changes(self):
+        """Создание, изменение и удаление рецептов через API обновляют индекс"""
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.ids([7, 8]), [self.none.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('recipes-detail', args=[self.none.id]),
+                {
+                    'tags': [self.tag.id],
+                    'ingredients': [
+                        {'id': self.ingredients[position].id, 'amount': 5}
+                        for position in (1, 2)
+                    ],
+                },
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ids([7, 8]), [])
+        self.assertEqual(self.ids([1, 2]), [self.none.id, self.full.id, self.most.id])
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(buffer, format='JPEG')
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('recipes-list'), {
+                'name': 'Новый рецепт',
+                'text': 'Описание',
+                'cooking_time': 15,
+                'image': (
+                    'data:image/jpeg;base64,'
+                    + base64.b64encode(buffer.getvalue()).decode()
+                ),
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': self.ingredients[9].id, 'amount': 5}
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.ids([9]), [response.data['id']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                reverse('recipes-detail', args=[self.full.id])
+            )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            self.ids(range(3)), [self.none.id, self.most.id, self.half.id]
+        )
+
+    def test_admin_ingredient_edit_updates_index(self):
+        """Правка состава рецепта в админке попадает в индекс"""
+        self.author.is_staff = True
+        self.author.is_superuser = True
+        self.author.save()
+        self.client.force_login(self.author)
+        self.assertEqual(self.ids([7, 8]), [self.none.id])
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('admin:recipes_recipe_change', args=[self.none.id]),
+                recipe_admin_form(self.none, self.tag, {self.ingredients[9]: 5})
+            )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.ids([7, 8]), [])
+        self.assertEqual(self.ids([9]), [self.none.id])
+
+    def test_journal_overflow_rebuilds_index(self):
+        """Если журнал изменений переполнен, индекс строится заново"""
+        self.ids([0])
+        with self.settings(PANTRY_JOURNAL_SIZE=2):
+            for recipe in (self.full, self.most, self.half):
+                RecipeIngredient.objects.filter(recipe=recipe).delete()
+                with self.captureOnCommitCallbacks(execute=True):
+                    record_change(recipe.id)
+            self.assertEqual(self.ids(range(3)), [])
+
+    def test_index_matches_sql(self):
+        """Индекс и запрос к БД дают одинаковый результат"""
+        rng = random.Random(7)
+        for index in range(30):
+            self.create_recipe(
+                f'Случайный {index}', rng.sample(range(10), rng.randint(1, 6))
+            )
+        invalidate_pantry_index()
+        ingredient_ids = [ingredient.id for ingredient in self.ingredients]
+        for _ in range(20):
+            pantry = rng.sample(ingredient_ids, rng.randint(1, 6))
+            for min_coverage in (0.3, 0.5, 1):
+                self.assertEqual(
+                    pantry_index.match(pantry, min_coverage),
+                    sql_match(pantry, min_coverage)
+                )
+        call_command(
+            'check_pantry_index', samples=10, size=4, seed=1, stdout=io.StringIO()
+        )
+
+    def test_sql_backend(self):
+        """При PANTRY_USE_INDEX = False используется запрос к БД"""
+        with self.settings(PANTRY_USE_INDEX=False), \
+                mock.patch.object(pantry_index, 'match') as match:
+            self.assertEqual(
+                self.ids(range(3)), [self.full.id, self.most.id, self.half.id]
+            )
+        match.assert_not_called()
+
+    def test_within_budget(self):
+        """Страница подбора укладывается в бюджет запросов"""
+        self.client.force_authenticate(self.author)
+        for index in range(10):
+            self.create_recipe(f'Копия {index}', range(3))
+        invalidate_pantry_index()
+        self.ids(range(3))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.ids(range(3))), 6)
+        self.assertLessEqual(len(queries), 4)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class RecipeTrendingTest(APITestCase):
+    """Тесты сортировки по популярности"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.users = [
+            User.objects.create_user(
+                username=f'user{index}',
+                email=f'user{index}@example.com',
+                first_name='User',
+                last_name=str(index)
+            )
+            for index in range(3)
+        ]
+        self.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.author
+            )
+            for index in range(4)
+        ]
+        self.url = reverse('recipes-list')
+
+    def trending_ids(self, **params):
+        response = self.client.get(self.url, {'ordering': 'trending', **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def add(self, user, recipe, action='favorite'):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            reverse(f'recipes-{action}', args=[recipe.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(None)
+
+    def test_ranked_by_activity(self):
+        """Рецепты упорядочены по числу добавлений, без активности не попадают"""
+        first, second, third, _ = self.recipes
+        self.add(self.users[0], second)
+        for user in self.users:
+            self.add(user, third)
+        self.add(self.users[1], second, 'shopping-cart')
+        self.add(self.users[2], first)
+        self.assertEqual(
+            self.trending_ids(), [third.id, second.id, first.id]
+        )
+
+    def test_recent_activity_outweighs_old(self):
+        """Старые добавления весят меньше новых"""
+        old, new = self.recipes[:2]
+        now = timezone.now()
+        hours = settings.TRENDING_HALF_LIFE_HOURS
+        record_activity([old.id], FAVORITE, now - timedelta(hours=3 * hours))
+        record_activity([old.id], FAVORITE, now - timedelta(hours=3 * hours))
+        record_activity([new.id], FAVORITE, now)
+        self.assertEqual(self.trending_ids(), [new.id, old.id])
+        # Восемь добавлений трехпериодной давности равны одному сейчас
+        for _ in range(6):
+            record_activity([old.id], FAVORITE, now - timedelta(hours=3 * hours))
+        scores = dict(RecipeTrend.objects.values_list('recipe_id', 'score'))
+        self.assertAlmostEqual(scores[old.id], scores[new.id])
+
+    def test_incremental_scores_match_rebuild(self):
+        """Пересчет командой дает те же оценки и убирает снятые отметки"""
+        first, second, third, _ = self.recipes
+        self.add(self.users[0], first)
+        self.add(self.users[1], first, 'shopping-cart')
+        self.add(self.users[0], second)
+        self.add(self.users[0], third)
+        expected = dict(RecipeTrend.objects.values_list('recipe_id', 'score'))
+        call_command('rebuild_trending', stdout=io.StringIO())
+        rebuilt = dict(RecipeTrend.objects.values_list('recipe_id', 'score'))
+        self.assertEqual(rebuilt.keys(), expected.keys())
+        for recipe_id, score in expected.items():
+            self.assertAlmostEqual(rebuilt[recipe_id], score, places=6)
+
+        Favorite.objects.filter(recipe=third).delete()
+        Favorite.objects.filter(recipe=second).update(
+            created=timezone.now() - timedelta(days=settings.TRENDING_WINDOW_DAYS + 1)
+        )
+        rebuild_scores()
+        self.assertEqual(self.trending_ids(), [first.id])
+
+    def test_trending_uses_page_numbers(self):
+        """Сортировка по популярности использует постраничную пагинацию"""
+        for recipe in self.recipes:
+            self.add(self.users[0], recipe)
+        response = self.client.get(self.url, {
+            'ordering': 'trending', 'pagination': 'cursor', 'limit': 2
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertIn('page=2', response.data['next'])
+
+    def test_combines_with_filters(self):
+        """Сортировка сочетается с фильтрами списка"""
+        other = User.objects.create_user(
+            username='other', email='other@example.com',
+            first_name='Other', last_name='User'
+        )
+        foreign = Recipe.objects.create(
+            name='Чужой', text='Описание', cooking_time=5, author=other
+        )
+        self.add(self.users[0], foreign)
+        self.add(self.users[0], self.recipes[0])
+        self.assertEqual(
+            self.trending_ids(author=self.author.id), [self.recipes[0].id]
+        )
+
+    def test_unknown_ordering(self):
+        """Неизвестная сортировка отклоняется"""
+        response = self.client.get(self.url, {'ordering': 'random'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_scores_deleted_with_recipe(self):
+        """Оценка удаляется вместе с рецептом"""
+        self.add(self.users[0], self.recipes[0])
+        self.recipes[0].delete()
+        self.assertFalse(RecipeTrend.objects.exists())
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class BatchMarksTest(APITestCase):
+    """Тесты пакетного добавления в избранное и корзину"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            first_name='User',
+            last_name='Test'
+        )
+        self.ingredient = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.recipes = []
+        for index in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.user
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=100
+            )
+            self.recipes.append(recipe)
+        self.ids = [recipe.id for recipe in self.recipes]
+        self.client.force_authenticate(self.user)
+
+    def batch(self, name, method, recipe_ids):
+        response = getattr(self.client, method)(
+            reverse(f'recipes-{name}-batch'), {'recipes': recipe_ids},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [(item['id'], item['status']) for item in response.data['results']]
+
+    def shopping_list(self):
+        return list(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'total_amount'))
+
+    def test_add_and_remove_favorites(self):
+        """Пачка добавляется и удаляется со статусом по каждому id"""
+        first, second, third = self.ids
+        Favorite.objects.create(user=self.user, recipe_id=second)
+        self.assertEqual(
+            self.batch('favorite', 'post', [first, second, 999, first]),
+            [(first, 'added'), (second, 'exists'), (999, 'not_found')]
+        )
+        self.assertEqual(
+            set(Favorite.objects.values_list('recipe_id', flat=True)),
+            {first, second}
+        )
+        self.assertEqual(
+            self.batch('favorite', 'delete', [first, third]),
+            [(first, 'removed'), (third, 'absent')]
+        )
+        self.assertEqual(
+            list(Favorite.objects.values_list('recipe_id', flat=True)), [second]
+        )
+        # Популярность учитывает только новые отметки
+        self.assertEqual(
+            set(RecipeTrend.objects.values_list('recipe_id', flat=True)), {first}
+        )
+
+    def test_cart_updates_shopping_list_once(self):
+        """Список покупок меняется только для реально измененных строк"""
+        first, second, third = self.ids
+        self.batch('shopping-cart', 'post', [first, second])
+        self.assertEqual(self.shopping_list(), [(self.ingredient.id, 200)])
+        self.assertEqual(
+            self.batch('shopping-cart', 'post', [first, second, third]),
+            [(first, 'exists'), (second, 'exists'), (third, 'added')]
+        )
+        self.assertEqual(self.shopping_list(), [(self.ingredient.id, 300)])
+        self.batch('shopping-cart', 'delete', [first, first, 999])
+        self.assertEqual(self.shopping_list(), [(self.ingredient.id, 200)])
+        self.batch('shopping-cart', 'delete', [second, third])
+        self.assertEqual(self.shopping_list(), [])
+
+    def test_single_statement_writes(self):
+        """Пачка пишется одним INSERT и одним DELETE"""
+        with CaptureQueriesContext(connection) as queries:
+            self.batch('favorite', 'post', self.ids)
+        inserts = [
+            query['sql'] for query in queries.captured_queries
+            if 'INSERT INTO "recipes_favorite"' in query['sql']
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('ON CONFLICT', inserts[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.batch('favorite', 'delete', self.ids)
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('DELETE FROM "recipes_favorite"')
+        ]), 1)
+
+    def test_single_actions_keep_behaviour(self):
+        """Одиночные действия возвращают прежние коды ответа"""
+        url = reverse('recipes-favorite', args=[self.ids[0]])
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_400_BAD_REQUEST)
+        missing = reverse('recipes-shopping-cart', args=[999])
+        self.assertEqual(self.client.post(missing).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_payload(self):
+        """Пустой или слишком большой список отклоняется"""
+        url = reverse('recipes-favorite-batch')
+        for payload in (
+            {},
+            {'recipes': []},
+            {'recipes': ['x']},
+            {'recipes': list(range(1, settings.MARKS_BATCH_LIMIT + 2))},
+        ):
+            response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_authentication(self):
+        """Пакетные действия доступны только авторизованным"""
+        self.client.force_authenticate(None)
+        response = self.client.post(
+            reverse('recipes-shopping-cart-batch'), {'recipes': self.ids},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RecipeUpdateWritesTest(APITestCase):
+    """Изменение рецепта пишет только отличающиеся строки"""
+
+    WRITE = re.compile(r'^(INSERT (?:OR IGNORE )?INTO|UPDATE|DELETE FROM) "(\w+)"')
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(name=f'Тег {index}', color='#E26C2D', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(12)
+        ]
+        self.recipe = Recipe.objects.create(
+            name='Рецепт',
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.user
+        )
+        self.recipe.tags.set(self.tags[:2])
+        self.amounts = {ingredient.id: 100 for ingredient in self.ingredients[:10]}
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=self.recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in self.amounts.items()
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.url = reverse('recipes-detail', args=[self.recipe.id])
+
+    def patch(self, amounts=None, tags=None, **fields):
+        amounts = self.amounts if amounts is None else amounts
+        tags = self.tags[:2] if tags is None else tags
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {
+                'ingredients': [
+                    {'id': pk, 'amount': amount} for pk, amount in amounts.items()
+                ],
+                'tags': [tag.id for tag in tags],
+                **fields,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        writes = Counter()
+        for query in queries.captured_queries:
+            match = self.WRITE.match(query['sql'])
+            if match:
+                writes[match.group(1).split()[0], match.group(2)] += 1
+        return writes
+
+    def stored_amounts(self):
+        return dict(self.recipe.recipe_ingredients.values_list('ingredient_id', 'amount'))
+
+    def test_unchanged_payload_writes_nothing(self):
+        """Тот же состав не порождает записей"""
+        self.assertEqual(self.patch(), Counter())
+
+    def test_amount_change_is_single_update(self):
+        """Изменение количества — один UPDATE без удаления и вставки"""
+        first = self.ingredients[0].id
+        writes = self.patch({**self.amounts, first: 250})
+        self.assertEqual(writes['UPDATE', 'recipes_recipeingredient'], 1)
+        self.assertEqual(writes['INSERT', 'recipes_recipeingredient'], 0)
+        self.assertEqual(writes['DELETE', 'recipes_recipeingredient'], 0)
+        self.assertEqual(self.stored_amounts()[first], 250)
+        self.assertEqual(writes['UPDATE', 'recipes_recipe'], 0)
+
+    def test_add_and_remove_ingredients(self):
+        """Добавление и удаление — по одному INSERT и DELETE"""
+        amounts = dict(self.amounts)
+        del amounts[self.ingredients[0].id]
+        amounts[self.ingredients[10].id] = 5
+        amounts[self.ingredients[11].id] = 7
+        writes = self.patch(amounts)
+        self.assertEqual(writes['INSERT', 'recipes_recipeingredient'], 1)
+        self.assertEqual(writes['DELETE', 'recipes_recipeingredient'], 1)
+        self.assertEqual(writes['UPDATE', 'recipes_recipeingredient'], 0)
+        self.assertEqual(self.stored_amounts(), amounts)
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                user=self.user
+            ).values_list('ingredient_id', 'total_amount')),
+            amounts
+        )
+
+    def test_reorder_keeps_submitted_order(self):
+        """Ответ перечисляет ингредиенты в порядке, присланном автором"""
+        amounts = dict(reversed(list(self.amounts.items())))
+        writes = self.patch(amounts)
+        self.assertEqual(writes['UPDATE', 'recipes_recipeingredient'], 1)
+        self.assertEqual(writes['INSERT', 'recipes_recipeingredient'], 0)
+        self.assertEqual(writes['DELETE', 'recipes_recipeingredient'], 0)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [item['id'] for item in response.data['ingredients']], list(amounts)
+        )
+
+        # Новый ингредиент в середине списка тоже встает на свое место
+        first, *rest = list(amounts.items())
+        amounts = dict([first, (self.ingredients[10].id, 5), *rest])
+        self.patch(amounts)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [item['id'] for item in response.data['ingredients']], list(amounts)
+        )
+
+    def test_tags_and_fields_diff(self):
+        """Теги и поля рецепта меняются только при отличиях"""
+        writes = self.patch(tags=self.tags[1:], name='Новое название')
+        self.assertEqual(writes['DELETE', 'recipes_recipe_tags'], 1)
+        self.assertEqual(writes['INSERT', 'recipes_recipe_tags'], 1)
+        self.assertEqual(writes['UPDATE', 'recipes_recipe'], 1)
+        self.assertEqual(sum(
+            count for (_, table), count in writes.items()
+            if table == 'recipes_recipeingredient'
+        ), 0)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(
+            set(self.recipe.tags.values_list('id', flat=True)),
+            {tag.id for tag in self.tags[1:]}
+        )
+
+    def test_failed_update_is_rolled_back(self):
+        """Ошибка посреди изменения откатывает всю правку"""
+        amounts = {**self.amounts, self.ingredients[0].id: 250}
+        with mock.patch(
+            'recipes.serializers.propagate_recipe_change',
+            side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.patch(amounts, name='Новое название')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Рецепт')
+        self.assertEqual(self.stored_amounts(), self.amounts)
+
+
+class RecipeRelatedIdsTest(APITestCase):
+    """Проверка id тегов и ингредиентов при создании рецепта"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(name=f'Тег {index}', color='#E26C2D', slug=f'tag{index}')
+            for index in range(4)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10)
+        ]
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(buffer, format='JPEG')
+        self.image = (
+            'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+        )
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post(self, tag_ids, ingredient_ids):
+        return self.client.post(reverse('recipes-list'), {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': self.image,
+            'tags': tag_ids,
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredient_ids],
+        }, format='json')
+
+    def test_unknown_and_repeated_tags(self):
+        """Ошибка указывается для каждого неверного id тега"""
+        response = self.post(
+            [self.tags[0].id, 999, self.tags[0].id], [self.ingredients[0].id]
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['details']['tags'], {
+            '1': ['Объект с id=999 не существует.'],
+            '2': [f'Значение {self.tags[0].id} указано повторно.'],
+        })
+
+    def test_unknown_ingredients(self):
+        """Ошибка указывается у каждого неизвестного ингредиента"""
+        response = self.post(
+            [self.tags[0].id], [self.ingredients[0].id, 998, 999]
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['details']['ingredients'], [
+            {},
+            {'id': ['Ингредиент с id=998 не существует.']},
+            {'id': ['Ингредиент с id=999 не существует.']},
+        ])
+
+    def test_constant_number_of_queries(self):
+        """Число запросов при создании не зависит от числа тегов и ингредиентов"""
+        ingredient_ids = [ingredient.id for ingredient in self.ingredients]
+        tag_ids = [tag.id for tag in self.tags]
+        self.post(tag_ids[:1], ingredient_ids[:1])
+        counts = []
+        for size in (1, 4):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(tag_ids[:size], ingredient_ids[:size * 2])
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertFalse([
+                query for query in queries.captured_queries
+                if '"recipes_tag"."id" IN' in query['sql']
+                or '"recipes_ingredient"."id" IN' in query['sql']
+            ])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(
+            set(recipe.tags.values_list('id', flat=True)), set(tag_ids)
+        )
+
+    def test_new_tag_is_accepted(self):
+        """Новый тег сразу проходит проверку"""
+        self.post([self.tags[0].id], [self.ingredients[0].id])
+        tag = Tag.objects.create(name='Новый', color='#000000', slug='new')
+        response = self.post([tag.id], [self.ingredients[0].id])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_ids_created_by_another_process(self):
+        """Теги и ингредиенты, которых нет в снимке процесса, не отвергаются"""
+        self.post([self.tags[0].id], [self.ingredients[0].id])
+        # Другой процесс меняет версию в своем кеше, этот ее не видит
+        with mock.patch('recipes.signals.bump_version'):
+            tag = Tag.objects.create(name='Новый', color='#000000', slug='new')
+            ingredient = Ingredient.objects.create(
+                name='Новый ингредиент', measurement_unit='г'
+            )
+        response = self.post(
+            [self.tags[0].id, tag.id], [self.ingredients[0].id, ingredient.id]
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.post([tag.id, 999], [ingredient.id, 998])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['details']['tags'], {
+            '1': ['Объект с id=999 не существует.'],
+        })
+
+    def test_field_with_queryset(self):
+        """Без справочника поле проверяет ключи одним запросом"""
+        field = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                field.run_validation([tag.id for tag in self.tags]),
+                [tag.id for tag in self.tags]
+            )
+        self.assertEqual(len(queries), 1)
+        with self.assertRaises(ValidationError) as context:
+            field.run_validation([self.tags[0].id, 999])
+        self.assertEqual(
+            context.exception.detail,
+            {1: ['Объект с id=999 не существует.']}
+        )
+
+
+class RecipeCatalogSerializationTest(APITestCase):
+    """Ингредиенты и теги в ответе берутся из справочников в памяти"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        self.milk = Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        self.flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.lunch = Tag.objects.create(name='Обед', color='#E26C2D', slug='lunch')
+        self.breakfast = Tag.objects.create(
+            name='Завтрак', color='#49B64E', slug='breakfast'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Блины',
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.author
+        )
+        self.recipe.tags.set([self.lunch, self.breakfast])
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.milk, amount=200
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.flour, amount=100
+        )
+
+    def get_ingredients(self):
+        response = self.client.get(reverse('recipes-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results'][0]['ingredients']
+
+    def test_list_does_not_join_ingredients(self):
+        """Список рецептов не читает таблицу ингредиентов"""
+        self.get_ingredients()
+        with CaptureQueriesContext(connection) as queries:
+            ingredients = self.get_ingredients()
+        self.assertEqual(ingredients, [
+            {'id': self.milk.id, 'name': 'Молоко', 'measurement_unit': 'мл', 'amount': 200},
+            {'id': self.flour.id, 'name': 'Мука', 'measurement_unit': 'г', 'amount': 100},
+        ])
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if '"recipes_ingredient"' in query['sql']
+        ])
+
+    def test_ingredient_change_reloads_catalog(self):
+        """Изменение ингредиента сразу видно в ответе"""
+        self.get_ingredients()
+        self.milk.measurement_unit = 'л'
+        self.milk.save()
+        self.assertEqual(self.get_ingredients()[0]['measurement_unit'], 'л')
+
+    def get_recipe(self):
+        return Recipe.objects.prefetch_related(
+            recipe_tag_ids(),
+            Prefetch('recipe_ingredients', queryset=recipe_ingredient_rows())
+        ).get(id=self.recipe.id)
+
+    def test_tags_from_catalog(self):
+        """Теги рецепта разворачиваются по справочнику в порядке имени"""
+        expected = [
+            {'id': self.breakfast.id, 'name': 'Завтрак', 'slug': 'breakfast'},
+            {'id': self.lunch.id, 'name': 'Обед', 'slug': 'lunch'},
+        ]
+        self.assertEqual(
+            TagSerializer(self.recipe.tags.all(), many=True).data, expected
+        )
+
+        recipe = self.get_recipe()
+        # Первое обращение строит справочник тегов
+        RecipeListSerializer(recipe).data
+        with CaptureQueriesContext(connection) as queries:
+            tags = RecipeListSerializer(recipe).data['tags']
+        self.assertEqual(tags, expected)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if '"recipes_tag"' in query['sql']
+        ])
+
+        self.lunch.name = 'Ужин'
+        self.lunch.save()
+        self.assertEqual(
+            RecipeListSerializer(self.get_recipe()).data['tags'][1]['name'],
+            'Ужин'
+        )
+
+    def test_tags_without_prefetch(self):
+        """Без загруженных id теги читаются одним запросом на рецепт"""
+        RecipeListSerializer(self.get_recipe()).data
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        with CaptureQueriesContext(connection) as queries:
+            tags = RecipeListSerializer(recipe).data['tags']
+        self.assertEqual(
+            [tag['slug'] for tag in tags], ['breakfast', 'lunch']
+        )
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if '"recipes_recipe_tags"' in query['sql']
+        ]), 1)
+
+    def test_catalog_version_checked_once_per_list(self):
+        """Версия справочников сверяется один раз на сериализацию списка"""
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                name=f'Оладьи {number}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.author
+            )
+            recipe.tags.set([self.lunch])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.milk, amount=100
+            )
+        recipes = Recipe.objects.prefetch_related(
+            recipe_tag_ids(),
+            Prefetch('recipe_ingredients', queryset=recipe_ingredient_rows())
+        )
+        with mock.patch(
+            'recipes.versions.get_version', wraps=get_version
+        ) as version:
+            data = RecipeListSerializer(recipes, many=True).data
+        self.assertEqual(len(data), 5)
+        self.assertEqual(
+            sorted(call.args[0] for call in version.call_args_list),
+            [INGREDIENTS, TAGS]
+        )
+
+
+class DownloadShoppingCartTest(APITestCase):
+    """Тесты скачивания списка покупок"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer',
+            email='buyer@example.com',
+            first_name='Buyer',
+            last_name='User'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        milk = Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        eggs = Ingredient.objects.create(name='Яйца', measurement_unit='шт')
+        for amounts in ((200, 2), (300, 3)):
+            recipe = Recipe.objects.create(
+                name='Омлет',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.user
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=milk, amount=amounts[0]
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=eggs, amount=amounts[1]
+            )
+            self.client.post(
+                reverse('recipes-shopping-cart', kwargs={'pk': recipe.pk})
+            )
+        self.url = reverse('recipes-download-shopping-cart')
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_download_txt(self):
+        """Список по умолчанию в текстовом формате с суммами"""
+        content = self.download()
+        self.assertIn('• Молоко (мл) — 500', content)
+        self.assertIn('• Яйца (шт) — 5', content)
+
+    def test_download_csv(self):
+        """Список в формате CSV"""
+        content = self.download(format='csv')
+        self.assertEqual(
+            content.splitlines(),
+            ['name,measurement_unit,amount', 'Молоко,мл,500', 'Яйца,шт,5']
+        )
+
+    def test_download_json(self):
+        """Список в формате JSON"""
+        content = json.loads(self.download(format='json'))
+        self.assertEqual(content, [
+            {'name': 'Молоко', 'measurement_unit': 'мл', 'amount': 500},
+            {'name': 'Яйца', 'measurement_unit': 'шт', 'amount': 5},
+        ])
+
+    def test_download_unknown_format(self):
+        """Неизвестный формат возвращает 400 со списком поддерживаемых"""
+        response = self.client.get(self.url, {'format': 'xyz'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.json(),
+            {'errors': 'Поддерживаются форматы: txt, csv, json'}
+        )
+
+    def test_download_empty_cart(self):
+        """Пустая корзина возвращает ошибку"""
+        ShoppingCart.objects.all().delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ShoppingListAggregateTest(APITestCase):
+    """Тесты материализованного списка покупок"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer',
+            email='buyer@example.com',
+            first_name='Buyer',
+            last_name='User'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.milk = Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        self.eggs = Ingredient.objects.create(name='Яйца', measurement_unit='шт')
+        self.flour = Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.first = self.create_recipe({self.milk: 200, self.eggs: 2})
+        self.second = self.create_recipe({self.milk: 300})
+
+    def create_recipe(self, amounts):
+        recipe = Recipe.objects.create(
+            name='Рецепт',
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.user
+        )
+        for ingredient, amount in amounts.items():
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        return recipe
+
+    def cart_url(self, recipe):
+        return reverse('recipes-shopping-cart', kwargs={'pk': recipe.pk})
+
+    def totals(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient__name', 'total_amount'
+            )
+        )
+
+    def test_cart_toggles_update_totals(self):
+        """Добавление и удаление рецептов пересчитывает суммы"""
+        self.client.post(self.cart_url(self.first))
+        self.client.post(self.cart_url(self.second))
+        self.assertEqual(self.totals(), {'Молоко': 500, 'Яйца': 2})
+
+        self.client.delete(self.cart_url(self.first))
+        self.assertEqual(self.totals(), {'Молоко': 300})
+
+    def test_recipe_update_propagates_to_carts(self):
+        """Изменение ингредиентов рецепта отражается в корзинах"""
+        self.client.post(self.cart_url(self.first))
+        response = self.client.patch(
+            reverse('recipes-detail', kwargs={'pk': self.first.pk}),
+            {'ingredients': [
+                {'id': self.milk.id, 'amount': 250},
+                {'id': self.flour.id, 'amount': 100},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.totals(), {'Молоко': 250, 'Мука': 100})
+
+    def test_recipe_delete_removes_totals(self):
+        """Удаление рецепта убирает его из списков покупок"""
+        self.client.post(self.cart_url(self.first))
+        self.client.post(self.cart_url(self.second))
+        self.client.delete(reverse('recipes-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(self.totals(), {'Молоко': 300})
+
+    def test_author_delete_cascades_to_lists(self):
+        """Удаление аккаунта автора убирает его рецепты из чужих списков"""
+        author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User',
+            password='author-password'
+        )
+        recipe = self.create_recipe({self.milk: 100, self.flour: 50})
+        recipe.author = author
+        recipe.save()
+        self.client.post(self.cart_url(recipe))
+        self.client.post(self.cart_url(self.second))
+
+        self.client.force_authenticate(author)
+        response = self.client.delete(
+            reverse('users-me'), {'current_password': 'author-password'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+        self.assertEqual(self.totals(), {'Молоко': 300})
+        self.assertEqual(find_shopping_list_mismatches(), [])
+        response = self.client.get(reverse('recipes-download-shopping-cart'))
+        self.assertNotContains(response, 'Мука')
+
+    def test_admin_changes_update_lists(self):
+        """Корзина и ингредиенты, измененные в админке, попадают в списки"""
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        response = self.client.post(
+            reverse('admin:recipes_shoppingcart_add'),
+            {'user': self.user.id, 'recipe': self.first.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.totals(), {'Молоко': 200, 'Яйца': 2})
+
+        rows = list(self.first.recipe_ingredients.order_by('id'))
+        tag = Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(image, format='JPEG')
+        image.name = 'recipe.jpg'
+        image.seek(0)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(
+                reverse('admin:recipes_recipe_change', args=[self.first.id]),
+                {
+                    'name': self.first.name,
+                    'author': self.first.author_id,
+                    'text': self.first.text,
+                    'cooking_time': self.first.cooking_time,
+                    'image': image,
+                    'tags': [tag.id],
+                    'recipe_ingredients-TOTAL_FORMS': 3,
+                    'recipe_ingredients-INITIAL_FORMS': 2,
+                    'recipe_ingredients-0-id': rows[0].id,
+                    'recipe_ingredients-0-recipe': self.first.id,
+                    'recipe_ingredients-0-ingredient': self.milk.id,
+                    'recipe_ingredients-0-amount': 250,
+                    'recipe_ingredients-0-position': 0,
+                    'recipe_ingredients-1-id': rows[1].id,
+                    'recipe_ingredients-1-recipe': self.first.id,
+                    'recipe_ingredients-1-ingredient': self.eggs.id,
+                    'recipe_ingredients-1-amount': 2,
+                    'recipe_ingredients-1-position': 1,
+                    'recipe_ingredients-1-DELETE': 'on',
+                    'recipe_ingredients-2-recipe': self.first.id,
+                    'recipe_ingredients-2-ingredient': self.flour.id,
+                    'recipe_ingredients-2-amount': 100,
+                    'recipe_ingredients-2-position': 2,
+                }
+            )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.totals(), {'Молоко': 250, 'Мука': 100})
+
+        response = self.client.post(
+            reverse('admin:recipes_shoppingcart_changelist'),
+            {
+                'action': 'delete_selected',
+                'post': 'yes',
+                '_selected_action': list(
+                    ShoppingCart.objects.values_list('id', flat=True)
+                ),
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.totals(), {})
+        self.assertEqual(find_shopping_list_mismatches(), [])
+
+    def test_rebuild_command(self):
+        """Команда находит расхождения и пересобирает таблицу"""
+        ShoppingCart.objects.create(user=self.user, recipe=self.first)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_lists', '--verify', stdout=io.StringIO())
+
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertEqual(self.totals(), {'Молоко': 200, 'Яйца': 2})
+        call_command('rebuild_shopping_lists', '--verify', stdout=io.StringIO())
+
+    def test_rebuild_recipe_in_several_carts(self):
+        """Рецепт в нескольких корзинах не умножает суммы при пересборке по пользователям"""
+        buyers = [self.user] + [
+            User.objects.create_user(
+                username=f'buyer{number}',
+                email=f'buyer{number}@example.com',
+                first_name='Buyer',
+                last_name='User'
+            )
+            for number in range(2)
+        ]
+        for buyer in buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.first)
+        ShoppingListItem.objects.all().delete()
+
+        call_command(
+            'rebuild_shopping_lists', '--user', str(self.user.id),
+            stdout=io.StringIO()
+        )
+        self.assertEqual(self.totals(), {'Молоко': 200, 'Яйца': 2})
+        call_command(
+            'rebuild_shopping_lists', '--batch-size', '2', stdout=io.StringIO()
+        )
+        for buyer in buyers:
+            self.assertEqual(
+                dict(buyer.shopping_list_items.values_list(
+                    'ingredient__name', 'total_amount'
+                )),
+                {'Молоко': 200, 'Яйца': 2}
+            )
+        call_command(
+            'rebuild_shopping_lists', '--verify', '--batch-size', '2',
+            stdout=io.StringIO()
+        )
+
+
+class IngredientPrefixIndexTest(APITestCase):
+    """Тесты поиска ингредиентов по индексу в памяти"""
+
+    def setUp(self):
+        for name in ('Мёд', 'Молоко', 'молоко сгущенное', 'Мука', 'Яйца'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        self.url = reverse('ingredients-list')
+
+    def search(self, name):
+        response = self.client.get(self.url, {'name': name})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search_is_case_insensitive(self):
+        """Поиск по префиксу не зависит от регистра"""
+        self.assertEqual(self.search('МОЛ'), ['Молоко', 'молоко сгущенное'])
+
+    def test_prefix_search_folds_yo(self):
+        """Буквы ё и е считаются одинаковыми"""
+        self.assertEqual(self.search('мед'), ['Мёд'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_result_size_is_capped(self):
+        """Число подсказок ограничено настройкой"""
+        self.assertEqual(len(self.search('м')), 2)
+
+    def test_index_is_rebuilt_after_changes(self):
+        """Индекс перестраивается после изменения ингредиентов"""
+        self.assertEqual(self.search('сах'), [])
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        self.assertEqual(self.search('сах'), ['Сахар'])
+
+    def test_search_does_not_query_database(self):
+        """Повторный поиск обслуживается без запросов к БД"""
+        self.search('мол')
+        with self.assertNumQueries(0):
+            self.search('мук')
+
+
+class IngredientFuzzySearchTest(APITestCase):
+    """Тесты нечеткого поиска ингредиентов"""
+
+    def setUp(self):
+        for name in (
+            'Мёд', 'Молоко', 'молоко сгущенное', 'Сухое молоко', 'Мука'
+        ):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        self.url = reverse('ingredients-list')
+
+    def search(self, name):
+        response = self.client.get(self.url, {'name': name, 'fuzzy': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_typo_is_found(self):
+        """Название с опечаткой находится по сходству"""
+        self.assertEqual(self.search('малако'), ['Молоко'])
+
+    def test_prefix_matches_rank_first(self):
+        """Совпадения по префиксу идут раньше более похожих названий"""
+        self.assertEqual(
+            self.search('МОЛОКО'),
+            ['Молоко', 'молоко сгущенное', 'Сухое молоко']
+        )
+
+    def test_trigrams_match_pg_trgm(self):
+        """Триграммы строятся по словам с дополнением пробелами"""
+        self.assertEqual(
+            trigrams('Ой!'), {'  о', ' ой', 'ой '}
+        )
+        self.assertAlmostEqual(
+            similarity(trigrams('малако'), trigrams('молоко')), 2 / 12
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Индексы есть только в PostgreSQL')
+    def test_postgresql_search_uses_indexes(self):
+        """План запроса использует функциональный и триграммный индексы"""
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(
+                'EXPLAIN ' + POSTGRESQL_SEARCH, search_params('малако', 10)
+            )
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(PATTERN_INDEX, plan)
+        self.assertIn(TRIGRAM_INDEX, plan)
+
+
+class PrerenderedListTest(APITestCase):
+    """Тесты заранее отрисованных списков тегов и ингредиентов"""
+
+    def setUp(self):
+        Tag.objects.create(name='Завтрак', color='#FF6600', slug='breakfast')
+        Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        self.tags_url = reverse('tags-list')
+        self.ingredients_url = reverse('ingredients-list')
+
+    def test_list_has_etag_and_returns_not_modified(self):
+        """Ответ содержит ETag, повторный запрос с ним получает 304"""
+        response = self.client.get(self.ingredients_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(response.content),
+            [{'id': Ingredient.objects.get().id, 'name': 'Молоко',
+              'measurement_unit': 'мл'}]
+        )
+        etag = response['ETag']
+
+        response = self.client.get(self.ingredients_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_gzip_variant(self):
+        """Клиенту с поддержкой gzip отдается сжатый вариант"""
+        plain = self.client.get(self.tags_url)
+        compressed = self.client.get(self.tags_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+
+    def test_etag_changes_after_save(self):
+        """Изменение тега меняет версию и ETag"""
+        etag = self.client.get(self.tags_url)['ETag']
+        Tag.objects.create(name='Обед', color='#00FF00', slug='lunch')
+
+        response = self.client.get(self.tags_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_bulk_load_changes_etag(self):
+        """Загрузка ингредиентов в обход сигналов тоже меняет ETag"""
+        etag = self.client.get(self.ingredients_url)['ETag']
+        with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8') as file:
+            json.dump([{'name': 'Сахар', 'measurement_unit': 'г'}], file)
+            file.flush()
+            call_command('load_ingredients', file=file.name, stdout=io.StringIO())
+
+        response = self.client.get(self.ingredients_url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_repeated_request_does_not_query_database(self):
+        """Повторный запрос не обращается к БД"""
+        self.client.get(self.ingredients_url)
+        with self.assertNumQueries(0):
+            self.client.get(self.ingredients_url)
+
+
+class IngredientImportTest(TestCase):
+    """Тесты потокового импорта ингредиентов"""
+
+    def write_file(self, suffix, content):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8', delete=False
+        )
+        with file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def run_import(self, path, *args):
+        output = io.StringIO()
+        call_command('import_ingredients', f'--path={path}', *args, stdout=output)
+        return output.getvalue()
+
+    def test_csv_import_counts(self):
+        """CSV импортируется пачками с подсчетом пропущенных строк"""
+        Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        path = self.write_file('.csv', (
+            'name,measurement_unit\n'
+            'Молоко,мл\n'
+            'Мука,г\n'
+            'Мука,г\n'
+            'Сахар,г\n'
+            'битая строка\n'
+        ))
+        output = self.run_import(path, '--batch-size=2')
+        self.assertIn('Добавлено: 2, пропущено существующих: 2, некорректных строк: 1', output)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', flat=True)),
+            {'Молоко', 'Мука', 'Сахар'}
+        )
+
+    def test_json_import(self):
+        """JSON читается потоково"""
+        path = self.write_file('.json', json.dumps([
+            {'name': 'Молоко', 'measurement_unit': 'мл'},
+            {'name': 'Мука', 'measurement_unit': 'г'},
+        ], ensure_ascii=False))
+        self.run_import(path, '--json')
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_unchanged_file_is_skipped(self):
+        """Повторный импорт того же файла пропускается"""
+        path = self.write_file('.csv', 'Молоко,мл\n')
+        self.run_import(path)
+        Ingredient.objects.all().delete()
+
+        output = self.run_import(path)
+        self.assertIn('Файл не изменился', output)
+        self.assertEqual(Ingredient.objects.count(), 0)
+
+        self.run_import(path, '--force')
+        self.assertEqual(Ingredient.objects.count(), 1)
+        self.assertEqual(IngredientImport.objects.count(), 2)
+
+
+class SeedFoodgramCommandTest(TestCase):
+    """Тесты генератора синтетических данных"""
+
+    def setUp(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(30)
+        )
+
+    def seed(self, *args):
+        call_command(
+            'seed_foodgram', '--users=20', '--recipes=60', '--batch-size=25',
+            *args, stdout=io.StringIO()
+        )
+
+    def snapshot(self):
+        return sorted(
+            Recipe.objects.values_list(
+                'name', 'author__username', 'cooking_time', 'created'
+            ).annotate(ingredients_count=Count('recipe_ingredients'))
+        )
+
+    def test_seed_creates_dataset(self):
+        """Команда создает связанный набор данных"""
+        self.seed()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Recipe.objects.count(), 60)
+        self.assertFalse(
+            Recipe.objects.filter(recipe_ingredients__isnull=True).exists()
+        )
+        self.assertTrue(Favorite.objects.exists())
+        self.assertFalse(
+            Subscription.objects.filter(user=F('author')).exists()
+        )
+        call_command('rebuild_shopping_lists', '--verify', stdout=io.StringIO())
+
+    def test_seed_is_deterministic(self):
+        """Одинаковое зерно дает одинаковые данные"""
+        self.seed('--seed=7')
+        first = self.snapshot()
+        self.seed('--seed=7', '--clear')
+        second = self.snapshot()
+        self.assertEqual(
+            [row[:3] + row[4:] for row in first],
+            [row[:3] + row[4:] for row in second]
+        )
+
+    def test_clear_deletes_in_batches(self):
+        """--clear удаляет рецепты без сигналов на каждый и чинит чужие списки"""
+        self.seed()
+        buyer = User.objects.create_user(
+            username='buyer',
+            email='buyer@example.com',
+            first_name='Buyer',
+            last_name='User'
+        )
+        ShoppingCart.objects.create(
+            user=buyer, recipe=Recipe.objects.order_by('id').first()
+        )
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertTrue(buyer.shopping_list_items.exists())
+
+        with mock.patch(
+            'recipes.signals.remove_recipe_from_all_lists'
+        ) as remove_recipe:
+            self.seed('--clear', '--recipes=0', '--users=0')
+        remove_recipe.assert_not_called()
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(list(User.objects.all()), [buyer])
+        self.assertFalse(buyer.shopping_list_items.exists())
+        call_command('rebuild_shopping_lists', '--verify', stdout=io.StringIO())
+
+    def test_seed_refuses_to_duplicate(self):
+        """Повторный запуск без --clear завершается ошибкой"""
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class HotQueryPlanTest(TestCase):
+    """Планы частых запросов на сгенерированных данных используют индексы"""
+
+    # Полный просмотр таблицы или сортировка во временном B-дереве
+    SEQUENTIAL_SCAN = re.compile(
+        r'Seq Scan|\bSCAN \w+$|USE TEMP B-TREE', re.MULTILINE
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(30)
+        )
+        call_command(
+            'seed_foodgram', '--users=20', '--recipes=200',
+            stdout=io.StringIO()
+        )
+        cls.user = User.objects.order_by('id').first()
+        cls.author = Recipe.objects.order_by('id').first().author
+
+    def hot_queries(self):
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:6])
+        return {
+            'лента': Recipe.objects.order_by('-created', '-id')[:7],
+            'рецепты автора': Recipe.objects.filter(
+                author=self.author
+            ).order_by('-created', '-id')[:7],
+            'избранное': Favorite.objects.filter(
+                user=self.user
+            ).values_list('recipe_id', flat=True)[:7],
+            'корзина': ShoppingCart.objects.filter(
+                user=self.user
+            ).values_list('recipe_id', flat=True)[:7],
+            'подписки': Subscription.objects.filter(
+                user=self.user
+            ).values_list('author_id', flat=True)[:7],
+            'ингредиенты рецептов': RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ),
+            'популярные': trending(Recipe.objects.all())[:7],
+        }
+
+    def test_hot_queries_use_indexes(self):
+        """EXPLAIN частых запросов не содержит последовательных просмотров"""
+        if connection.vendor == 'postgresql':
+            # На маленькой таблице планировщик и так выбрал бы Seq Scan,
+            # проверяем, что подходящий индекс вообще есть
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIsNone(self.SEQUENTIAL_SCAN.search(plan), plan)
+
+    def test_recipe_ingredients_ordering_has_no_joins(self):
+        """Сортировка ингредиентов рецепта не добавляет JOIN"""
+        sql = str(RecipeIngredient.objects.filter(recipe_id=1).query)
+        self.assertNotIn('JOIN', sql)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTest(APITestCase):
+    """Тесты бюджетов SQL-запросов на страницах с несколькими объектами"""
+
+    def setUp(self):
+        reset_violations()
+        self.user = User.objects.create_user(
+            username='reader',
+            email='reader@example.com',
+            first_name='Reader',
+            last_name='User'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        Subscription.objects.create(user=self.user, author=self.author)
+        self.tags = [
+            Tag.objects.create(name=f'Тег {index}', color='#E26C2D', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10)
+        ]
+        self.recipes = []
+        for index in range(10):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.author
+            )
+            recipe.tags.set(self.tags[:2])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+                for ingredient in self.ingredients[:5]
+            )
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            self.recipes.append(recipe)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def recipe_payload(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(buffer, format='JPEG')
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': (
+                'data:image/jpeg;base64,'
+                + base64.b64encode(buffer.getvalue()).decode()
+            ),
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 50}
+                for ingredient in self.ingredients[:8]
+            ],
+        }
+
+    def test_read_endpoints_within_budget(self):
+        """Чтение укладывается в бюджет при нескольких объектах на странице"""
+        recipe = self.recipes[0]
+        self.client.post(reverse('recipes-shopping-cart', args=[recipe.id]))
+        requests = [
+            (reverse('recipes-list'), {'limit': 10}),
+            (reverse('recipes-list'), {'limit': 10, 'tags': ['tag0', 'tag1']}),
+            (reverse('recipes-list'), {'limit': 10, 'is_favorited': 1}),
+            (reverse('recipes-list'), {'limit': 10, 'author': self.author.id}),
+            (reverse('recipes-list'), {'limit': 10, 'pagination': 'cursor'}),
+            (reverse('recipes-detail', args=[recipe.id]), None),
+            (reverse('recipes-get-link', args=[recipe.id]), None),
+            (reverse('recipes-download-shopping-cart'), {'format': 'json'}),
+            (reverse('tags-list'), None),
+            (reverse('tags-detail', args=[self.tags[0].id]), None),
+            (reverse('ingredients-list'), None),
+            (reverse('ingredients-list'), {'name': 'Инг'}),
+            (reverse('ingredients-detail', args=[self.ingredients[0].id]), None),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials()
+        response = self.client.get(reverse('recipes-list'), {'limit': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_endpoints_within_budget(self):
+        """Запись укладывается в бюджет для рецепта с многими ингредиентами"""
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(
+                reverse('recipes-list'), self.recipe_payload(), format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            url = reverse('recipes-detail', args=[response.data['id']])
+            response = self.client.patch(url, self.recipe_payload(), format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            recipe = self.recipes[1]
+            for action in ('favorite', 'shopping-cart'):
+                action_url = reverse(f'recipes-{action}', args=[recipe.id])
+                if action == 'favorite':
+                    self.client.delete(action_url)
+                response = self.client.post(action_url)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                response = self.client.delete(action_url)
+                self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_admin_changelist_within_budget(self):
+        """Список рецептов в админке не делает запросов на каждую строку"""
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:recipes_recipe_changelist'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'Тег 0, Тег 1')
+
+    def test_violation_raises_with_duplicates_report(self):
+        """Превышение бюджета в режиме raise выбрасывает исключение"""
+        with mock.patch.dict(RecipeViewSet.query_budgets, {'list': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'при бюджете 1'):
+                self.client.get(reverse('recipes-list'))
+        self.assertEqual(get_violations(), {'RecipeViewSet.list': 1})
+
+    def test_short_link_redirect_budget(self):
+        """Редирект по короткой ссылке укладывается в свой бюджет"""
+        self.client.credentials()
+        short_link = ShortLink.objects.create(
+            recipe=self.recipes[0], short_id='abc123'
+        )
+        url = reverse('short_link_redirect', args=[short_link.short_id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(get_violations(), {})
+        with mock.patch.object(short_link_redirect, 'query_budget', 0):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'при бюджете 0'):
+                self.client.get(url)
+        self.assertEqual(get_violations(), {'short_link_redirect': 1})
+
+    @override_settings(QUERY_BUDGET_MODE='count')
+    def test_violation_is_counted_in_count_mode(self):
+        """В режиме count нарушение только учитывается в счетчике"""
+        with mock.patch.dict(RecipeViewSet.query_budgets, {'retrieve': 1}):
+            url = reverse('recipes-detail', args=[self.recipes[0].id])
+            for _ in range(2):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_violations(), {'RecipeViewSet.retrieve': 2})
+
+    def test_duplicated_queries_group_in_lists(self):
+        """Списки параметров IN разной длины считаются одним шаблоном"""
+        queries = [
+            'SELECT * FROM t WHERE id = %s',
+            'SELECT * FROM t WHERE id = %s',
+            'SELECT * FROM t WHERE id IN (%s, %s)',
+            'SELECT * FROM t WHERE id IN (%s)',
+            'SELECT 1',
+        ]
+        self.assertEqual(duplicated_queries(queries), [
+            (2, 'SELECT * FROM t WHERE id = %s'),
+            (2, 'SELECT * FROM t WHERE id IN (...)'),
+        ])
+
+
+class ProfilingMiddlewareTest(APITestCase):
+    """Тесты заголовка Server-Timing и журнала медленных запросов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='cook',
+            email='cook@example.com',
+            first_name='Cook',
+            last_name='User'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        for index in range(3):
+            Recipe.objects.create(
+                name=f'Рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=10,
+                author=self.user
+            )
+
+    def timings(self, response):
+        """Разбирает Server-Timing в словарь имя -> параметры"""
+        result = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            result[name] = dict(param.split('=', 1) for param in params)
+        return result
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_request_gets_server_timing(self):
+        """Выбранный запрос получает замеры БД, view, сериализации и отрисовки"""
+        response = self.client.get(reverse('recipes-list'))
+        timings = self.timings(response)
+        self.assertEqual(
+            set(timings), {'db', 'view', 'serialize', 'render', 'total'}
+        )
+        self.assertRegex(timings['db']['desc'], r'^"\d+ queries"$')
+        self.assertLessEqual(
+            float(timings['serialize']['dur']), float(timings['view']['dur'])
+        )
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_server_timing_only_for_staff_when_not_sampled(self):
+        """Без выборки заголовок получают только сотрудники"""
+        response = self.client.get(reverse('recipes-list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('recipes-list'))
+        self.assertIn('serialize', self.timings(response))
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_server_timing_for_token_staff_outside_drf(self):
+        """Сотрудник с токеном получает заголовок и вне view DRF"""
+        short_link = ShortLink.objects.create(
+            recipe=Recipe.objects.first(), short_id='abc123'
+        )
+        url = reverse('short_link_redirect', args=[short_link.short_id])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertIn('total', self.timings(response))
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_image_decoding_is_measured(self):
+        """Декодирование изображения попадает в отдельную метрику"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (50, 50), color='red').save(buffer, format='JPEG')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('recipes-list'), {
+                'name': 'Рецепт с фото',
+                'text': 'Описание',
+                'cooking_time': 5,
+                'image': (
+                    'data:image/jpeg;base64,'
+                    + base64.b64encode(buffer.getvalue()).decode()
+                ),
+                'ingredients': [{'id': self.ingredient.id, 'amount': 5}],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('image', self.timings(response))
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_request_is_logged(self):
+        """Медленный запрос пишется в журнал одной структурированной записью"""
+        with self.assertLogs('foodgram.profiling', 'WARNING') as logs:
+            self.client.get(reverse('recipes-list'))
+        data = logs.records[0].data
+        self.assertEqual(data['path'], reverse('recipes-list'))
+        self.assertEqual(data['status'], status.HTTP_200_OK)
+        self.assertEqual(data['view'], 'recipes-list')
+        self.assertGreater(data['sql_count'], 0)
+        self.assertIn('total_ms', data)
+        entry = json.loads(JsonFormatter().format(logs.records[0]))
+        self.assertEqual(entry['message'], 'slow request')
+        self.assertEqual(entry['path'], reverse('recipes-list'))
+
+
+class MetricsEndpointTest(APITestCase):
+    """Тесты эндпоинта /metrics"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            first_name='Author',
+            last_name='User'
+        )
+        Recipe.objects.create(
+            name='Рецепт',
+            text='Описание рецепта',
+            cooking_time=10,
+            author=self.author
+        )
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def sample(self, text, series):
+        """Значение ряда series или 0, если его еще нет"""
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_requests_latency_and_queries_per_view(self):
+        """Запросы учитываются по действию ViewSet, методу и статусу"""
+        series = (
+            'foodgram_http_requests_total'
+            '{view="RecipeViewSet.list",method="GET",status="200"}'
+        )
+        before = self.sample(self.scrape(), series)
+        for _ in range(2):
+            self.client.get(reverse('recipes-list'))
+        text = self.scrape()
+        self.assertEqual(self.sample(text, series), before + 2)
+        self.assertIn(
+            'foodgram_http_request_duration_seconds_bucket'
+            '{view="RecipeViewSet.list",method="GET",status="200",le="+Inf"}',
+            text
+        )
+        self.assertGreater(self.sample(
+            text,
+            'foodgram_http_request_db_queries_sum{view="RecipeViewSet.list"}'
+        ), 0)
+        self.assertIn('# TYPE foodgram_image_uploads_in_progress gauge', text)
+
+    def test_cache_hits_are_counted(self):
+        """Повторный запрос справочника засчитывается как попадание в кеш"""
+        series = (
+            'foodgram_cache_requests_total'
+            '{cache="prerendered_ingredients",result="hit"}'
+        )
+        self.client.get(reverse('ingredients-list'))
+        before = self.sample(self.scrape(), series)
+        self.client.get(reverse('ingredients-list'))
+        self.assertEqual(self.sample(self.scrape(), series), before + 1)
+
+    def test_thread_shards_are_summed(self):
+        """Значения из разных потоков складываются при сборе"""
+        registry = Registry()
+        counter = MetricCounter('test_total', 'Тест', ('kind',), registry=registry)
+
+        def work():
+            for _ in range(1000):
+                counter.inc(('a',))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(('b',), 5)
+        self.assertEqual(counter.collect(), {('a',): 4000, ('b',): 5})
+
+    def test_histogram_collect_while_labels_are_added(self):
+        """Сбор гистограммы не падает, пока другой поток добавляет метки"""
+        registry = Registry()
+        histogram = Histogram('test_seconds', 'Тест', ('key',), registry=registry)
+        done = threading.Event()
+
+        def work():
+            for index in range(20000):
+                histogram.observe(0.01, (str(index),))
+            done.set()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        try:
+            while not done.is_set():
+                histogram.collect()
+        finally:
+            thread.join()
+        self.assertEqual(len(histogram.collect()), 20000)
+
+    def test_flush_error_is_logged(self):
+        """Ошибка записи снимка логируется и не прерывает поток записи"""
+        registry = Registry()
+        with mock.patch.object(
+            registry, 'write_snapshot', side_effect=OSError('диск заполнен')
+        ), self.assertLogs('foodgram.metrics', level='ERROR') as logs:
+            registry.flush()
+        self.assertIn('снимок метрик', logs.output[0])
+
+    def test_multiprocess_snapshots_are_merged(self):
+        """Снимки воркеров складываются, gauge завершившихся процессов отбрасываются"""
+        registry = Registry()
+        counter = MetricCounter('jobs_total', 'Задачи', ('kind',), registry=registry)
+        gauge = Gauge('jobs_in_progress', 'Задачи в работе', registry=registry)
+        counter.inc(('import',), 2)
+        gauge.inc()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROC_DIR=directory):
+            dead_pid = 2 ** 22 + 1
+            with open(os.path.join(directory, f'{dead_pid}.json'), 'w') as file:
+                json.dump({
+                    'jobs_total': [[['import'], 3]],
+                    'jobs_in_progress': [[[], 7]],
+                }, file)
+            text = registry.render()
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, f'{registry.snapshot_name()}.json')
+            ))
+        self.assertIn('jobs_total{kind="import"} 5', text)
+        self.assertIn('jobs_in_progress 1', text)
+
+    def test_reused_pid_keeps_dead_snapshot(self):
+        """Процесс с pid завершившегося воркера не затирает его снимок"""
+        registry = Registry()
+        counter = MetricCounter('jobs_total', 'Задачи', ('kind',), registry=registry)
+        gauge = Gauge('jobs_in_progress', 'Задачи в работе', registry=registry)
+        counter.inc(('import',), 2)
+        gauge.inc()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROC_DIR=directory):
+            # Снимок прежнего процесса с тем же pid
+            with open(
+                os.path.join(directory, f'{os.getpid()}-dead.json'), 'w'
+            ) as file:
+                json.dump({
+                    'jobs_total': [[['import'], 3]],
+                    'jobs_in_progress': [[[], 7]],
+                }, file)
+            text = registry.render()
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('jobs_total{kind="import"} 5', text)
+        self.assertIn('jobs_in_progress 1', text)
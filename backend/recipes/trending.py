@@ -0,0 +1,111 @@
+"""
+Популярные сейчас рецепты (?ordering=trending).
+
+Популярность — сумма весов добавлений в избранное и корзину,
+затухающих экспоненциально с периодом полураспада
+TRENDING_HALF_LIFE_HOURS. Затухание ленивое (forward decay):
+вклад события в момент t считается относительно неподвижной точки
+отсчета EPOCH как weight * exp((t - EPOCH) / tau), и сравнивать
+рецепты можно по этим суммам без пересчета при ходе времени — текущее
+значение у всех рецептов отличается одним и тем же множителем
+exp(-(now - EPOCH) / tau).
+
+Чтобы суммы не переполнялись, в RecipeTrend.score хранится их
+натуральный логарифм, а новое событие прибавляется одним UPDATE
+как logaddexp(score, key) = max + ln(1 + exp(-|score - key|)).
+Со временем строки не переписываются, ключ растет примерно
+на 127 за год.
+
+Снятие отметки счет не уменьшает. Команда rebuild_trending
+периодически пересчитывает оценки по избранному и корзинам
+за TRENDING_WINDOW_DAYS: убирает вклад снятых отметок и удаляет
+строки рецептов без недавней активности.
+
+Список сортируется по индексу (-score, -recipe) в RecipeTrend
+и содержит только рецепты с активностью.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .models import Favorite, RecipeTrend, ShoppingCart
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+FAVORITE = 'favorite'
+SHOPPING_CART = 'shopping_cart'
+
+
+def decay_time():
+    """tau: время, за которое вклад события уменьшается в e раз, в часах."""
+    return settings.TRENDING_HALF_LIFE_HOURS / math.log(2)
+
+
+def event_key(kind, at):
+    """Логарифм вклада события kind в момент at."""
+    hours = (at - EPOCH).total_seconds() / 3600
+    return math.log(settings.TRENDING_WEIGHTS[kind]) + hours / decay_time()
+
+
+def logaddexp(left, right):
+    if left is None:
+        return right
+    high, low = max(left, right), min(left, right)
+    return high + math.log1p(math.exp(low - high))
+
+
+@transaction.atomic(savepoint=False)
+def record_activity(recipe_ids, kind, at=None):
+    """Учитывает добавление рецептов recipe_ids в избранное или корзину."""
+    if not recipe_ids:
+        return
+    key = Value(event_key(kind, at or timezone.now()), output_field=FloatField())
+    RecipeTrend.objects.bulk_create(
+        [RecipeTrend(recipe_id=recipe_id) for recipe_id in recipe_ids],
+        ignore_conflicts=True
+    )
+    RecipeTrend.objects.filter(recipe_id__in=recipe_ids).update(score=Case(
+        When(score__isnull=True, then=key),
+        default=Greatest(F('score'), key) + Ln(
+            Value(1.0) + Exp(-Abs(F('score') - key))
+        ),
+        output_field=FloatField(),
+    ))
+
+
+def trending(queryset):
+    """Рецепты с активностью, по убыванию популярности."""
+    return queryset.filter(trend__score__isnull=False).order_by(
+        '-trend__score', '-trend__recipe_id'
+    )
+
+
+def rebuild_scores(batch_size=1000, now=None):
+    """
+    Пересчитывает оценки по избранному и корзинам за последние
+    TRENDING_WINDOW_DAYS. Возвращает число рецептов с оценкой.
+    """
+    since = (now or timezone.now()) - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+    scores = {}
+    for kind, model in ((FAVORITE, Favorite), (SHOPPING_CART, ShoppingCart)):
+        for recipe_id, created in model.objects.filter(
+            created__gte=since
+        ).order_by().values_list('recipe_id', 'created').iterator():
+            scores[recipe_id] = logaddexp(
+                scores.get(recipe_id), event_key(kind, created)
+            )
+    with transaction.atomic():
+        RecipeTrend.objects.all().delete()
+        RecipeTrend.objects.bulk_create(
+            (
+                RecipeTrend(recipe_id=recipe_id, score=score)
+                for recipe_id, score in scores.items()
+            ),
+            batch_size=batch_size
+        )
+    return len(scores)
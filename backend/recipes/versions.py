@@ -0,0 +1,66 @@
+"""
+Версии редко меняющихся справочников.
+
+Версия хранится в кеше Django и меняется при каждом изменении данных.
+Процессы сравнивают ее со своей копией и перестраивают локальные
+структуры (индексы, готовые ответы) только когда она изменилась.
+При нескольких воркерах в CACHES должен быть общий бэкенд
+(Redis, Memcached, БД), иначе каждый процесс видит только свои версии.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from foodgram.metrics import record_cache
+
+INGREDIENTS = 'ingredients'
+TAGS = 'tags'
+RECIPE_INGREDIENTS = 'recipe_ingredients'
+
+VERSION_KEY = 'foodgram:version:{}'
+
+
+def get_version(name):
+    """Текущая версия справочника name."""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Отмечает, что данные справочника name изменились."""
+    cache.set(VERSION_KEY.format(name), uuid.uuid4().hex, timeout=None)
+
+
+class VersionedValue:
+    """
+    Значение в памяти процесса, которое пересобирается функцией build
+    при смене версии справочника name.
+
+    Значение заменяется целиком, поэтому читатели никогда не видят
+    его в полусобранном состоянии. Попадания и пересборки учитываются
+    в метрике кешей под именем cache_name.
+    """
+
+    def __init__(self, name, build, cache_name=None):
+        self.name = name
+        self.build = build
+        self.cache_name = cache_name or name
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        version = get_version(self.name)
+        hit = version == self._version
+        if not hit:
+            with self._lock:
+                if version != self._version:
+                    self._value = self.build()
+                    self._version = version
+        record_cache(self.cache_name, hit)
+        return self._value
@@ -1,45 +1,88 @@
 import secrets
 import string
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .filters import RecipeFilter, IngredientFilter
+from foodgram.pagination import (
+    CustomPageNumberPagination, MergedKeysetPagination, OptionalKeysetPagination
+)
+from foodgram.query_budget import query_budget
+from .feed import feed_sources
+from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .ingredient_search import fuzzy_search
 from .models import (
     Recipe, Ingredient, Tag, Favorite, ShoppingCart,
-    ShortLink, RecipeIngredient
+    ShortLink
+)
+from .marks import (
+    ABSENT, ADDED, EXISTS, REMOVED, add_favorites, add_to_cart, apply_batch,
+    remove_favorites, remove_from_cart
 )
+from .pantry import match_recipes
 from .permissions import IsAuthorOrReadOnly
+from .prerendered import PrerenderedListMixin
+from .renderers import CSVRenderer, PlainTextRenderer
 from .serializers import (
     RecipeListSerializer, RecipeCreateUpdateSerializer,
-    IngredientSerializer, TagSerializer, RecipeMinifiedSerializer, ShortLinkSerializer
+    IngredientSerializer, TagSerializer, RecipeMinifiedSerializer, ShortLinkSerializer,
+    SimilarRecipeSerializer, PantryQuerySerializer, PantryRecipeSerializer,
+    RecipeIdsSerializer, recipe_ingredient_rows
 )
+from .shopping_list import SHOPPING_LIST_FORMATS, get_shopping_list
+from .similarity import similar_recipes
+from .versions import INGREDIENTS, TAGS
+from users.models import Subscription
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(PrerenderedListMixin, ReadOnlyModelViewSet):
     """ViewSet для работы с тегами."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    prerender_version = TAGS
+    query_budgets = {'list': 2, 'retrieve': 2}
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(PrerenderedListMixin, ReadOnlyModelViewSet):
     """ViewSet для работы с ингредиентами."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = IngredientFilter
     pagination_class = None
+    prerender_version = INGREDIENTS
+    # list с ?fuzzy=1 в PostgreSQL: токен, порог сходства и поиск
+    query_budgets = {'list': 3, 'retrieve': 2}
 
     def list(self, request, *args, **kwargs):
         """Переопределяем метод получения списка ингредиентов."""
+        name = request.query_params.get('name')
+        # Поиск с опечатками выполняет БД по триграммному индексу
+        if name and request.query_params.get('fuzzy') in ('1', 'true'):
+            return Response(fuzzy_search(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            ))
+        # Автодополнение по префиксу обслуживаем из индекса в памяти
+        if name:
+            return Response(ingredient_index.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            ))
+
+        # Полный список отдаем заранее отрисованным
+        response = self.prerendered_list(request)
+        if response is not None:
+            return response
+
         queryset = self.filter_queryset(self.get_queryset())
         serializer = self.get_serializer(queryset, many=True)
 
@@ -54,6 +97,52 @@ class RecipeViewSet(ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    pagination_class = OptionalKeysetPagination
+    # Бюджеты SQL-запросов на весь запрос, включая аутентификацию;
+    # запись идет в транзакции, внутри тестовой это еще два SAVEPOINT
+    query_budgets = {
+        'list': 8,
+        'retrieve': 5,
+        'create': 18,
+        'update': 18,
+        'partial_update': 18,
+        'destroy': 16,
+    }
+
+    # Действия, ответ которых строится через RecipeListSerializer
+    annotated_actions = (
+        'list', 'retrieve', 'update', 'partial_update', 'feed', 'pantry'
+    )
+
+    def get_queryset(self):
+        """
+        Для чтения возвращаем queryset с аннотациями флагов пользователя
+        и заранее загруженными связями, чтобы число запросов на страницу
+        не зависело от её размера.
+        """
+        queryset = super().get_queryset()
+        if self.action not in self.annotated_actions:
+            return queryset
+
+        queryset = queryset.select_related('author').prefetch_related(
+            Prefetch('recipe_ingredients', queryset=recipe_ingredient_rows())
+        )
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(
+                    Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+                ),
+                is_in_shopping_cart=Exists(
+                    ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+                ),
+                author_is_subscribed=Exists(
+                    Subscription.objects.filter(
+                        user=user, author=OuterRef('author')
+                    )
+                ),
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -68,6 +157,15 @@ class RecipeViewSet(ModelViewSet):
         context['exclude_tags'] = True
         return context
 
+    def perform_content_negotiation(self, request, force=False):
+        """
+        Для download_shopping_cart неизвестный ?format= должен дойти
+        до view и получить 400, а не 404 от согласования формата.
+        """
+        if self.action == 'download_shopping_cart':
+            force = True
+        return super().perform_content_negotiation(request, force)
+
     def create(self, request, *args, **kwargs):
         """Создание нового рецепта."""
         serializer = self.get_serializer(data=request.data)
@@ -95,12 +193,9 @@ class RecipeViewSet(ModelViewSet):
             # Если был использован prefetch_related, сбрасываем кеш
             instance._prefetched_objects_cache = {}
 
-        # Принудительно используем RecipeListSerializer для формирования ответа
-        response_serializer = RecipeListSerializer(
-            instance,
-            context={'request': request, 'exclude_tags': True}
-        )
-        return Response(response_serializer.data)
+        # Ответ строится через RecipeListSerializer
+        # в RecipeCreateUpdateSerializer.to_representation
+        return Response(serializer.data)
 
     def partial_update(self, request, *args, **kwargs):
         """Частичное обновление существующего рецепта."""
@@ -111,77 +206,164 @@ class RecipeViewSet(ModelViewSet):
         """Выполнение создания объекта."""
         serializer.save(author=self.request.user)
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated]
+    )
+    @query_budget(7)
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь,
+        с курсорной пагинацией (см. recipes.feed).
+        """
+        paginator = MergedKeysetPagination()
+        recipe_ids = paginator.paginate_sources(
+            feed_sources(request.user), request
+        )
+        recipes = self.get_queryset().filter(
+            id__in=recipe_ids
+        ).order_by('-created', '-id')
+        serializer = self.get_serializer(recipes, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @query_budget(6)
+    def pantry(self, request):
+        """
+        Рецепты, которые можно приготовить из продуктов пользователя
+        (?ingredients=1&ingredients=2&min_coverage=0.5), по убыванию
+        доли имеющихся ингредиентов (см. recipes.pantry).
+        """
+        params = PantryQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = match_recipes(
+            params.validated_data['ingredients'],
+            params.validated_data['min_coverage']
+        )
+        paginator = CustomPageNumberPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = self.get_queryset().in_bulk([match.recipe_id for match in page])
+        results = []
+        for match in page:
+            recipe = recipes.get(match.recipe_id)
+            if recipe is not None:
+                recipe.coverage = round(match.coverage, 4)
+                recipe.missing = match.missing
+                results.append(recipe)
+        serializer = PantryRecipeSerializer(
+            results, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
         permission_classes=[IsAuthenticated]
     )
+    @query_budget(8)
     def favorite(self, request, pk=None):
         """Добавление/удаление рецепта в избранное."""
-        recipe = self.get_object()
+        return self.toggle_mark(
+            request, add_favorites, remove_favorites,
+            'Рецепт уже добавлен в избранное',
+            'Рецепт не был добавлен в избранное'
+        )
 
+    @action(
+        detail=True,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated]
+    )
+    @query_budget(14)
+    def shopping_cart(self, request, pk=None):
+        """Добавление/удаление рецепта в корзину покупок."""
+        return self.toggle_mark(
+            request, add_to_cart, remove_from_cart,
+            'Рецепт уже добавлен в корзину',
+            'Рецепт не был добавлен в корзину'
+        )
+
+    def toggle_mark(self, request, add, remove, exists_error, absent_error):
+        """
+        Одна отметка рецепта тем же путем, что и пачка (см. recipes.marks):
+        повторное добавление или удаление отсутствующей отметки — 400.
+        """
+        recipe = self.get_object()
         if request.method == 'POST':
-            favorite, created = Favorite.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
-            )
-            if not created:
+            if not add(request.user, [recipe.id]):
                 return Response(
-                    {'errors': 'Рецепт уже добавлен в избранное'},
+                    {'errors': exists_error},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             serializer = RecipeMinifiedSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         # DELETE
-        try:
-            favorite = Favorite.objects.get(user=request.user, recipe=recipe)
-            favorite.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        except Favorite.DoesNotExist:
+        if not remove(request.user, [recipe.id]):
             return Response(
-                {'errors': 'Рецепт не был добавлен в избранное'},
+                {'errors': absent_error},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
-        detail=True,
+        detail=False,
         methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-batch',
         permission_classes=[IsAuthenticated]
     )
-    def shopping_cart(self, request, pk=None):
-        """Добавление/удаление рецепта в корзину покупок."""
-        recipe = self.get_object()
+    @query_budget(8)
+    def favorite_batch(self, request):
+        """Добавление/удаление пачки рецептов в избранное."""
+        return self.batch_marks(request, add_favorites, remove_favorites)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    @query_budget(14)
+    def shopping_cart_batch(self, request):
+        """Добавление/удаление пачки рецептов в корзину покупок."""
+        return self.batch_marks(request, add_to_cart, remove_from_cart)
+
+    def batch_marks(self, request, add, remove):
+        """
+        Тело запроса {"recipes": [id, ...]}, ответ — статус каждого id:
+        added/exists при добавлении, removed/absent при удалении,
+        not_found для несуществующих рецептов.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
         if request.method == 'POST':
-            cart_item, created = ShoppingCart.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
+            results = apply_batch(add, request.user, recipe_ids, ADDED, EXISTS)
+        else:
+            results = apply_batch(
+                remove, request.user, recipe_ids, REMOVED, ABSENT
             )
-            if not created:
-                return Response(
-                    {'errors': 'Рецепт уже добавлен в корзину'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            serializer = RecipeMinifiedSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({'results': results})
 
-        # DELETE
-        try:
-            cart_item = ShoppingCart.objects.get(user=request.user, recipe=recipe)
-            cart_item.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        except ShoppingCart.DoesNotExist:
-            return Response(
-                {'errors': 'Рецепт не был добавлен в корзину'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    @action(detail=True, methods=['get'])
+    @query_budget(6)
+    def similar(self, request, pk=None):
+        """Рецепты с похожим набором ингредиентов (см. recipes.similarity)."""
+        recipe = self.get_object()
+        serializer = SimilarRecipeSerializer(
+            similar_recipes(recipe, settings.SIMILAR_RECIPES_LIMIT), many=True
+        )
+        return Response(serializer.data)
 
     @action(
         detail=True,
         methods=['get'],
         url_path='get-link'
     )
+    @query_budget(8)
     def get_link(self, request, pk=None):
         """Получение короткой ссылки на рецепт."""
         recipe = self.get_object()
@@ -199,41 +381,33 @@ class RecipeViewSet(ModelViewSet):
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[JSONRenderer, PlainTextRenderer, CSVRenderer]
     )
+    @query_budget(4)
     def download_shopping_cart(self, request):
-        """Скачивание списка покупок."""
-        # Используем related_name для доступа к объектам корзины пользователя
-        shopping_cart_recipes = request.user.shopping_cart.values_list('recipe', flat=True)
+        """Скачивание списка покупок в формате txt, csv или json."""
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': 'Поддерживаются форматы: txt, csv, json'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        if not shopping_cart_recipes:
+        if not request.user.shopping_cart.exists():
             return Response(
                 {'message': 'Корзина покупок пуста'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Собираем все ингредиенты с суммированием количества
-        ingredients_dict = {}
-        recipe_ingredients = RecipeIngredient.objects.filter(
-            recipe__in=shopping_cart_recipes
-        ).select_related('ingredient')
-
-        for recipe_ingredient in recipe_ingredients:
-            ingredient = recipe_ingredient.ingredient
-            key = f"{ingredient.name} ({ingredient.measurement_unit})"
-
-            if key in ingredients_dict:
-                ingredients_dict[key] += recipe_ingredient.amount
-            else:
-                ingredients_dict[key] = recipe_ingredient.amount
-
-        # Формируем текстовый файл
-        shopping_list = "Список покупок:\n\n"
-        for ingredient_info, amount in ingredients_dict.items():
-            shopping_list += f"• {ingredient_info} — {amount}\n"
-
-        response = HttpResponse(shopping_list, content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+        response = StreamingHttpResponse(
+            render(get_shopping_list(request.user)),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{file_format}"'
+        )
         return response
 
     def _generate_short_id(self):
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_subscription_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', '-created', 'author'], name='subscription_user_created_idx'),
+        ),
+    ]
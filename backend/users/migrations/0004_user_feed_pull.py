@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_subscription_subscription_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_pull',
+            field=models.BooleanField(default=False, help_text='Ставится, когда подписчиков больше FEED_PULL_THRESHOLD; рецепты такого автора не рассылаются по лентам.', verbose_name='Лента подписчиков читает рецепты автора напрямую'),
+        ),
+    ]
@@ -18,6 +18,12 @@ class User(AbstractUser):
     first_name = models.CharField('first name', max_length=150)
     last_name = models.CharField('last name', max_length=150)
     avatar = models.ImageField('Аватар', upload_to='users/avatars/', blank=True, null=True)
+    feed_pull = models.BooleanField(
+        'Лента подписчиков читает рецепты автора напрямую',
+        default=False,
+        help_text='Ставится, когда подписчиков больше FEED_PULL_THRESHOLD; '
+                  'рецепты такого автора не рассылаются по лентам.',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -50,6 +56,13 @@ class Subscription(models.Model):
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         ordering = ('-created',)
+        indexes = [
+            # Подписки пользователя по дате, author в ключе покрывает выборку
+            models.Index(
+                fields=['user', '-created', 'author'],
+                name='subscription_user_created_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'author'],
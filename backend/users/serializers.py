@@ -1,22 +1,27 @@
 from rest_framework import serializers
 
+from foodgram.profiling import ProfiledListSerializer, ProfiledSerializerMixin
 from foodgram.utils import Base64ImageField
 from users.models import Subscription, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор пользователя."""
 
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         model = User
+        list_serializer_class = ProfiledListSerializer
         fields = (
             'email', 'id', 'username', 'first_name',
             'last_name', 'is_subscribed', 'avatar'
         )
 
     def get_is_subscribed(self, obj):
+        # Флаг может быть заранее вычислен аннотацией queryset
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return request.user.subscriptions.filter(author=obj).exists()
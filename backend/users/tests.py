@@ -1,10 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from recipes.models import Subscription
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Recipe
+from users.models import Subscription
 
 User = get_user_model()
 
@@ -139,6 +142,95 @@ class UserAPITest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['username'], 'user2')
     
+    def test_subscriptions_cursor_pagination(self):
+        """Тест курсорной пагинации списка подписок"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        authors = [self.user2]
+        for index in range(3):
+            authors.append(User.objects.create_user(
+                username=f'author{index}',
+                email=f'author{index}@example.com',
+                first_name='Author',
+                last_name=str(index)
+            ))
+        for author in authors:
+            Subscription.objects.create(user=self.user1, author=author)
+
+        url = reverse('users-subscriptions')
+        usernames = []
+        response = self.client.get(url, {'pagination': 'cursor', 'limit': 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            usernames.extend(item['username'] for item in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(
+            usernames,
+            [author.username for author in reversed(authors)]
+        )
+
+    def create_authors_with_recipes(self, count, recipes_per_author=3):
+        """Создает авторов с рецептами и подписывает на них user1"""
+        for index in range(count):
+            author = User.objects.create_user(
+                username=f'chef{index}',
+                email=f'chef{index}@example.com',
+                first_name='Chef',
+                last_name=str(index)
+            )
+            for number in range(recipes_per_author):
+                Recipe.objects.create(
+                    name=f'Рецепт {index}-{number}',
+                    text='Описание рецепта',
+                    cooking_time=10,
+                    author=author
+                )
+            Subscription.objects.create(user=self.user1, author=author)
+
+    def count_subscriptions_queries(self, limit):
+        """Возвращает число запросов для страницы подписок"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('users-subscriptions'),
+                {'limit': limit, 'recipes_limit': 2}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def test_subscriptions_query_count_is_constant(self):
+        """Тест постоянного числа запросов для страницы подписок"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.create_authors_with_recipes(5)
+
+        self.assertEqual(
+            self.count_subscriptions_queries(2),
+            self.count_subscriptions_queries(5)
+        )
+
+    def test_subscriptions_recipes_limit(self):
+        """Тест ограничения рецептов и подсчета их количества"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.create_authors_with_recipes(2)
+
+        response = self.client.get(
+            reverse('users-subscriptions'), {'recipes_limit': 2}
+        )
+        for author in response.data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], 3)
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']],
+                list(
+                    Recipe.objects.filter(author_id=author['id'])
+                    .order_by('-created', '-id')
+                    .values_list('id', flat=True)[:2]
+                )
+            )
+
     def test_self_subscription_forbidden(self):
         """Тест запрета подписки на самого себя"""
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
@@ -159,6 +251,83 @@ class UserAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+@override_settings(QUERY_BUDGET_MODE='raise')
+class UserQueryBudgetTest(APITestCase):
+    """Тесты бюджетов SQL-запросов эндпоинтов пользователей"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            email='reader@example.com',
+            first_name='Reader',
+            last_name='User',
+            password='testpass123'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.authors = []
+        for index in range(8):
+            author = User.objects.create_user(
+                username=f'chef{index}',
+                email=f'chef{index}@example.com',
+                first_name='Chef',
+                last_name=str(index)
+            )
+            for number in range(3):
+                Recipe.objects.create(
+                    name=f'Рецепт {index}-{number}',
+                    text='Описание рецепта',
+                    cooking_time=10,
+                    author=author
+                )
+            self.authors.append(author)
+        for author in self.authors[:6]:
+            Subscription.objects.create(user=self.user, author=author)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_read_endpoints_within_budget(self):
+        """Списки пользователей и подписок укладываются в бюджет"""
+        requests = [
+            (reverse('users-list'), {'limit': 10}),
+            (reverse('users-detail', args=[self.authors[0].id]), None),
+            (reverse('users-me'), None),
+            (reverse('users-subscriptions'), {'limit': 6, 'recipes_limit': 2}),
+            (reverse('users-subscriptions'), {'pagination': 'cursor', 'limit': 6}),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse('users-list'), {'limit': 10})
+        flags = {item['id']: item['is_subscribed'] for item in response.data['results']}
+        self.assertTrue(flags[self.authors[0].id])
+        self.assertFalse(flags[self.authors[7].id])
+
+    def test_write_endpoints_within_budget(self):
+        """Подписка, регистрация и смена пароля укладываются в бюджет"""
+        url = reverse('users-subscribe', args=[self.authors[7].id])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.post(reverse('users-set-password'), {
+            'current_password': 'testpass123',
+            'new_password': 'newpass12345'
+        })
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.client.credentials()
+        response = self.client.post(reverse('users-list'), {
+            'username': 'newuser',
+            'email': 'newuser@example.com',
+            'first_name': 'New',
+            'last_name': 'User',
+            'password': 'newpass123'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
 class SubscriptionModelTest(TestCase):
     """Тесты модели Subscription"""
     
@@ -1,3 +1,8 @@
+from django.db import transaction
+from django.db.models import (
+    Count, Exists, F, IntegerField, OuterRef, Subquery, Window
+)
+from django.db.models.functions import Coalesce, RowNumber
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import action
@@ -5,6 +10,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from djoser.views import UserViewSet as DjoserUserViewSet
 
+from foodgram.pagination import OptionalKeysetPagination
+from foodgram.query_budget import query_budget
+from recipes.feed import subscribed, unsubscribed
+from recipes.models import Recipe
 from recipes.serializers import UserWithRecipesSerializer
 from .models import User, Subscription
 from .serializers import SetAvatarSerializer, SetPasswordSerializer
@@ -13,6 +22,25 @@ from .serializers import SetAvatarSerializer, SetPasswordSerializer
 class UserViewSet(DjoserUserViewSet):
     """ViewSet для работы с пользователями."""
 
+    query_budgets = {
+        'list': 4,
+        'retrieve': 4,
+        'me': 4,
+        'create': 6,
+    }
+    # Остальные действия djoser: смена пароля, активация и т.п.
+    default_query_budget = 10
+
+    def get_queryset(self):
+        """Флаг подписки вычисляется в том же запросе, что и список."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
     def get_permissions(self):
         """Получение прав для действий."""
         if self.action == 'list' or self.action == 'retrieve':
@@ -24,6 +52,8 @@ class UserViewSet(DjoserUserViewSet):
         methods=['post', 'delete'],
         permission_classes=[IsAuthenticated]
     )
+    # Подписка заполняет ленту: число подписчиков, рецепты автора, вставка
+    @query_budget(14)
     def subscribe(self, request, id=None):
         """Подписка/отписка от автора."""
         author = get_object_or_404(User, id=id)
@@ -35,10 +65,13 @@ class UserViewSet(DjoserUserViewSet):
             )
 
         if request.method == 'POST':
-            subscription, created = Subscription.objects.get_or_create(
-                user=request.user,
-                author=author
-            )
+            with transaction.atomic():
+                subscription, created = Subscription.objects.get_or_create(
+                    user=request.user,
+                    author=author
+                )
+                if created:
+                    subscribed(request.user, author)
             if not created:
                 return Response(
                     {'errors': 'Вы уже подписаны на этого автора'},
@@ -53,11 +86,13 @@ class UserViewSet(DjoserUserViewSet):
 
         # DELETE
         try:
-            subscription = Subscription.objects.get(
-                user=request.user,
-                author=author
-            )
-            subscription.delete()
+            with transaction.atomic():
+                subscription = Subscription.objects.get(
+                    user=request.user,
+                    author=author
+                )
+                subscription.delete()
+                unsubscribed(request.user, author)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Subscription.DoesNotExist:
             return Response(
@@ -68,36 +103,88 @@ class UserViewSet(DjoserUserViewSet):
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        pagination_class=OptionalKeysetPagination
     )
+    @query_budget(5)
     def subscriptions(self, request):
         """Список подписок пользователя."""
-        subscriptions = request.user.subscriptions.select_related('author')
-
-        authors = [subscription.author for subscription in subscriptions]
-        page = self.paginate_queryset(authors)
-
-        if page is not None:
-            serializer = UserWithRecipesSerializer(
-                page,
-                many=True,
-                context={'request': request}
+        recipes_count = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by().values('author').annotate(count=Count('id')).values('count')
+        subscriptions = request.user.subscriptions.select_related(
+            'author'
+        ).annotate(
+            recipes_count=Coalesce(
+                Subquery(recipes_count, output_field=IntegerField()), 0
             )
-            return self.get_paginated_response(serializer.data)
+        )
 
+        # Пагинируем сами подписки, чтобы курсор строился по (created, id)
+        page = self.paginate_queryset(subscriptions)
+        authors = self.get_subscribed_authors(
+            subscriptions if page is None else page
+        )
         serializer = UserWithRecipesSerializer(
             authors,
             many=True,
             context={'request': request}
         )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
         return Response(serializer.data)
 
+    def get_subscribed_authors(self, subscriptions):
+        """
+        Возвращает авторов из подписок с заранее вычисленными полями
+        для UserWithRecipesSerializer.
+
+        Первые recipes_limit рецептов всех авторов страницы загружаются
+        одним запросом с ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        authors = []
+        for subscription in subscriptions:
+            author = subscription.author
+            author.is_subscribed = True
+            author.recipes_count = subscription.recipes_count
+            author.limited_recipes = []
+            authors.append(author)
+        if not authors:
+            return authors
+
+        recipes = Recipe.objects.filter(
+            author_id__in=[author.id for author in authors]
+        ).only('id', 'name', 'image', 'cooking_time', 'author_id')
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit is not None:
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=(F('created').desc(), F('id').desc())
+                )
+            ).filter(row_number__lte=recipes_limit)
+
+        authors_by_id = {author.id: author for author in authors}
+        for recipe in recipes.order_by('author_id', '-created', '-id'):
+            authors_by_id[recipe.author_id].limited_recipes.append(recipe)
+        return authors
+
+    def get_recipes_limit(self):
+        """Значение параметра recipes_limit или None, если он не задан."""
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit >= 0 else None
+
     @action(
         detail=False,
         methods=['put', 'delete'],
         permission_classes=[IsAuthenticated],
         url_path='me/avatar'
     )
+    @query_budget(4)
     def avatar(self, request):
         """Установка/удаление аватара."""
         user = request.user
@@ -125,6 +212,7 @@ class UserViewSet(DjoserUserViewSet):
         permission_classes=[IsAuthenticated],
         url_path='set_password'
     )
+    @query_budget(4)
     def set_password(self, request):
         """Смена пароля пользователя."""
         serializer = SetPasswordSerializer(